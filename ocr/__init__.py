@@ -0,0 +1,42 @@
+# ocr/__init__.py
+"""
+图像文字识别包：核心流程（预处理、版面分析、识别、导出）与图形界面分开，
+
+    from ocr import pipeline
+    text = pipeline.process_file("scan.jpg")
+
+    python -m ocr.main                  # 图形界面
+    python -m ocr.batch 图片目录 -o 输出目录
+
+导入本包和核心模块不会导入 PyQt5，也不会导入 pytesseract / tesserocr / PyMuPDF，
+这些在第一次识别或读取 PDF 时才加载。下面几个常用函数可以直接从包中取得，
+第一次访问时才导入 pipeline。
+"""
+import importlib
+
+_EXPORTS = {
+    "process_file": "pipeline",
+    "process_array": "pipeline",
+    "analyze_array": "pipeline",
+    "iter_document": "pipeline",
+    "preprocess_image_from_array": "preprocessor",
+    "preprocess_batch": "preprocessor",
+    "classify_page": "preprocessor",
+    "PageSkipped": "preprocessor",
+    "run_ocr": "ocr",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,377 @@
+# batch.py
+"""
+无界面批量OCR：
+    python -m ocr.batch 图片目录 -o 输出目录 -j 8
+    python -m ocr.batch "scans/*.jpg" --jsonl results.jsonl
+    python -m ocr.batch @file_list.txt --jsonl results.jsonl
+    python -m ocr.batch 图片目录 -o 输出目录 --format hocr   # 输出带坐标的 hOCR / ALTO / JSON
+
+PDF 和多页 TIFF 按页拆分成独立任务，每页一条结果（带页码）。
+中途崩溃后用同样的参数重新运行即可续跑，已完成的图像/页会被跳过。
+"""
+import argparse
+import contextlib
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+from . import pipeline
+from . import ocr
+from . import preprocessor
+from . import ingest
+from . import cache as result_cache
+from . import instrument
+from . import document
+from . import fingerprint
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp") + ingest.DOCUMENT_EXTS
+
+
+def collect_inputs(sources, recursive=False):
+    """
+    展开输入：目录、通配符、文件路径，或 @列表文件（每行一个路径）
+    :return: [(图像路径, 输出用相对名), ...]，已去重并排序
+    """
+    items = {}
+    for source in sources:
+        if source.startswith("@"):
+            with open(source[1:], encoding="utf-8") as f:
+                paths = [line.strip() for line in f if line.strip()]
+            for path in paths:
+                items.setdefault(os.path.abspath(path), os.path.basename(path))
+        elif os.path.isdir(source):
+            if recursive:
+                walker = os.walk(source)
+            else:
+                walker = [(source, [], os.listdir(source))]
+            for root, _, names in walker:
+                for name in names:
+                    if not name.lower().endswith(IMAGE_EXTS):
+                        continue
+                    path = os.path.join(root, name)
+                    items.setdefault(os.path.abspath(path), os.path.relpath(path, source))
+        elif glob.has_magic(source):
+            for path in glob.glob(source, recursive=recursive):
+                if os.path.isfile(path):
+                    items.setdefault(os.path.abspath(path), os.path.basename(path))
+        else:
+            items.setdefault(os.path.abspath(source), os.path.basename(source))
+    return sorted(items.items())
+
+
+def output_path_for(output_dir, rel_name, page=None, fmt="txt"):
+    """
+    输出文件路径：保留相对目录结构，扩展名按输出格式改为 .txt/.json/.hocr/.xml
+    多页文档每页一个文件：name_page0001.txt
+    """
+    stem = os.path.splitext(rel_name)[0]
+    if page is not None:
+        stem += f"_page{page:04d}"
+    return os.path.join(output_dir, stem + document.FORMAT_EXTS[fmt])
+
+
+def expand_pages(items):
+    """
+    将多页文档展开为按页的任务，普通图片页码为 None
+    :return: 任务列表 [(路径, 相对名, 页码), ...] 和无法读取页数的文档 [(路径, 错误), ...]
+    """
+    tasks, failed = [], []
+    for path, rel_name in items:
+        if not ingest.is_document(path):
+            tasks.append((path, rel_name, None))
+            continue
+        try:
+            count = ingest.page_count(path)
+        except Exception as e:
+            failed.append((path, str(e)))
+            continue
+        tasks.extend((path, rel_name, page) for page in range(1, count + 1))
+    return tasks, failed
+
+
+def load_done_jsonl(jsonl_path):
+    """
+    读取已有的 JSONL 结果，返回已成功处理的 (路径, 页码) 集合
+    崩溃时可能留下写了一半的最后一行，这里将其截掉，保证续写后文件仍然合法
+    """
+    done = set()
+    if not os.path.exists(jsonl_path):
+        return done
+
+    with open(jsonl_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok":
+            done.add((record["path"], record.get("page")))
+    return done
+
+
+def pending_tasks(tasks, output_dir=None, jsonl_path=None, fmt="txt"):
+    """
+    续跑：去掉之前已成功处理的页（JSONL 中有成功记录、输出文件已存在）
+    :param tasks: expand_pages 返回的任务列表
+    :return: 尚未完成的任务列表
+    """
+    done_jsonl = load_done_jsonl(jsonl_path) if jsonl_path else set()
+
+    def is_done(path, rel_name, page):
+        if jsonl_path and (path, page) not in done_jsonl:
+            return False
+        if output_dir and not os.path.exists(output_path_for(output_dir, rel_name, page, fmt)):
+            return False
+        return True
+
+    return [task for task in tasks if not is_done(*task)]
+
+
+# 每个工作进程各自的缓存和指纹索引实例，磁盘上的数据在进程间共享
+_worker_cache = None
+_worker_index = None
+
+
+def _init_worker(cache_dir=None, log_level=None, index_dir=None):
+    global _worker_cache, _worker_index
+    # 进程池已经占满所有核心，避免 OpenCV 内部再开线程造成过度订阅
+    cv2.setNumThreads(1)
+    if log_level is not None:
+        # spawn 方式启动的子进程不会继承主进程的日志配置
+        logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    if cache_dir:
+        _worker_cache = result_cache.ResultCache(cache_dir=cache_dir)
+    if index_dir:
+        _worker_index = fingerprint.BlockIndex(index_dir)
+
+
+def process_one(path, page, options, profile=False, structured=False, doc_id=None):
+    """
+    子进程中处理单张图像或文档的一页，返回可序列化的结果记录
+    :param page: 文档页码（从1开始），普通图片为 None
+    :param options: 传给 pipeline.process_array 的参数
+    :param profile: 记录各阶段耗时和内存峰值，放入结果的 "profile" 字段
+    :param structured: 同时输出带坐标和置信度的页结构，放入结果的 "document" 字段
+    :param doc_id: 文档标识，启用指纹索引时只识别与上一版本相比有变化的文本块
+    """
+    start = time.perf_counter()
+    record = {"path": path}
+    if page is not None:
+        record["page"] = page
+    name = path if page is None else f"{path}#{page}"
+    with instrument.profile(name, track_memory=True) if profile else contextlib.nullcontext() as prof:
+        try:
+            with instrument.stage("read"):
+                if page is None:
+                    img = preprocessor.read_image(path)
+                else:
+                    img = ingest.read_page(path, page - 1)
+            if structured:
+                _, page_data = pipeline.analyze_array(img, cache=_worker_cache, index=_worker_index,
+                                                      doc_id=doc_id, **options)
+                texts = [block["text"] for block in page_data["blocks"]]
+            else:
+                _, texts = pipeline.process_array(img, cache=_worker_cache, index=_worker_index,
+                                                  doc_id=doc_id, **options)
+        except preprocessor.PageSkipped as e:
+            # 空白/非文本页面：按没有文字的成功结果记录，续跑时不再重复判断
+            record.update(status="ok", blocks=[], page_skipped=e.reason)
+            if structured:
+                record["document"] = document.build_page([], img.shape[1], img.shape[0])
+        except Exception as e:
+            record.update(status="error", error=str(e))
+        else:
+            record.update(status="ok", blocks=texts)
+            if structured:
+                record["document"] = page_data
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    if prof is not None:
+        record["profile"] = prof.to_dict()
+    return record
+
+
+def _write_text_atomic(file_path, text):
+    # 先写临时文件再改名，崩溃时不会留下被误认为已完成的半截结果
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_path = file_path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+
+def run_batch(sources, output_dir=None, jsonl_path=None, workers=None,
+              lang="chi_sim+eng", resume=True, recursive=False, block_workers=1,
+              engine="auto", cache_dir=None, denoise="nlm", metrics_path=None, fmt="txt",
+              psm=3, revisions_dir=None, tile=None, reuse_buffers=False,
+              skip_non_text=False):
+    """
+    批量处理图像
+    :param sources: 目录、通配符、文件路径或 @列表文件 组成的列表
+    :param output_dir: 每张图像（多页文档每页）输出一个 .txt 到该目录
+    :param jsonl_path: 所有结果以 JSONL 流写入该文件
+    :param workers: 进程数，默认使用全部核心
+    :param block_workers: 每张图像内并发识别的文本块数，进程池已占满核心时保持 1 即可
+    :param engine: OCR 引擎，见 engines.get_engine；tesserocr 会在每个进程内常驻
+    :param denoise: 去噪方式，见 preprocessor.denoise_before
+    :param cache_dir: 结果缓存目录，重复提交的相同图像直接复用结果
+    :param resume: 跳过之前已成功处理的图像
+    :param metrics_path: 统计各阶段耗时/内存并写入该文件（.prom/.txt 为 Prometheus 文本格式，其他为 JSON）
+    :param fmt: output_dir 中的输出格式，见 document.FORMATS；非 txt 时 JSONL 记录带 "document" 字段
+    :param psm: tesseract --psm，"auto" 按每个文本块的形状选择，见 ocr.choose_psm
+    :param revisions_dir: 文本块指纹索引目录；同一相对路径的文档再次处理时，只识别有变化的文本块
+    :param tile: 超大图像按该边长分块处理，峰值内存与分块大小相关，见 tiling.py
+    :param reuse_buffers: 预处理的中间结果写入每个工作进程常驻的缓冲区，见 preprocessor.BufferPool
+    :param skip_non_text: 空白页、照片、条码等非文本页面不做预处理和识别，输出为空，
+                          记录带 "page_skipped" 字段，见 preprocessor.classify_page
+    :return: 统计信息字典
+    """
+    if output_dir is None and jsonl_path is None:
+        raise ValueError("需要指定 output_dir 或 jsonl_path")
+
+    tasks, failed = expand_pages(collect_inputs(sources, recursive=recursive))
+    todo = pending_tasks(tasks, output_dir, jsonl_path, fmt) if resume else tasks
+    stats = {"total": len(tasks) + len(failed), "skipped": len(tasks) - len(todo),
+             "ok": 0, "error": 0, "no_text": 0}
+    logger.info("%d pages, %d already done", stats["total"], stats["skipped"])
+    registry = instrument.MetricsRegistry() if metrics_path else None
+
+    if jsonl_path:
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+    jsonl_file = open(jsonl_path, "a" if resume else "w", encoding="utf-8") if jsonl_path else None
+
+    def emit(record, rel_name=None):
+        stats[record["status"]] += 1
+        if "page_skipped" in record:
+            stats["no_text"] += 1
+        if record["status"] == "ok":
+            if output_dir:
+                out_path = output_path_for(output_dir, rel_name, record.get("page"), fmt)
+                if fmt == "txt":
+                    text = "\n\n".join(record["blocks"])
+                else:
+                    text = document.export(record["document"], fmt, os.path.basename(record["path"]))
+                _write_text_atomic(out_path, text)
+        else:
+            logger.error("%s: %s", record["path"], record["error"])
+        if registry is not None and "profile" in record:
+            registry.add(record["profile"])
+        if jsonl_file:
+            jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            jsonl_file.flush()
+
+    for path, error in failed:
+        emit({"path": path, "status": "error", "error": error, "seconds": 0.0})
+    if not todo:
+        if jsonl_file:
+            jsonl_file.close()
+        if registry is not None:
+            registry.write(metrics_path)
+        return stats
+
+    options = {"lang": lang, "max_workers": block_workers, "engine": engine, "denoise": denoise,
+               "psm": psm, "tile": tile, "buffers": reuse_buffers,
+               "skip_non_text": skip_non_text}
+    workers = workers or os.cpu_count() or 1
+    rel_names = {(path, page): rel for path, rel, page in todo}
+    pending_items = iter(todo)
+    # 限制同时在途的任务数，十万级输入时不会一次性创建全部 future
+    max_in_flight = workers * 4
+    in_flight = set()
+    finished = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(cache_dir, logging.getLogger().level,
+                                           revisions_dir)) as executor:
+            while True:
+                while len(in_flight) < max_in_flight:
+                    item = next(pending_items, None)
+                    if item is None:
+                        break
+                    path, rel_name, page = item
+                    doc_id = rel_name if page is None else f"{rel_name}#{page}"
+                    in_flight.add(executor.submit(process_one, path, page, options,
+                                                   registry is not None, fmt != "txt", doc_id))
+                if not in_flight:
+                    break
+
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    record = future.result()
+                    finished += 1
+                    page = record.get("page")
+                    emit(record, rel_names[(record["path"], page)])
+                    where = record["path"] if page is None else f"{record['path']}#{page}"
+                    logger.info("%d/%d %s (%ss)", finished, len(todo), where, record["seconds"])
+    finally:
+        if jsonl_file:
+            jsonl_file.close()
+        if registry is not None:
+            registry.write(metrics_path)
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量OCR识别（无界面）")
+    parser.add_argument("inputs", nargs="+", help="图像目录、通配符、文件路径或 @列表文件")
+    parser.add_argument("-o", "--output-dir", help="每张图像输出一个 .txt 文件到该目录")
+    parser.add_argument("--jsonl", help="将结果以 JSONL 流写入该文件")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="并行进程数，默认全部核心")
+    parser.add_argument("--lang", default="chi_sim+eng", help="tesseract 语言；auto 按文本块自动选择 eng/chi_sim，auto:osd 用 tesseract OSD 判断整页")
+    parser.add_argument("--psm", type=ocr.parse_psm, default=3,
+                        help="tesseract --psm；auto 按每个文本块的形状选择（单栏/单行/单词/稀疏文本）")
+    parser.add_argument("--block-workers", type=int, default=1, help="每张图像内并发识别的文本块数")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"],
+                        help="OCR 引擎，auto 优先使用 tesserocr")
+    parser.add_argument("--denoise", default="nlm", choices=preprocessor.DENOISE_METHODS,
+                        help="去噪方式，大图可用 nlm_downscaled 或 auto")
+    parser.add_argument("--cache-dir", help="结果缓存目录")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="超大图像（A0 图纸、长收据等）按该边长分块处理，如 2048")
+    parser.add_argument("--reuse-buffers", action="store_true",
+                        help="预处理的中间结果写入每个进程常驻的缓冲区，降低每页的内存峰值和分配次数")
+    parser.add_argument("--skip-non-text", action="store_true",
+                        help="先在缩略图上判断页面，空白隔页、照片、条码等不做预处理和识别，输出为空")
+    parser.add_argument("--revisions", help="文本块指纹索引目录：重新扫描的修订版文档只识别有变化的文本块（按相对路径对应）")
+    parser.add_argument("--format", default="txt", choices=document.FORMATS,
+                        help="-o 输出格式：txt，或带词坐标和置信度的 json / hocr / alto")
+    parser.add_argument("--metrics", help="统计各阶段耗时/内存并写入该文件（.prom 为 Prometheus 文本格式，其他为 JSON）")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试日志")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归扫描子目录")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有结果，全部重新处理")
+    args = parser.parse_args(argv)
+
+    if not args.output_dir and not args.jsonl:
+        parser.error("需要指定 --output-dir 或 --jsonl")
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format=LOG_FORMAT)
+
+    stats = run_batch(args.inputs, output_dir=args.output_dir, jsonl_path=args.jsonl,
+                      workers=args.workers, lang=args.lang,
+                      resume=not args.no_resume, recursive=args.recursive,
+                      block_workers=args.block_workers, engine=args.engine,
+                      cache_dir=args.cache_dir, denoise=args.denoise,
+                      metrics_path=args.metrics, fmt=args.format, psm=args.psm,
+                      revisions_dir=args.revisions, tile=args.tile,
+                      reuse_buffers=args.reuse_buffers, skip_non_text=args.skip_non_text)
+    logger.info("done: %s", stats)
+    return 0 if stats["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
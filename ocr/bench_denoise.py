@@ -0,0 +1,110 @@
+# bench_denoise.py
+"""
+比较各去噪方式的耗时和对结果的影响：
+    python -m ocr.bench_denoise                       # 使用 test_picture 下的图像
+    python -m ocr.bench_denoise --upscale 3           # 放大到接近 300dpi A4 的尺寸再测
+    python -m ocr.bench_denoise --ocr --json out.json # 同时比较OCR文本（需要安装 tesseract）
+
+以 nlm（原有方式）为基准：
+    pixel_agree  去噪后直接二值化（不旋转）与基准逐像素一致的比例
+    text_ratio   OCR 文本与基准文本的相似度（difflib）
+"""
+import argparse
+import difflib
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from . import preprocessor
+from . import ocr
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_gray(path, upscale=1.0):
+    img = preprocessor.read_image(path)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if upscale != 1.0:
+        gray = cv2.resize(gray, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+    if np.mean(gray) < 127:
+        gray = cv2.bitwise_not(gray)
+    return gray
+
+
+def best_time(func, repeat):
+    """多次运行取最短时间，返回 (秒, 最后一次的结果)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_image(path, methods, upscale=1.0, repeat=3, run_text=False):
+    gray = load_gray(path, upscale)
+    rows = []
+    baseline_binary = None
+    baseline_text = None
+    for method in methods:
+        denoise_s, denoised = best_time(
+            lambda: preprocessor.denoise_before(gray, method=method), repeat)
+        # 不经过旋转直接二值化，只比较去噪本身带来的差异
+        binary = preprocessor.after_rotation(denoised)
+        row = {
+            "image": os.path.basename(path),
+            "size": f"{gray.shape[1]}x{gray.shape[0]}",
+            "method": method,
+            "denoise_ms": round(denoise_s * 1000, 1),
+            "noise_sigma": round(preprocessor.estimate_noise(gray), 2),
+        }
+        if baseline_binary is None:
+            baseline_binary = binary
+        row["pixel_agree"] = round(float(np.mean(binary == baseline_binary)), 4)
+
+        if run_text:
+            final = preprocessor.after_rotation(preprocessor.do_rotation(denoised))
+            text = "\n".join(ocr.run_ocr(final))
+            if baseline_text is None:
+                baseline_text = text
+            row["text_ratio"] = round(difflib.SequenceMatcher(None, baseline_text, text).ratio(), 4)
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="去噪方式耗时/效果对比")
+    parser.add_argument("images", nargs="*", help="测试图像，默认 test_picture 下全部图像")
+    parser.add_argument("--methods", nargs="+",
+                        default=["nlm", "nlm_downscaled", "bilateral", "median", "auto"],
+                        help="参与比较的去噪方式，第一个作为基准")
+    parser.add_argument("--upscale", type=float, default=1.0, help="测试前放大图像的倍数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式重复次数，取最短时间")
+    parser.add_argument("--ocr", action="store_true", help="同时运行OCR并比较文本")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    images = args.images or sorted(glob.glob(os.path.join(HERE, "test_picture", "*")))
+    rows = []
+    for path in images:
+        rows.extend(bench_image(path, args.methods, args.upscale, args.repeat, args.ocr))
+
+    columns = ["image", "size", "method", "denoise_ms", "noise_sigma", "pixel_agree"]
+    if args.ocr:
+        columns.append("text_ratio")
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join(str(row.get(c)) for c in columns))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
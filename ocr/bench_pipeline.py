@@ -0,0 +1,301 @@
+# bench_pipeline.py
+"""
+预处理 + OCR 流程的可复现基准测试，使用合成页面（已知文本）：
+    python -m ocr.bench_pipeline --json base.json                   # 默认场景，结果写入 JSON
+    python -m ocr.bench_pipeline --json new.json --compare base.json # 与之前的结果对比
+    python -m ocr.bench_pipeline --dpi 300 --skew 0 2 --noise 0 15 --columns 1 2
+    python -m ocr.bench_pipeline --no-ocr                           # 只测预处理和版面检测
+
+合成页面按 DPI、倾斜角、噪声强度、分栏数的组合生成，同一 --seed 下完全一致。
+    stages       每个阶段单独运行（输入为上一阶段的输出）的耗时 p50/p95
+    end_to_end   pipeline.process_array 整体耗时 p50/p95 和吞吐量（页/秒）
+    accuracy     识别文本与真实文本的字符准确率（去掉空白后按 difflib 匹配的字符数 / 真实字符数）
+    peak_rss     进程的最大常驻内存（Windows 上没有 resource 模块，为 null）
+"""
+import argparse
+import datetime
+import difflib
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+from . import preprocessor
+from . import ocr
+from . import pipeline
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORDS = ("the quick brown fox jumps over lazy dog page text layout column line block "
+         "image noise skew scan print paper number 2024 17 305 alpha beta gamma delta "
+         "report figure table value result method sample data model test order").split()
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+A4_INCHES = (8.27, 11.69)
+
+
+# ---------- 合成页面 ----------
+
+def render_page(dpi=300, skew=0.0, noise=0.0, columns=1, seed=0):
+    """
+    生成一张 A4 合成页面
+    :param skew: 倾斜角（度）
+    :param noise: 高斯噪声的标准差（灰度级）
+    :return: (BGR 图像, 真实文本)
+    """
+    rng = random.Random(f"{seed}-{dpi}-{columns}")
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    page = np.full((height, width), 255, dtype=np.uint8)
+
+    # 约 12pt 的字号：Hershey 字体 scale=1 时大写字母高约 22 像素
+    scale = dpi / 72 * 12 * 0.7 / 22
+    thickness = max(1, round(scale * 2))
+    (_, text_h), _ = cv2.getTextSize("Ag", FONT, scale, thickness)
+    line_h = int(text_h * 2.2)
+    margin = int(width * 0.08)
+    gap = int(width * 0.06)
+    col_w = (width - 2 * margin - gap * (columns - 1)) // columns
+
+    lines_per_col = (height - 2 * margin) // line_h
+    truth = []
+    for col in range(columns):
+        x0 = margin + col * (col_w + gap)
+        for row in range(lines_per_col):
+            words = []
+            while True:
+                candidate = " ".join(words + [rng.choice(WORDS)])
+                if words and cv2.getTextSize(candidate, FONT, scale, thickness)[0][0] > col_w:
+                    break
+                words = candidate.split(" ")
+            line = " ".join(words)
+            y = margin + (row + 1) * line_h
+            cv2.putText(page, line, (x0, y), FONT, scale, 0, thickness, cv2.LINE_AA)
+            truth.append(line)
+
+    if skew:
+        center = (width / 2, height / 2)
+        matrix = cv2.getRotationMatrix2D(center, skew, 1.0)
+        page = cv2.warpAffine(page, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderValue=255)
+    if noise:
+        noise_rng = np.random.default_rng(seed)
+        noisy = page.astype(np.float32) + noise_rng.normal(0, noise, page.shape)
+        page = np.clip(noisy, 0, 255).astype(np.uint8)
+
+    return cv2.cvtColor(page, cv2.COLOR_GRAY2BGR), "\n".join(truth)
+
+
+def char_accuracy(truth, text):
+    """去掉空白后，匹配上的字符数 / 真实文本字符数"""
+    truth = re.sub(r"\s+", "", truth)
+    text = re.sub(r"\s+", "", text)
+    if not truth:
+        return 1.0 if not text else 0.0
+    matcher = difflib.SequenceMatcher(None, truth, text, autojunk=False)
+    matched = sum(block.size for block in matcher.get_matching_blocks())
+    return matched / len(truth)
+
+
+# ---------- 计时 ----------
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_stages(img, ocr_options):
+    """各阶段单独计时，返回 ({阶段: 秒}, 识别文本或 None)"""
+    seconds = {}
+    seconds["gray"], gray = timed(cv2.cvtColor, img, cv2.COLOR_BGR2GRAY)
+    seconds["scale"], (gray, _) = timed(preprocessor.normalize_scale, gray)
+    seconds["denoise"], denoised = timed(preprocessor.denoise_before, gray,
+                                         method=ocr_options["denoise"])
+    seconds["rotation"], rotated = timed(preprocessor.do_rotation, denoised)
+    seconds["threshold"], final = timed(preprocessor.after_rotation, rotated)
+    seconds["layout"], _ = timed(ocr.detect_layout, final)
+    texts = None
+    if ocr_options["run_ocr"]:
+        seconds["ocr"], texts = timed(ocr.run_ocr, final, lang=ocr_options["lang"],
+                                      max_workers=ocr_options["block_workers"],
+                                      engine=ocr_options["engine"])
+    return seconds, texts
+
+
+def run_end_to_end(img, ocr_options):
+    """整体计时，返回 (秒, 识别文本或 None)"""
+    if not ocr_options["run_ocr"]:
+        seconds, _ = timed(pipeline.preprocess, img, denoise=ocr_options["denoise"])
+        return seconds, None
+    seconds, (_, texts) = timed(pipeline.process_array, img, lang=ocr_options["lang"],
+                                max_workers=ocr_options["block_workers"],
+                                engine=ocr_options["engine"], denoise=ocr_options["denoise"])
+    return seconds, texts
+
+
+def summarize(samples):
+    arr = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(arr.mean()), 2),
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+    }
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, cwd=HERE, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip() or None
+
+
+# ---------- 主流程 ----------
+
+def run_benchmark(dpis, skews, noises, columns, repeat=1, seed=0, run_ocr=True,
+                  lang="eng", engine="auto", block_workers=1, denoise="nlm"):
+    ocr_options = {"run_ocr": run_ocr, "lang": lang, "engine": engine,
+                   "block_workers": block_workers, "denoise": denoise}
+    stage_samples = {}
+    e2e_samples = []
+    pages = []
+    for dpi, skew, noise, cols in itertools.product(dpis, skews, noises, columns):
+        img, truth = render_page(dpi, skew, noise, cols, seed)
+        row = {"dpi": dpi, "skew": skew, "noise": noise, "columns": cols,
+               "size": f"{img.shape[1]}x{img.shape[0]}"}
+
+        for _ in range(repeat):
+            seconds, _ = run_stages(img, ocr_options)
+            for name, value in seconds.items():
+                stage_samples.setdefault(name, []).append(value)
+
+        page_times = []
+        texts = None
+        for _ in range(repeat):
+            seconds, texts = run_end_to_end(img, ocr_options)
+            page_times.append(seconds)
+        e2e_samples.extend(page_times)
+        row["end_to_end_ms"] = round(min(page_times) * 1000, 1)
+        if texts is not None:
+            row["accuracy"] = round(char_accuracy(truth, "\n".join(texts)), 4)
+        pages.append(row)
+        print("\t".join(f"{k}={v}" for k, v in row.items()), flush=True)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "options": dict(ocr_options, dpis=dpis, skews=skews, noises=noises,
+                            columns=columns, repeat=repeat, seed=seed),
+        },
+        "stages": {name: summarize(values) for name, values in stage_samples.items()},
+        "end_to_end": summarize(e2e_samples),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "pages": pages,
+    }
+    result["end_to_end"]["pages_per_s"] = round(len(e2e_samples) / sum(e2e_samples), 3)
+    scores = [row["accuracy"] for row in pages if "accuracy" in row]
+    if scores:
+        result["accuracy"] = {"mean": round(float(np.mean(scores)), 4),
+                              "min": round(float(np.min(scores)), 4)}
+    return result
+
+
+def compare(base, current):
+    """对比两次结果，返回 [(指标, 基准, 当前, 变化百分比)]"""
+    rows = []
+
+    def add(name, old, new):
+        if old is None or new is None:
+            return
+        change = (new - old) / old * 100 if old else None
+        rows.append((name, old, new, None if change is None else round(change, 1)))
+
+    for key in ("p50_ms", "p95_ms", "pages_per_s"):
+        add(f"end_to_end.{key}", base["end_to_end"].get(key), current["end_to_end"].get(key))
+    for name in current["stages"]:
+        if name in base["stages"]:
+            for key in ("p50_ms", "p95_ms"):
+                add(f"{name}.{key}", base["stages"][name][key], current["stages"][name][key])
+    if "accuracy" in base and "accuracy" in current:
+        add("accuracy.mean", base["accuracy"]["mean"], current["accuracy"]["mean"])
+        add("accuracy.min", base["accuracy"]["min"], current["accuracy"]["min"])
+    add("peak_rss_bytes", base.get("peak_rss_bytes"), current.get("peak_rss_bytes"))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预处理 + OCR 流程基准测试（合成页面）")
+    parser.add_argument("--dpi", nargs="+", type=int, default=[150, 300], help="页面分辨率")
+    parser.add_argument("--skew", nargs="+", type=float, default=[0.0, 3.0], help="倾斜角（度）")
+    parser.add_argument("--noise", nargs="+", type=float, default=[0.0, 12.0],
+                        help="高斯噪声标准差")
+    parser.add_argument("--columns", nargs="+", type=int, default=[1, 2], help="分栏数")
+    parser.add_argument("--repeat", type=int, default=1, help="每页重复次数")
+    parser.add_argument("--seed", type=int, default=0, help="生成页面的随机种子")
+    parser.add_argument("--lang", default="eng", help="tesseract 语言（合成页面为英文）")
+    parser.add_argument("--engine", default="auto", help="OCR 引擎，见 engines.py")
+    parser.add_argument("--block-workers", type=int, default=1, help="每页内并发识别的文本块数")
+    parser.add_argument("--denoise", default="nlm", choices=preprocessor.DENOISE_METHODS,
+                        help="去噪方式")
+    parser.add_argument("--no-ocr", action="store_true", help="不运行OCR（不需要 tesseract）")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.dpi, args.skew, args.noise, args.columns, repeat=args.repeat,
+                           seed=args.seed, run_ocr=not args.no_ocr, lang=args.lang,
+                           engine=args.engine, block_workers=args.block_workers,
+                           denoise=args.denoise)
+
+    print()
+    print("stage\tcount\tmean_ms\tp50_ms\tp95_ms")
+    for name, entry in list(result["stages"].items()) + [("end_to_end", result["end_to_end"])]:
+        print(f"{name}\t{entry['count']}\t{entry['mean_ms']}\t{entry['p50_ms']}\t{entry['p95_ms']}")
+    print(f"pages/s: {result['end_to_end']['pages_per_s']}")
+    if "accuracy" in result:
+        print(f"accuracy: mean {result['accuracy']['mean']}, min {result['accuracy']['min']}")
+    if result["peak_rss_bytes"] is not None:
+        print(f"peak RSS: {result['peak_rss_bytes'] / 1e6:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+        print()
+        print(f"compare with {args.compare} (commit {base['meta'].get('commit')})")
+        print("metric\tbase\tcurrent\tchange%")
+        for name, old, new, change in compare(base, result):
+            print(f"{name}\t{old}\t{new}\t{change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# bench_startup.py
+"""
+冷启动基准：每次在新的解释器进程中导入入口模块，测量启动耗时以及导入了哪些重量级依赖
+    python -m ocr.bench_startup                          # 默认入口：包、pipeline、batch、server、watch、main
+    python -m ocr.bench_startup --repeat 10 --json startup.json
+    python -m ocr.bench_startup --first-ocr --gui        # 另测第一页识别完成、界面窗口显示的耗时
+    python -m ocr.bench_startup --importtime ocr.batch   # 列出 -X importtime 中累计耗时最多的模块
+
+    baseline     空解释器（python -c pass）的启动耗时，其余各项都包含这部分
+    wall         进程从启动到退出的总耗时 p50/p95
+    import       进程内 import 语句本身的耗时 p50
+    heavy        导入后已经加载的重量级依赖
+    first_ocr    导入 pipeline 并识别一张合成页面的耗时，second 为同一进程内第二次识别，
+                 两者之差主要是引擎初始化（需要安装 tesseract）
+    gui          导入界面、创建并显示主窗口的耗时（无显示器时使用 offscreen 平台）
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+ENTRY_MODULES = ("ocr", "ocr.pipeline", "ocr.batch", "ocr.server", "ocr.watch", "ocr.main")
+HEAVY_MODULES = ("PyQt5.QtWidgets", "cv2", "numpy", "pytesseract", "tesserocr", "pymupdf", "fitz")
+
+IMPORT_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+FIRST_OCR_CODE = """
+import json, sys, time
+start = time.perf_counter()
+from ocr import pipeline
+imported = time.perf_counter()
+import cv2
+import numpy as np
+img = np.full((400, 1200, 3), 255, dtype=np.uint8)
+for i, line in enumerate(("The quick brown fox", "jumps over the lazy dog")):
+    cv2.putText(img, line, (40, 120 + 140 * i), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 0, 0), 4)
+rendered = time.perf_counter()
+pipeline.process_array(img, lang={lang!r}, engine={engine!r})
+first = time.perf_counter()
+pipeline.process_array(img, lang={lang!r}, engine={engine!r})
+second = time.perf_counter()
+print(json.dumps({{"import": imported - start, "first_ocr": first - rendered,
+                  "second_ocr": second - first,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+GUI_CODE = """
+import json, sys, time
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+from ocr.main import OCRApp
+imported = time.perf_counter()
+app = QApplication(sys.argv)
+window = OCRApp()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+window.close()
+print(json.dumps({{"import": imported - start, "shown": shown - start, "heavy": heavy}}))
+"""
+
+
+def run_child(code, env=None):
+    """在新的解释器中运行代码，返回 (进程总耗时, 子进程输出的 JSON)"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        lines = proc.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit code {proc.returncode}")
+    lines = proc.stdout.decode().strip().splitlines()
+    return wall, json.loads(lines[-1]) if lines else {}
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))]
+    return {"p50_ms": round(statistics.median(ms), 1), "p95_ms": round(p95, 1)}
+
+
+def measure(code, repeat, env=None, keys=("import",)):
+    """重复运行 repeat 次，汇总总耗时和子进程报告的各项耗时"""
+    walls, values, heavy = [], {key: [] for key in keys}, []
+    for _ in range(repeat):
+        wall, report = run_child(code, env)
+        walls.append(wall)
+        for key in keys:
+            values[key].append(report[key])
+        heavy = report["heavy"]
+    entry = {"wall": summarize(walls), "heavy": heavy}
+    for key in keys:
+        entry[key] = summarize(values[key])
+    return entry
+
+
+def run_benchmark(modules=ENTRY_MODULES, repeat=5, first_ocr=False, gui=False,
+                  lang="eng", engine="auto"):
+    result = {"python": sys.version.split()[0], "repeat": repeat, "modules": {}}
+    result["baseline"] = summarize([run_child("pass")[0]
+                                    for _ in range(repeat)])
+    # 先运行一次，让各模块的 .pyc 写入缓存，之后的测量都是同样的条件
+    for module in modules:
+        try:
+            run_child(IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES))
+        except RuntimeError:
+            pass
+
+    for module in modules:
+        try:
+            result["modules"][module] = measure(
+                IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES), repeat)
+        except RuntimeError as e:
+            result["modules"][module] = {"error": str(e)}
+
+    if first_ocr:
+        code = FIRST_OCR_CODE.format(lang=lang, engine=engine, heavy=HEAVY_MODULES)
+        try:
+            result["first_ocr"] = measure(code, repeat, keys=("import", "first_ocr", "second_ocr"))
+        except RuntimeError as e:
+            result["first_ocr"] = {"error": str(e)}
+
+    if gui:
+        env = dict(os.environ)
+        if not env.get("DISPLAY") and sys.platform.startswith("linux"):
+            env["QT_QPA_PLATFORM"] = "offscreen"
+        code = GUI_CODE.format(heavy=HEAVY_MODULES)
+        try:
+            result["gui"] = measure(code, repeat, env=env, keys=("import", "shown"))
+        except RuntimeError as e:
+            result["gui"] = {"error": str(e)}
+    return result
+
+
+def import_profile(module, top=15):
+    """用 -X importtime 列出导入 module 时累计耗时最多的模块，返回 [(累计微秒, 自身微秒, 模块名), ...]"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    rows = []
+    for line in proc.stderr.decode(errors="replace").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def print_result(result):
+    print(f"python {result['python']}, repeat {result['repeat']}")
+    print(f"baseline\twall p50 {result['baseline']['p50_ms']} ms")
+    print()
+    print("module\twall_p50_ms\twall_p95_ms\timport_p50_ms\theavy")
+    for module, entry in result["modules"].items():
+        if "error" in entry:
+            print(f"{module}\terror: {entry['error']}")
+            continue
+        print(f"{module}\t{entry['wall']['p50_ms']}\t{entry['wall']['p95_ms']}\t"
+              f"{entry['import']['p50_ms']}\t{','.join(entry['heavy']) or '-'}")
+    for name, keys in (("first_ocr", ("import", "first_ocr", "second_ocr")),
+                       ("gui", ("import", "shown"))):
+        entry = result.get(name)
+        if entry is None:
+            continue
+        if "error" in entry:
+            print(f"{name}\terror: {entry['error']}")
+            continue
+        parts = [f"wall {entry['wall']['p50_ms']} ms"] + [f"{key} {entry[key]['p50_ms']} ms" for key in keys]
+        print(f"{name}\t" + ", ".join(parts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动耗时基准测试")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_MODULES), help="要测量的入口模块")
+    parser.add_argument("--repeat", type=int, default=5, help="每个入口启动的进程数")
+    parser.add_argument("--first-ocr", action="store_true", help="测量第一页识别完成的耗时（需要 tesseract）")
+    parser.add_argument("--gui", action="store_true", help="测量界面窗口显示的耗时（需要 PyQt5）")
+    parser.add_argument("--lang", default="eng", help="--first-ocr 使用的 tesseract 语言")
+    parser.add_argument("--engine", default="auto", help="--first-ocr 使用的 OCR 引擎，见 engines.py")
+    parser.add_argument("--importtime", metavar="MODULE", help="列出导入该模块时最慢的子模块后退出")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if args.importtime:
+        print("cumulative_ms\tself_ms\tmodule")
+        for cumulative, self_us, name in import_profile(args.importtime):
+            print(f"{cumulative / 1000:.1f}\t{self_us / 1000:.1f}\t{name}")
+        return
+
+    result = run_benchmark(args.modules, repeat=args.repeat, first_ocr=args.first_ocr,
+                           gui=args.gui, lang=args.lang, engine=args.engine)
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
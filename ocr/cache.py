@@ -0,0 +1,168 @@
+# cache.py
+"""
+按内容寻址的结果缓存：键为输入图像内容的哈希 + 流程参数
+    - 内存层：LRU，按条目数淘汰
+    - 磁盘层：每条一个 .npz 文件，总大小超过上限时按最近使用时间淘汰
+条目可以包含预处理后的图像 "image"、每块识别结果 "texts"，以及可 JSON 序列化的附加信息 "meta"
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def hash_array(img_array):
+    """图像内容哈希（包含形状和类型，避免不同尺寸的相同字节冲突）"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str((img_array.shape, img_array.dtype.str)).encode())
+    h.update(np.ascontiguousarray(img_array).data)
+    return h.hexdigest()
+
+
+def make_key(digest, **params):
+    """由输入哈希和流程参数生成缓存键"""
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b((digest + payload).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_items=32, cache_dir=None, max_disk_bytes=1 << 30):
+        """
+        :param max_items: 内存层最多保留的条目数
+        :param cache_dir: 磁盘层目录，None 表示只用内存
+        :param max_disk_bytes: 磁盘层总大小上限（字节）
+        """
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._scan_disk())
+
+    def get(self, key):
+        """返回缓存条目字典，未命中返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        entry = self._load_disk(key)
+        if entry is not None:
+            self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, image=None, texts=None, meta=None):
+        """写入缓存；image 为预处理后的图像，texts 为每块识别结果，meta 为可 JSON 序列化的附加信息"""
+        entry = {}
+        if image is not None:
+            entry["image"] = image
+        if texts is not None:
+            entry["texts"] = list(texts)
+        if meta is not None:
+            entry["meta"] = meta
+        self._put_memory(key, entry)
+        if self.cache_dir:
+            self._save_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir:
+            for path, _, _ in self._scan_disk():
+                _remove(path)
+            self._disk_bytes = 0
+
+    def _put_memory(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def _load_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {}
+                if "image" in data:
+                    entry["image"] = data["image"]
+                if "texts" in data:
+                    entry["texts"] = [str(t) for t in data["texts"]]
+                if "meta" in data:
+                    entry["meta"] = json.loads(str(data["meta"]))
+            # 更新修改时间，作为淘汰时的最近使用时间
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def _save_disk(self, key, entry):
+        arrays = {}
+        if "image" in entry:
+            arrays["image"] = entry["image"]
+        if "texts" in entry:
+            arrays["texts"] = np.array(entry["texts"], dtype=str)
+        if "meta" in entry:
+            arrays["meta"] = np.array(json.dumps(entry["meta"], ensure_ascii=False))
+
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名，多个进程共享同一目录时不会读到半截文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path) - old_size
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _scan_disk(self):
+        """[(路径, 修改时间, 大小), ...]"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, st.st_mtime, st.st_size))
+        return files
+
+    def _evict_disk(self):
+        # 重新扫描目录，其他进程写入的文件也计入总大小；淘汰到上限的 90%，避免每次写入都触发
+        files = sorted(self._scan_disk(), key=lambda f: f[1])
+        total = sum(size for _, _, size in files)
+        target = self.max_disk_bytes * 0.9
+        for path, _, size in files:
+            if total <= target:
+                break
+            _remove(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
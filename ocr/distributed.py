@@ -0,0 +1,825 @@
+# distributed.py
+"""
+多台机器协同识别：协调者把文档拆成按页的任务，各机器上的工作者拉取任务、识别后返回结构化结果，
+协调者按输入顺序（文档内按页码）组装输出，写法与 batch.py 相同。
+    python -m ocr.distributed coordinator 图片目录 --jsonl results.jsonl --address 0.0.0.0:7700
+    python -m ocr.distributed worker --address 协调者:7700 -j 4
+    python -m ocr.distributed coordinator 图片目录 -o 输出目录 --local 4          # 同一进程内起 4 个工作线程（测试用）
+    python -m ocr.distributed coordinator 图片目录 --jsonl out.jsonl --transport redis --address redis://host:6379/0
+    python -m ocr.distributed worker --transport zmq --address tcp://协调者:7701
+
+所有消息都是 工作者 -> 协调者 的一次请求和一条回复，传输方式可替换（见 TRANSPORTS）：
+    local   同一进程内直接调用（消息仍经过 JSON 序列化），用于测试
+    socket  TCP 上按行传输 JSON，只依赖标准库
+    zmq     ZeroMQ REQ/REP（需要安装 pyzmq）
+    redis   经 Redis（或兼容的 Valkey/KeyDB）列表转发请求和回复（需要安装 redis）
+
+任务只传文件路径和页码，工作者需要能以相同路径访问输入文件（共享存储）。
+    - 拉取：工作者每次按需要的数量拉取任务，手头多留 prefetch 个，处理快的机器自然拉得多
+    - 窃取：待分配的任务分完后，空闲工作者从积压最多的工作者那里拿走尚未开始的任务，
+            被拿走的任务在原工作者下一次请求的回复中撤回；万一两边都做了，以先返回的结果为准
+    - 心跳：工作者处理任务时另开线程定期发送心跳，超过 timeout 没有任何消息的工作者视为失联，
+            它手上未完成的任务重新分配；同一任务因失联重新分配超过 max_attempts 次后记为失败
+每页一个任务：文本块级别的并行由每个工作者内部的 block_workers 完成，
+把预处理后的整页图像发给多台机器识别各块，传输开销比识别本身还大。
+"""
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+from . import batch
+from . import document
+from . import instrument
+from . import ocr
+from . import preprocessor
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ("local", "socket", "zmq", "redis")
+DEFAULT_ADDRESSES = {"socket": "127.0.0.1:7700", "zmq": "tcp://127.0.0.1:7701",
+                     "redis": "redis://127.0.0.1:6379/0"}
+
+HEARTBEAT = 2.0     # 工作者发送心跳的间隔（秒）
+TIMEOUT = 10.0      # 超过该时间没有消息的工作者视为失联（秒）
+
+
+# ---------- 传输 ----------
+# 协调者一侧调用 serve(handler)，此后每条请求 msg 都由 handler(msg) 得到回复；
+# 工作者一侧由 connect() 得到客户端，client.request(msg) 发送请求并返回回复，
+# 连接断开或超时抛出 ConnectionError。客户端不是线程安全的，每个线程各自 connect()
+
+def _encode(msg):
+    return json.dumps(msg, ensure_ascii=False).encode() + b"\n"
+
+
+def _handle(handler, msg):
+    """调用 handler 得到回复；处理出错时回复 {"error": ...}，服务线程继续处理后面的请求"""
+    try:
+        return handler(msg)
+    except Exception as e:
+        logger.exception("failed to handle %s from %s", msg.get("op"), msg.get("worker"))
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+class LocalTransport:
+    """同一进程内：请求直接交给协调者处理，经过一次 JSON 序列化，与跨进程时收到的内容一致"""
+
+    def __init__(self):
+        self._handler = None
+
+    def serve(self, handler):
+        self._handler = handler
+
+    def connect(self):
+        return self
+
+    def request(self, msg):
+        if self._handler is None:
+            raise ConnectionError("协调者尚未启动")
+        reply = self._handler(json.loads(_encode(msg)))
+        return json.loads(_encode(reply))
+
+    def close(self):
+        pass
+
+
+def _split_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class SocketTransport:
+    """TCP 连接上按行收发 JSON，每个工作者线程一条长连接"""
+
+    def __init__(self, address=DEFAULT_ADDRESSES["socket"], timeout=TIMEOUT):
+        self.address = _split_address(address)
+        self.timeout = timeout
+        self._server = None
+
+    def serve(self, handler):
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(_encode(_handle(handler, json.loads(line))))
+
+        server = socketserver.ThreadingTCPServer(self.address, Handler, bind_and_activate=False)
+        server.daemon_threads = True
+        server.allow_reuse_address = True
+        server.server_bind()
+        server.server_activate()
+        self._server = server
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.2},
+                         daemon=True).start()
+
+    def connect(self):
+        return _SocketClient(self.address, self.timeout)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _SocketClient:
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def request(self, msg):
+        try:
+            if self._sock is None:
+                self._sock = socket.create_connection(self.address, timeout=self.timeout)
+                self._file = self._sock.makefile("rb")
+            self._sock.sendall(_encode(msg))
+            line = self._file.readline()
+        except OSError as e:
+            self.close()
+            raise ConnectionError(str(e)) from e
+        if not line:
+            self.close()
+            raise ConnectionError("连接已被协调者关闭")
+        return json.loads(line)
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+
+class ZmqTransport:
+    """ZeroMQ：协调者 REP，工作者 REQ；请求超时后丢弃 REQ 套接字重新连接"""
+
+    def __init__(self, address=DEFAULT_ADDRESSES["zmq"], timeout=TIMEOUT):
+        import zmq  # 可选依赖，只在使用时导入
+
+        self.zmq = zmq
+        self.address = address
+        self.timeout = timeout
+        self._context = zmq.Context.instance()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def serve(self, handler):
+        zmq = self.zmq
+        sock = self._context.socket(zmq.REP)
+        sock.bind(self.address)
+
+        def loop():
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
+            while not self._stop.is_set():
+                if not poller.poll(200):
+                    continue
+                # REP 套接字收到请求后必须回复，否则不能接收下一条
+                try:
+                    msg = json.loads(sock.recv())
+                except ValueError as e:
+                    sock.send(_encode({"error": f"无效的请求: {e}"}))
+                    continue
+                sock.send(_encode(_handle(handler, msg)))
+            sock.close(linger=0)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def connect(self):
+        return _ZmqClient(self)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _ZmqClient:
+    def __init__(self, transport):
+        self.transport = transport
+        self._sock = None
+
+    def request(self, msg):
+        zmq = self.transport.zmq
+        if self._sock is None:
+            self._sock = self.transport._context.socket(zmq.REQ)
+            self._sock.setsockopt(zmq.LINGER, 0)
+            self._sock.setsockopt(zmq.RCVTIMEO, int(self.transport.timeout * 1000))
+            self._sock.connect(self.transport.address)
+        try:
+            self._sock.send(_encode(msg))
+            return json.loads(self._sock.recv())
+        except zmq.ZMQError as e:
+            # REQ 套接字在未收到回复时不能再次发送，只能丢弃重建
+            self.close()
+            raise ConnectionError(str(e)) from e
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close(linger=0)
+            self._sock = None
+
+
+class RedisTransport:
+    """
+    Redis 列表转发：请求 LPUSH 到 {prefix}:requests，协调者 BRPOP 后把回复 LPUSH 到请求中指定的回复键
+    每个请求带有 request_id，回复原样带回；客户端超时后到达的旧回复编号不同，被丢弃
+    多个协调者不能共用同一个 prefix
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESSES["redis"], timeout=TIMEOUT, prefix="ocr"):
+        import redis  # 可选依赖，只在使用时导入
+
+        self.redis = redis
+        self.address = address
+        self.timeout = timeout
+        self.prefix = prefix
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        # BRPOP 阻塞期间套接字上没有数据，读超时必须长于阻塞时间（redis-py 8 默认只有 5 秒）
+        return self.redis.Redis.from_url(self.address, socket_timeout=self.timeout + 5)
+
+    def serve(self, handler):
+        conn = self._connect()
+        requests_key = f"{self.prefix}:requests"
+        # 上一次运行遗留的请求来自已经不存在的任务，丢弃
+        conn.delete(requests_key)
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    item = conn.brpop(requests_key, timeout=1)
+                    if item is None:
+                        continue
+                    try:
+                        msg = json.loads(item[1])
+                        reply_to = msg.pop("reply_to")
+                        request_id = msg.pop("request_id", None)
+                    except (ValueError, KeyError, AttributeError) as e:
+                        # 没有回复键，无法回复，只能丢弃
+                        logger.warning("dropped malformed request: %s", e)
+                        continue
+                    reply = dict(_handle(handler, msg), request_id=request_id)
+                    pipe = conn.pipeline()
+                    pipe.lpush(reply_to, _encode(reply))
+                    pipe.expire(reply_to, int(self.timeout * 2) + 1)
+                    pipe.execute()
+                except self.redis.RedisError as e:
+                    # Redis 暂时不可用时稍后重试，工作者那边按连接失败处理
+                    logger.warning("redis: %s", e)
+                    self._stop.wait(1.0)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def connect(self):
+        return _RedisClient(self)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _RedisClient:
+    def __init__(self, transport):
+        self.transport = transport
+        self.conn = transport._connect()
+        self.reply_to = f"{transport.prefix}:reply:{uuid.uuid4().hex}"
+
+    def request(self, msg):
+        request_id = uuid.uuid4().hex
+        deadline = time.monotonic() + self.transport.timeout
+        try:
+            self.conn.lpush(f"{self.transport.prefix}:requests",
+                            _encode(dict(msg, reply_to=self.reply_to, request_id=request_id)))
+            while True:
+                remaining = deadline - time.monotonic()
+                item = self.conn.brpop(self.reply_to, timeout=max(1, int(remaining + 0.999)))
+                if item is None:
+                    raise ConnectionError("等待协调者回复超时")
+                reply = json.loads(item[1])
+                if reply.pop("request_id", None) == request_id:
+                    return reply
+                # 之前超时的请求迟到的回复，其中分配的任务会在下一次请求时由协调者收回（见 Coordinator._reconcile）
+                logger.debug("discarded stale reply on %s", self.reply_to)
+        except self.transport.redis.RedisError as e:
+            raise ConnectionError(str(e)) from e
+
+    def close(self):
+        self.conn.close()
+
+
+def make_transport(kind="socket", address=None, timeout=TIMEOUT):
+    """
+    :param kind: 传输方式，见 TRANSPORTS
+    :param address: socket 为 host:port，zmq 为 ZeroMQ 端点（tcp://host:port），redis 为 redis:// URL
+    """
+    if kind == "local":
+        return LocalTransport()
+    address = address or DEFAULT_ADDRESSES.get(kind)
+    if kind == "socket":
+        return SocketTransport(address, timeout=timeout)
+    if kind == "zmq":
+        return ZmqTransport(address, timeout=timeout)
+    if kind == "redis":
+        return RedisTransport(address, timeout=timeout)
+    raise ValueError(f"未知的传输方式: {kind}")
+
+
+# ---------- 协调者 ----------
+
+class Coordinator:
+    """
+    任务分配与结果收集；handle 可被多个传输线程同时调用
+    任务编号即输入顺序，iter_results 按编号依次产出结果
+    """
+
+    def __init__(self, tasks, job, prefetch=1, timeout=TIMEOUT, max_attempts=3):
+        """
+        :param tasks: [(路径, 相对名, 页码), ...]，见 batch.expand_pages
+        :param job: 随任务发给工作者的参数：{"options": 传给 process_array 的参数, "profile", "structured"}
+        :param prefetch: 工作者在正在处理的任务之外最多积压的任务数；工作者在请求中带有 prefetch 时以工作者的为准
+        :param timeout: 工作者失联判定时间（秒）
+        :param max_attempts: 同一任务因工作者失联最多分配的次数
+        """
+        self.tasks = [{"id": i, "path": path, "rel_name": rel_name, "page": page,
+                       "doc_id": rel_name if page is None else f"{rel_name}#{page}"}
+                      for i, (path, rel_name, page) in enumerate(tasks)]
+        self.job = job
+        self.prefetch = prefetch
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.counters = {"workers": 0, "stolen": 0, "redispatched": 0, "duplicates": 0}
+
+        self._pending = collections.deque(range(len(self.tasks)))
+        self._assigned = {}     # 工作者 -> 已分配未完成的任务编号（按分配顺序）
+        self._prefetch = {}     # 工作者 -> 工作者自己指定的积压数
+        self._running = {}      # 工作者 -> 正在处理的任务编号，不会被窃取
+        self._cancel = {}       # 工作者 -> 被窃取、需要撤回的任务编号
+        self._last_seen = {}
+        self._attempts = collections.Counter()
+        self._results = {}
+        self._finished = 0
+        self._next = 0          # iter_results 下一个要产出的任务编号
+        self._notified = set()  # 已被告知全部完成的工作者
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self._finished == len(self.tasks)
+
+    def handle(self, msg):
+        """处理一条工作者请求：pull 拉取任务，result 返回结果并拉取，heartbeat 心跳"""
+        worker = msg.get("worker")
+        op = msg.get("op")
+        if not worker or op not in ("pull", "result", "heartbeat"):
+            return {"error": f"无效的请求: {op}"}
+        with self._cond:
+            now = time.monotonic()
+            if worker not in self._last_seen:
+                self.counters["workers"] += 1
+                logger.info("worker %s joined", worker)
+                self._assigned[worker] = []
+            self._last_seen[worker] = now
+            self._running[worker] = set(msg.get("running", ()))
+            if "prefetch" in msg:
+                self._prefetch[worker] = max(0, int(msg["prefetch"]))
+            self._reap(now)
+
+            if op == "result":
+                self._complete(worker, msg["task"], msg["record"])
+            tasks = []
+            if op != "heartbeat":
+                self._reconcile(worker, msg.get("held", ()))
+                tasks = self._assign(worker, int(msg.get("want", 1)))
+            reply = {"tasks": tasks, "cancel": sorted(self._cancel.pop(worker, ())),
+                     "done": self.done}
+            if tasks:
+                reply["job"] = self.job
+            if self.done:
+                self._notified.add(worker)
+                self._cond.notify_all()
+            return reply
+
+    def _complete(self, worker, task_id, record):
+        for w, ids in self._assigned.items():
+            if task_id in ids:
+                ids.remove(task_id)
+                if w != worker:
+                    self._cancel.setdefault(w, set()).add(task_id)
+        if task_id in self._results or task_id < self._next:
+            # 被窃取的任务两边都做完了，或失联后又回来的工作者交回已重新分配的任务
+            self.counters["duplicates"] += 1
+            return
+        if task_id in self._pending:
+            self._pending.remove(task_id)
+        self._results[task_id] = record
+        self._finished += 1
+        self._cond.notify_all()
+
+    def _reconcile(self, worker, held):
+        """
+        工作者在 pull/result 请求中报告手上的全部任务；分配给它却不在其中的任务
+        （回复在传输中丢失）放回待分配队列
+        """
+        held = set(held)
+        mine = self._assigned[worker]
+        lost = [i for i in mine if i not in held]
+        if lost:
+            self._assigned[worker] = [i for i in mine if i in held]
+            self._requeue(lost)
+
+    def _requeue(self, ids):
+        # 待分配队列保持按编号排序，靠前的页先重做，按顺序组装时不会长时间等待
+        self._pending = collections.deque(sorted(self._pending + collections.deque(ids)))
+
+    def _assign(self, worker, want):
+        mine = self._assigned[worker]
+        want = min(want, self._prefetch.get(worker, self.prefetch) + 1 - len(mine))
+        ids = []
+        while len(ids) < want and self._pending:
+            ids.append(self._pending.popleft())
+        if len(ids) < want:
+            ids.extend(self._steal(worker, want - len(ids)))
+        mine.extend(ids)
+        return [self.tasks[i] for i in ids]
+
+    def _steal(self, thief, want):
+        """从积压最多的工作者那里拿走最后分配、尚未开始的任务"""
+        # 工作者按分配顺序处理，第一个任务可能已经开始，心跳报告正在处理的任务也不拿
+        victims = sorted(((w, [i for i in ids[1:] if i not in self._running.get(w, ())])
+                          for w, ids in self._assigned.items() if w != thief),
+                         key=lambda item: len(item[1]), reverse=True)
+        for victim, waiting in victims:
+            if not waiting:
+                break
+            stolen = waiting[-want:]
+            for task_id in stolen:
+                self._assigned[victim].remove(task_id)
+                self._cancel.setdefault(victim, set()).add(task_id)
+            self.counters["stolen"] += len(stolen)
+            logger.debug("%s stole %s from %s", thief, stolen, victim)
+            return stolen
+        return []
+
+    def _reap(self, now):
+        """把失联工作者手上未完成的任务放回待分配队列"""
+        for worker, last_seen in list(self._last_seen.items()):
+            if now - last_seen <= self.timeout:
+                continue
+            lost = self._assigned.pop(worker, [])
+            del self._last_seen[worker]
+            self._running.pop(worker, None)
+            self._cancel.pop(worker, None)
+            self._prefetch.pop(worker, None)
+            logger.warning("worker %s lost, requeueing %d tasks", worker, len(lost))
+            requeue = []
+            for task_id in lost:
+                self._attempts[task_id] += 1
+                if self._attempts[task_id] >= self.max_attempts:
+                    task = self.tasks[task_id]
+                    record = {"path": task["path"], "status": "error",
+                              "error": f"工作者失联 {self._attempts[task_id]} 次", "seconds": 0.0}
+                    if task["page"] is not None:
+                        record["page"] = task["page"]
+                    self._results[task_id] = record
+                    self._finished += 1
+                else:
+                    requeue.append(task_id)
+            self._requeue(requeue)
+            self.counters["redispatched"] += len(requeue)
+            self._cond.notify_all()
+
+    def iter_results(self, poll=1.0):
+        """
+        按任务编号（即输入顺序，文档内按页码）产出 (任务, 结果记录)，
+        后面的页先完成时暂存，等前面的页完成后再一起产出
+        """
+        while True:
+            with self._cond:
+                while self._next not in self._results and self._next < len(self.tasks):
+                    self._cond.wait(poll)
+                    self._reap(time.monotonic())
+                if self._next >= len(self.tasks):
+                    return
+                task_id = self._next
+                record = self._results.pop(task_id)
+                self._next += 1
+            yield self.tasks[task_id], record
+
+    def wait_workers(self, timeout):
+        """全部完成后等待仍在线的工作者都收到完成通知，最多等待 timeout 秒"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                alive = {w for w, t in self._last_seen.items() if now - t <= self.timeout}
+                if alive <= self._notified or now >= deadline:
+                    return
+                self._cond.wait(min(0.2, deadline - now))
+
+
+def run_coordinator(sources, transport, output_dir=None, jsonl_path=None, recursive=False,
+                    resume=True, fmt="txt", metrics_path=None, local_workers=0, prefetch=1,
+                    heartbeat=HEARTBEAT, timeout=TIMEOUT, max_attempts=3, cache_dir=None,
+                    **options):
+    """
+    拆分任务、等待工作者完成并按顺序写出结果，输出与 batch.run_batch 相同
+    :param transport: 传输，见 make_transport
+    :param local_workers: 在本进程内另起的工作线程数（local 传输时必须大于 0）
+    :param prefetch, timeout, max_attempts: 见 Coordinator
+    :param heartbeat: 本进程内工作线程的心跳间隔
+    :param options: 传给 pipeline.process_array 的参数（lang、engine、denoise、psm 等）
+    :return: 统计信息字典，另含工作者数、窃取和重新分配的任务数
+    """
+    if output_dir is None and jsonl_path is None:
+        raise ValueError("需要指定 output_dir 或 jsonl_path")
+
+    tasks, failed = batch.expand_pages(batch.collect_inputs(sources, recursive=recursive))
+    todo = batch.pending_tasks(tasks, output_dir, jsonl_path, fmt) if resume else tasks
+    stats = {"total": len(tasks) + len(failed), "skipped": len(tasks) - len(todo),
+             "ok": 0, "error": 0, "no_text": 0}
+    logger.info("%d pages, %d already done", stats["total"], stats["skipped"])
+    registry = instrument.MetricsRegistry() if metrics_path else None
+
+    options = dict(options)
+    options.setdefault("max_workers", 1)
+    job = {"options": options, "profile": registry is not None, "structured": fmt != "txt"}
+    coordinator = Coordinator(todo, job, prefetch=prefetch, timeout=timeout,
+                              max_attempts=max_attempts)
+
+    if jsonl_path:
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+    jsonl_file = open(jsonl_path, "a" if resume else "w", encoding="utf-8") if jsonl_path else None
+
+    def emit(record, rel_name=None):
+        stats[record["status"]] += 1
+        if "page_skipped" in record:
+            stats["no_text"] += 1
+        if record["status"] == "ok":
+            if output_dir:
+                out_path = batch.output_path_for(output_dir, rel_name, record.get("page"), fmt)
+                if fmt == "txt":
+                    text = "\n\n".join(record["blocks"])
+                else:
+                    text = document.export(record["document"], fmt, os.path.basename(record["path"]))
+                batch._write_text_atomic(out_path, text)
+        else:
+            logger.error("%s: %s", record["path"], record["error"])
+        if registry is not None and "profile" in record:
+            registry.add(record["profile"])
+        if jsonl_file:
+            jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            jsonl_file.flush()
+
+    threads = []
+    transport.serve(coordinator.handle)
+    try:
+        for path, error in failed:
+            emit({"path": path, "status": "error", "error": error, "seconds": 0.0})
+        for i in range(local_workers):
+            worker = Worker(transport, name=f"local-{i}", prefetch=prefetch, heartbeat=heartbeat)
+            thread = threading.Thread(target=worker.run, daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for finished, (task, record) in enumerate(coordinator.iter_results(), 1):
+            emit(record, task["rel_name"])
+            where = task["path"] if task["page"] is None else f"{task['path']}#{task['page']}"
+            logger.info("%d/%d %s (%ss)", finished, len(todo), where, record["seconds"])
+        coordinator.wait_workers(timeout=heartbeat * 2)
+    finally:
+        transport.close()
+        for thread in threads:
+            thread.join(timeout=heartbeat * 2)
+        if jsonl_file:
+            jsonl_file.close()
+        if registry is not None:
+            registry.write(metrics_path)
+
+    stats.update((key, coordinator.counters[key]) for key in ("workers", "stolen", "redispatched"))
+    return stats
+
+
+# ---------- 工作者 ----------
+
+class Worker:
+    """
+    拉取任务并逐个处理：手上保留 prefetch 个待处理任务，处理完一页时在交回结果的同一请求中拉取下一批；
+    处理期间由心跳线程报告正在处理的任务，并接收被窃取任务的撤回
+    """
+
+    def __init__(self, transport, name=None, prefetch=1, heartbeat=HEARTBEAT, poll=0.5,
+                 give_up=60.0):
+        """
+        :param transport: 与协调者相同类型的传输，见 make_transport
+        :param poll: 暂时没有任务时再次拉取的间隔（秒）
+        :param give_up: 连续这么久连不上协调者时退出（秒）
+        """
+        self.transport = transport
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.prefetch = prefetch
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.give_up = give_up
+        self.processed = 0
+        self._finished = False   # 协调者已报告全部完成
+        self._backlog = collections.deque()
+        self._running = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _apply(self, reply):
+        if "error" in reply:
+            logger.warning("%s: coordinator error: %s", self.name, reply["error"])
+        if reply.get("done"):
+            self._finished = True
+        with self._lock:
+            cancel = set(reply.get("cancel", ()))
+            if cancel:
+                self._backlog = collections.deque(t for t in self._backlog if t["id"] not in cancel)
+            for task in reply.get("tasks", ()):
+                self._backlog.append(dict(task, job=reply["job"]))
+
+    def _request(self, client, msg):
+        """发送请求，连接失败时重试，超过 give_up 秒抛出 ConnectionError"""
+        deadline = time.monotonic() + self.give_up
+        while True:
+            try:
+                return client.request(msg)
+            except ConnectionError as e:
+                if time.monotonic() >= deadline or self._finished:
+                    raise
+                logger.debug("%s: %s, retrying", self.name, e)
+                time.sleep(self.poll)
+
+    def _heartbeats(self):
+        client = self.transport.connect()
+        try:
+            while not self._stop.wait(self.heartbeat):
+                running = self._running
+                msg = {"op": "heartbeat", "worker": self.name,
+                       "running": [] if running is None else [running]}
+                try:
+                    self._apply(client.request(msg))
+                except ConnectionError as e:
+                    logger.debug("%s heartbeat: %s", self.name, e)
+        finally:
+            client.close()
+
+    def run(self):
+        """处理任务直到协调者报告全部完成；返回处理的任务数"""
+        client = self.transport.connect()
+        beats = threading.Thread(target=self._heartbeats, daemon=True)
+        beats.start()
+        result = None
+        try:
+            while True:
+                with self._lock:
+                    held = [task["id"] for task in self._backlog]
+                msg = {"op": "pull", "worker": self.name, "want": max(0, self.prefetch + 1 - len(held)),
+                       "prefetch": self.prefetch, "held": held, "running": []}
+                if result is not None:
+                    msg.update(op="result", task=result[0], record=result[1])
+                try:
+                    reply = self._request(client, msg)
+                except ConnectionError:
+                    # 协调者写完结果后会关闭，这时还在重复处理被窃取任务的工作者连不上是正常的
+                    if self._finished:
+                        break
+                    raise
+                result = None
+                self._apply(reply)
+                with self._lock:
+                    task = self._backlog.popleft() if self._backlog else None
+                    if task is not None:
+                        self._running = task["id"]
+                if task is None:
+                    if reply.get("done"):
+                        break
+                    time.sleep(self.poll)
+                    continue
+                job = task["job"]
+                record = batch.process_one(task["path"], task["page"], job["options"],
+                                           job["profile"], job["structured"], task["doc_id"])
+                self._running = None
+                self.processed += 1
+                result = (task["id"], record)
+        finally:
+            self._stop.set()
+            client.close()
+        logger.info("worker %s finished, %d tasks", self.name, self.processed)
+        return self.processed
+
+
+def _worker_process(kind, address, cache_dir, log_level, **kwargs):
+    batch._init_worker(cache_dir, log_level)
+    Worker(make_transport(kind, address), **kwargs).run()
+
+
+def run_workers(kind, address=None, processes=1, cache_dir=None, **kwargs):
+    """
+    在本机启动 processes 个工作进程，每个进程是一个独立的工作者，直到协调者报告全部完成
+    :param kwargs: 传给 Worker 的参数
+    :return: 异常退出的工作进程数
+    """
+    if processes <= 1:
+        batch._init_worker(cache_dir)
+        Worker(make_transport(kind, address), **kwargs).run()
+        return 0
+    procs = [multiprocessing.Process(target=_worker_process,
+                                     args=(kind, address, cache_dir, logging.getLogger().level),
+                                     kwargs=kwargs)
+             for _ in range(processes)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    return sum(proc.exitcode != 0 for proc in procs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多台机器协同 OCR：协调者拆分任务并组装结果，工作者拉取任务识别")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--transport", default="socket", choices=TRANSPORTS, help="传输方式")
+    common.add_argument("--address", help="socket 为 host:port，zmq 为 tcp://host:port，redis 为 redis:// URL")
+    common.add_argument("--heartbeat", type=float, default=HEARTBEAT, help="工作者心跳间隔（秒）")
+    common.add_argument("--cache-dir", help="结果缓存目录")
+    common.add_argument("-v", "--verbose", action="store_true", help="输出调试日志")
+
+    co = sub.add_parser("coordinator", parents=[common], help="拆分任务、分配给工作者并按顺序写出结果")
+    co.add_argument("inputs", nargs="+", help="图像目录、通配符、文件，或 @列表文件")
+    co.add_argument("-o", "--output-dir", help="每张图像输出一个文件到该目录")
+    co.add_argument("--jsonl", help="所有结果按输入顺序写入该 JSONL 文件")
+    co.add_argument("--local", type=int, default=0, help="在本进程内另起的工作线程数")
+    co.add_argument("--prefetch", type=int, default=1,
+                    help="本进程内工作线程（--local）在处理中的任务之外最多积压的任务数；远程工作者使用各自的 --prefetch")
+    co.add_argument("--timeout", type=float, default=TIMEOUT, help="超过该时间没有心跳的工作者视为失联（秒）")
+    co.add_argument("--max-attempts", type=int, default=3, help="同一任务因工作者失联最多分配的次数")
+    co.add_argument("--lang", default="chi_sim+eng", help="tesseract 语言，auto 按文本块自动选择")
+    co.add_argument("--psm", type=ocr.parse_psm, default=3, help="tesseract --psm，或 auto")
+    co.add_argument("--block-workers", type=int, default=1, help="每页内并发识别的文本块数")
+    co.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"],
+                    help="OCR 引擎，auto 优先使用 tesserocr")
+    co.add_argument("--denoise", default="nlm", choices=preprocessor.DENOISE_METHODS, help="去噪方式")
+    co.add_argument("--skip-non-text", action="store_true", help="空白页、照片、条码等不做识别，输出为空")
+    co.add_argument("--format", default="txt", choices=document.FORMATS, help="-o 输出格式")
+    co.add_argument("--metrics", help="统计各阶段耗时/内存并写入该文件")
+    co.add_argument("-r", "--recursive", action="store_true", help="递归扫描子目录")
+    co.add_argument("--no-resume", action="store_true", help="忽略已有结果，全部重新处理")
+
+    wo = sub.add_parser("worker", parents=[common], help="连接协调者，拉取并处理任务")
+    wo.add_argument("-j", "--processes", type=int, default=1, help="本机工作进程数，每个进程是一个工作者")
+    wo.add_argument("--prefetch", type=int, default=1, help="在处理中的任务之外预先拉取的任务数")
+    wo.add_argument("--give-up", type=float, default=60.0, help="连续这么久连不上协调者时退出（秒）")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format=batch.LOG_FORMAT)
+
+    if args.role == "worker":
+        if args.transport == "local":
+            parser.error("local 传输只能在协调者进程内使用（--local）")
+        try:
+            failures = run_workers(args.transport, args.address, processes=args.processes,
+                                   cache_dir=args.cache_dir, prefetch=args.prefetch,
+                                   heartbeat=args.heartbeat, give_up=args.give_up)
+        except ConnectionError as e:
+            logger.error("无法连接协调者: %s", e)
+            return 1
+        return 0 if not failures else 1
+
+    if not args.output_dir and not args.jsonl:
+        parser.error("需要指定 --output-dir 或 --jsonl")
+    if args.transport == "local" and args.local <= 0:
+        parser.error("local 传输需要 --local 指定工作线程数")
+    if args.local:
+        batch._init_worker(args.cache_dir)
+    stats = run_coordinator(args.inputs, make_transport(args.transport, args.address, args.timeout),
+                            output_dir=args.output_dir, jsonl_path=args.jsonl,
+                            recursive=args.recursive, resume=not args.no_resume, fmt=args.format,
+                            metrics_path=args.metrics, local_workers=args.local,
+                            prefetch=args.prefetch, heartbeat=args.heartbeat, timeout=args.timeout,
+                            max_attempts=args.max_attempts, lang=args.lang, psm=args.psm,
+                            max_workers=args.block_workers, engine=args.engine,
+                            denoise=args.denoise, skip_non_text=args.skip_non_text)
+    logger.info("done: %s", stats)
+    return 0 if stats["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# document.py
+"""
+结构化识别结果：页 -> 文本块 -> 行 -> 词，每级带原图坐标下的外接框和置信度
+
+    processed, transform = preprocessor.preprocess_image_from_array(img, return_transform=True)
+    blocks = ocr.run_ocr(processed, structured=True)
+    page = document.build_page(blocks, img.shape[1], img.shape[0], transform)
+    document.write(page, "out.hocr")
+
+框的格式为 [x, y, w, h]；置信度为 tesseract 的 0~100，行/块的置信度为其中词的平均值。
+导出格式：JSON、hOCR（XHTML）、ALTO v4（XML）。
+"""
+import json
+import os
+
+import numpy as np
+
+FORMATS = ("txt", "json", "hocr", "alto")
+FORMAT_EXTS = {"txt": ".txt", "json": ".json", "hocr": ".hocr", "alto": ".xml"}
+
+
+# ---------- 坐标换算 ----------
+
+def _inverse(transform):
+    """预处理变换（原图 -> 预处理后）的逆变换，None 表示坐标不变"""
+    if transform is None:
+        return None
+    matrix = np.asarray(transform, dtype=np.float64)
+    if np.allclose(matrix, [[1, 0, 0], [0, 1, 0]]):
+        return None
+    full = np.vstack([matrix, [0.0, 0.0, 1.0]])
+    return np.linalg.inv(full)[:2]
+
+
+def _map_box(box, inverse, width, height):
+    """预处理后坐标下的框映射回原图：四个角点变换后取外接框，并裁剪到原图范围内"""
+    x, y, w, h = box
+    if inverse is not None:
+        corners = np.array([[x, y, 1], [x + w, y, 1], [x, y + h, 1], [x + w, y + h, 1]],
+                           dtype=np.float64)
+        mapped = corners @ inverse.T
+        x0, y0 = mapped.min(axis=0)
+        x1, y1 = mapped.max(axis=0)
+    else:
+        x0, y0, x1, y1 = x, y, x + w, y + h
+    x0, x1 = (int(round(min(max(v, 0), width))) for v in (x0, x1))
+    y0, y1 = (int(round(min(max(v, 0), height))) for v in (y0, y1))
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def _union(boxes):
+    x0 = min(b[0] for b in boxes)
+    y0 = min(b[1] for b in boxes)
+    x1 = max(b[0] + b[2] for b in boxes)
+    y1 = max(b[1] + b[3] for b in boxes)
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def _mean_conf(items):
+    confs = [item["conf"] for item in items if item["conf"] >= 0]
+    return round(sum(confs) / len(confs), 2) if confs else None
+
+
+# ---------- 构建 ----------
+
+def build_page(blocks, width, height, transform=None):
+    """
+    把 ocr.run_ocr(structured=True) 的结果整理为页结构，坐标换算回原图
+    :param blocks: 每块 {"box", "text", "words"}，坐标为预处理后图像上的坐标
+    :param width, height: 原图尺寸
+    :param transform: 原图 -> 预处理后图像的 2x3 仿射矩阵，见 preprocessor.do_rotation
+    :return: {"width", "height", "text", "blocks": [{"box", "conf", "text", "lang", "lines": [
+              {"box", "conf", "text", "words": [{"box", "conf", "text"}, ...]}, ...]}, ...]}
+    """
+    inverse = _inverse(transform)
+    page_blocks = []
+    for block in blocks:
+        # 先在预处理后坐标下按行分组、求行框，再整体映射，旋转时行框不会被逐词放大
+        lines = {}
+        for word in block["words"]:
+            lines.setdefault((word["block"], word["par"], word["line"]), []).append(word)
+
+        page_lines = []
+        for words in lines.values():
+            page_lines.append({
+                "box": _map_box(_union([w["box"] for w in words]), inverse, width, height),
+                "conf": _mean_conf(words),
+                "text": " ".join(w["text"] for w in words),
+                "words": [{"box": _map_box(w["box"], inverse, width, height),
+                           "conf": w["conf"], "text": w["text"]} for w in words],
+            })
+        all_words = [w for line in page_lines for w in line["words"]]
+        page_block = {
+            "box": _map_box(block["box"], inverse, width, height),
+            "conf": _mean_conf(all_words),
+            "text": block["text"],
+            "lines": page_lines,
+        }
+        if "lang" in block:
+            page_block["lang"] = block["lang"]
+        page_blocks.append(page_block)
+    return {
+        "width": int(width),
+        "height": int(height),
+        "text": "\n\n".join(block["text"] for block in page_blocks),
+        "blocks": page_blocks,
+    }
+
+
+# ---------- 导出 ----------
+
+def to_json(page):
+    return json.dumps(page, ensure_ascii=False, indent=2)
+
+
+def _bbox(box):
+    x, y, w, h = box
+    return f"bbox {x} {y} {x + w} {y + h}"
+
+
+def to_hocr(page, image_name=""):
+    """导出为 hOCR 1.2"""
+    # saxutils 会连带导入 urllib，只在导出 XML 时才需要
+    from xml.sax.saxutils import escape, quoteattr
+
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"'
+        ' "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">',
+        '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">',
+        " <head>",
+        f"  <title>{escape(image_name)}</title>",
+        '  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>',
+        '  <meta name="ocr-system" content="tesseract"/>',
+        '  <meta name="ocr-capabilities" content="ocr_page ocr_carea ocr_line ocrx_word"/>',
+        " </head>",
+        " <body>",
+    ]
+    page_title = f'image "{image_name}"; {_bbox([0, 0, page["width"], page["height"]])}; ppageno 0'
+    out.append(f"  <div class='ocr_page' id='page_1' title={quoteattr(page_title)}>")
+    for b, block in enumerate(page["blocks"], 1):
+        out.append(f"   <div class='ocr_carea' id='block_1_{b}' title='{_bbox(block['box'])}'>")
+        for l, line in enumerate(block["lines"], 1):
+            out.append(f"    <span class='ocr_line' id='line_1_{b}_{l}' title='{_bbox(line['box'])}'>")
+            for n, word in enumerate(line["words"], 1):
+                title = f"{_bbox(word['box'])}; x_wconf {int(round(max(word['conf'], 0)))}"
+                out.append(f"     <span class='ocrx_word' id='word_1_{b}_{l}_{n}' title='{title}'>"
+                           f"{escape(word['text'])}</span>")
+            out.append("    </span>")
+        out.append("   </div>")
+    out += ["  </div>", " </body>", "</html>", ""]
+    return "\n".join(out)
+
+
+def _alto_pos(box):
+    x, y, w, h = box
+    return f'HPOS="{x}" VPOS="{y}" WIDTH="{w}" HEIGHT="{h}"'
+
+
+def to_alto(page, image_name=""):
+    """导出为 ALTO v4"""
+    from xml.sax.saxutils import escape, quoteattr
+
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#"'
+        ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+        ' xsi:schemaLocation="http://www.loc.gov/standards/alto/ns-v4#'
+        ' http://www.loc.gov/alto/v4/alto-4-2.xsd">',
+        " <Description>",
+        "  <MeasurementUnit>pixel</MeasurementUnit>",
+        "  <sourceImageInformation>",
+        f"   <fileName>{escape(image_name)}</fileName>",
+        "  </sourceImageInformation>",
+        " </Description>",
+        " <Layout>",
+        f'  <Page ID="page_0" PHYSICAL_IMG_NR="1" WIDTH="{page["width"]}" HEIGHT="{page["height"]}">',
+        f'   <PrintSpace {_alto_pos([0, 0, page["width"], page["height"]])}>',
+    ]
+    for b, block in enumerate(page["blocks"]):
+        out.append(f'    <TextBlock ID="block_{b}" {_alto_pos(block["box"])}>')
+        for l, line in enumerate(block["lines"]):
+            out.append(f'     <TextLine ID="line_{b}_{l}" {_alto_pos(line["box"])}>')
+            for n, word in enumerate(line["words"]):
+                if n:
+                    out.append("      <SP/>")
+                wc = round(max(word["conf"], 0) / 100, 2)
+                out.append(f'      <String ID="string_{b}_{l}_{n}" {_alto_pos(word["box"])}'
+                           f' WC="{wc}" CONTENT={quoteattr(word["text"])}/>')
+            out.append("     </TextLine>")
+        out.append("    </TextBlock>")
+    out += ["   </PrintSpace>", "  </Page>", " </Layout>", "</alto>", ""]
+    return "\n".join(out)
+
+
+def export(page, fmt, image_name=""):
+    """按格式名（见 FORMATS）导出为字符串"""
+    if fmt == "txt":
+        return page["text"]
+    if fmt == "json":
+        return to_json(page)
+    if fmt == "hocr":
+        return to_hocr(page, image_name)
+    if fmt == "alto":
+        return to_alto(page, image_name)
+    raise ValueError(f"未知的导出格式: {fmt}")
+
+
+def format_for_path(file_path):
+    """按扩展名推断导出格式：.json / .hocr / .html / .xml（ALTO），其他为纯文本"""
+    ext = os.path.splitext(file_path)[1].lower()
+    return {".json": "json", ".hocr": "hocr", ".html": "hocr", ".xml": "alto"}.get(ext, "txt")
+
+
+def write(page, file_path, fmt=None, image_name=""):
+    """写出到文件，fmt 为 None 时按扩展名推断"""
+    text = export(page, fmt or format_for_path(file_path), image_name)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(text)
@@ -0,0 +1,211 @@
+# engines.py
+"""
+OCR 引擎后端：
+    - tesserocr：进程内常驻的 Tesseract API，模型只加载一次，直接接收 numpy 数组，不写临时文件
+    - pytesseract：每次调用启动 tesseract 子进程，作为未安装 tesserocr 时的后备
+
+recognize(roi) 只返回文本；recognize_data(roi) 在同一次识别中同时取得文本和
+每个词的位置、置信度：{"text": 文本, "words": [{"text", "conf", "box", "block", "par", "line"}, ...]}
+
+pytesseract / tesserocr 在第一次创建引擎时才导入，只导入本模块（或 pipeline）的脚本和界面不需要付出这部分启动时间
+"""
+import threading
+
+import numpy as np
+
+pytesseract = None
+tesserocr = None
+_tesserocr_checked = False
+_import_lock = threading.Lock()
+
+
+def load_pytesseract():
+    """导入并返回 pytesseract 模块"""
+    global pytesseract
+    if pytesseract is None:
+        import pytesseract as module
+        pytesseract = module
+    return pytesseract
+
+
+def load_tesserocr():
+    """导入并返回 tesserocr 模块，未安装时为 None；只尝试一次"""
+    global tesserocr, _tesserocr_checked
+    with _import_lock:
+        if not _tesserocr_checked:
+            try:
+                import tesserocr as module
+            except ImportError:
+                module = None
+            tesserocr = module
+            _tesserocr_checked = True
+    return tesserocr
+
+
+class PytesseractEngine:
+    """通过 tesseract 命令行识别，每次调用一个子进程"""
+
+    name = "pytesseract"
+
+    def __init__(self, lang="chi_sim+eng", oem=3, psm=3):
+        self.lang = lang
+        self.oem = oem
+        self.psm = psm
+        self.config = f"--oem {oem} --psm {psm}"
+        load_pytesseract()
+
+    def recognize(self, roi):
+        return pytesseract.image_to_string(roi, lang=self.lang, config=self.config)
+
+    def recognize_data(self, roi):
+        # 只调用一次 tesseract（tsv 输出），文本由词重新拼出，不再额外运行 image_to_string
+        tsv = pytesseract.image_to_data(roi, lang=self.lang, config=self.config)
+        words = parse_tsv(tsv)
+        return {"text": words_to_text(words), "words": words}
+
+
+class TesserocrEngine:
+    """
+    进程内的 Tesseract，复用已初始化的 API 实例
+    同一个 API 不能被多个线程同时使用，这里维护一个空闲实例池，
+    并发数为 N 时最多初始化 N 个实例，之后的调用全部复用
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang="chi_sim+eng", oem=3, psm=3):
+        if load_tesserocr() is None:
+            raise RuntimeError("tesserocr 未安装")
+        self.lang = lang
+        self.oem = oem
+        self.psm = psm
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return tesserocr.PyTessBaseAPI(lang=self.lang, oem=self.oem, psm=self.psm)
+
+    def _release(self, api):
+        with self._lock:
+            self._idle.append(api)
+
+    def recognize(self, roi):
+        roi = np.ascontiguousarray(roi)
+        h, w = roi.shape[:2]
+        bytes_per_pixel = 1 if roi.ndim == 2 else roi.shape[2]
+
+        api = self._acquire()
+        try:
+            api.SetImageBytes(roi.tobytes(), w, h, bytes_per_pixel, bytes_per_pixel * w)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._release(api)
+
+    def recognize_data(self, roi):
+        roi = np.ascontiguousarray(roi)
+        h, w = roi.shape[:2]
+        bytes_per_pixel = 1 if roi.ndim == 2 else roi.shape[2]
+
+        api = self._acquire()
+        try:
+            api.SetImageBytes(roi.tobytes(), w, h, bytes_per_pixel, bytes_per_pixel * w)
+            api.Recognize()
+            # 两次取结果都读取同一次 Recognize 的结果，不会重复识别
+            return {"text": api.GetUTF8Text(), "words": parse_tsv(api.GetTSVText(0))}
+        finally:
+            api.Clear()
+            self._release(api)
+
+    def close(self):
+        with self._lock:
+            apis, self._idle = self._idle, []
+        for api in apis:
+            api.End()
+
+
+def parse_tsv(tsv):
+    """
+    解析 tesseract 的 TSV 输出（有无表头均可），只保留非空的词
+    :return: [{"text", "conf", "box": [x, y, w, h], "block", "par", "line"}, ...]，按输出顺序
+    """
+    words = []
+    for line in tsv.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 12 or fields[0] != "5":
+            continue
+        text = fields[11].strip()
+        if not text:
+            continue
+        block, par, line_no = (int(v) for v in fields[2:5])
+        left, top, width, height = (int(v) for v in fields[6:10])
+        words.append({"text": text, "conf": round(float(fields[10]), 2),
+                      "box": [left, top, width, height],
+                      "block": block, "par": par, "line": line_no})
+    return words
+
+
+def words_to_text(words):
+    """按行、段落重新拼出文本：同一行以空格连接，段落之间空一行，与 tesseract 文本输出一致"""
+    lines = []
+    last_par = last_line = None
+    for word in words:
+        par = (word["block"], word["par"])
+        line = par + (word["line"],)
+        if line != last_line:
+            if last_par is not None and par != last_par:
+                lines.append("")
+            lines.append(word["text"])
+            last_par, last_line = par, line
+        else:
+            lines[-1] += " " + word["text"]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+ENGINES = {
+    "pytesseract": PytesseractEngine,
+    "tesserocr": TesserocrEngine,
+}
+
+# 引擎按参数缓存在进程内，多次调用 run_ocr 共用同一批已加载的模型
+_engine_cache = {}
+_engine_cache_lock = threading.Lock()
+
+
+def available_engines():
+    """当前环境可用的引擎名"""
+    names = ["pytesseract"]
+    if load_tesserocr() is not None:
+        names.insert(0, "tesserocr")
+    return names
+
+
+def resolve_engine(name="auto"):
+    """
+    实际使用的引擎名
+    :param name: "auto" 优先使用 tesserocr，不可用时退回 pytesseract；也可以是引擎实例
+    """
+    if not isinstance(name, str):
+        return name.name
+    return available_engines()[0] if name == "auto" else name
+
+
+def get_engine(name="auto", lang="chi_sim+eng", oem=3, psm=3):
+    """
+    获取（并缓存）一个引擎实例
+    :param name: 引擎名，见 resolve_engine
+    """
+    name = resolve_engine(name)
+    if name not in ENGINES:
+        raise ValueError(f"未知的OCR引擎: {name}")
+
+    key = (name, lang, oem, psm)
+    with _engine_cache_lock:
+        engine = _engine_cache.get(key)
+        if engine is None:
+            engine = ENGINES[name](lang=lang, oem=oem, psm=psm)
+            _engine_cache[key] = engine
+    return engine
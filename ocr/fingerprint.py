@@ -0,0 +1,252 @@
+# fingerprint.py
+"""
+文本块指纹索引：同一文档的修订版重新扫描时，只识别内容有变化的文本块，其余块沿用上次的结果
+
+    index = fingerprint.BlockIndex("fingerprints/")
+    revision = index.revision("合同.pdf#3", settings={"lang": "chi_sim", "psm": 3})
+    results = ocr.run_ocr(processed, reuse=revision)
+    revision.commit(results)
+
+指纹为文本块墨迹外接框内的感知哈希：外接框纵向分成 BANDS 条横带，每条缩放后取 DCT 低频系数，
+按中位数二值化。只比较墨迹外接框，块的裁剪边界变化、整页平移都不影响指纹；
+分带比较时取差异最大的一带，改动一个词、加盖印章等局部变化不会被整块平均掉。
+
+匹配时先按指纹和外接框尺寸找出候选，用唯一候选估计整页平移量，再按扣除平移后的位置选取最近的一个。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BANDS = 8
+BAND_SIZE = (128, 32)    # 每条横带缩放后的 (宽, 高)
+HASH_COEFFS = (16, 8)    # 每条横带保留的低频系数 (横向, 纵向)，共 128 位
+
+MAX_DISTANCE = 0.06      # 任一横带中不同位的比例超过该值视为内容有变化
+SIZE_TOLERANCE = 0.05    # 墨迹外接框宽高的相对误差
+POSITION_TOLERANCE = 0.01  # 扣除整页平移后的位置误差，相对于页面对角线
+
+
+# ---------- 指纹 ----------
+
+def content_box(roi):
+    """块内墨迹的外接框 (x, y, w, h)，先做中值滤波去掉零星噪点；没有墨迹时为 None"""
+    ink = cv2.medianBlur(roi, 3) < 128
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def block_hash(roi):
+    """
+    文本块的感知哈希
+    :param roi: 预处理后的二值图中的一块（白底黑字）
+    :return: (墨迹外接框, 十六进制哈希)，没有墨迹时为 None
+    """
+    box = content_box(roi)
+    if box is None:
+        return None
+    x, y, w, h = box
+    band_w, band_h = BAND_SIZE
+    small = cv2.resize(roi[y:y+h, x:x+w], (band_w, band_h * BANDS),
+                       interpolation=cv2.INTER_AREA).astype(np.float32)
+    bits = []
+    for b in range(BANDS):
+        coeffs = cv2.dct(small[b * band_h:(b + 1) * band_h])[:HASH_COEFFS[1], :HASH_COEFFS[0]].ravel()
+        # 直流分量只反映墨迹总量，不参与中位数
+        bits.append(coeffs > np.median(coeffs[1:]))
+    return box, np.packbits(np.concatenate(bits)).tobytes().hex()
+
+
+def distance(hash_a, hash_b):
+    """两个指纹的距离：各横带中不同位比例的最大值"""
+    a = np.unpackbits(np.frombuffer(bytes.fromhex(hash_a), dtype=np.uint8))
+    b = np.unpackbits(np.frombuffer(bytes.fromhex(hash_b), dtype=np.uint8))
+    if a.shape != b.shape:
+        return 1.0
+    return float((a != b).reshape(BANDS, -1).mean(axis=1).max())
+
+
+def fingerprint_blocks(img, blocks):
+    """
+    每个文本块的指纹
+    :return: 与 blocks 一一对应的 {"box": 墨迹外接框（整页坐标）, "hash"}，空白块为 None
+    """
+    prints = []
+    for x, y, w, h in blocks:
+        hashed = block_hash(img[y:y+h, x:x+w])
+        if hashed is None:
+            prints.append(None)
+            continue
+        (bx, by, bw, bh), digest = hashed
+        prints.append({"box": [x + bx, y + by, bw, bh], "hash": digest})
+    return prints
+
+
+# ---------- 匹配 ----------
+
+def _same_size(a, b):
+    return all(abs(a[k] - b[k]) <= max(2, SIZE_TOLERANCE * max(a[k], b[k])) for k in (2, 3))
+
+
+def match(old, new, page_size):
+    """
+    把新版本的块与上一版本的块一一对应
+    :param old: 上一版本的条目 [{"box", "hash", ...}, ...]
+    :param new: 新版本的指纹，见 fingerprint_blocks
+    :param page_size: (宽, 高)，用于换算位置容差
+    :return: 与 new 一一对应的 old 下标，没有对应块时为 None
+    """
+    candidates = []
+    for entry in new:
+        candidates.append([j for j, prev in enumerate(old)
+                           if entry is not None and _same_size(entry["box"], prev["box"])
+                           and distance(entry["hash"], prev["hash"]) <= MAX_DISTANCE])
+
+    # 只有一个候选的块给出可靠的平移量，取中位数抵抗个别误配
+    shifts = [(new[i]["box"][0] - old[c[0]]["box"][0], new[i]["box"][1] - old[c[0]]["box"][1])
+              for i, c in enumerate(candidates) if len(c) == 1]
+    dx, dy = np.median(shifts, axis=0) if shifts else (0.0, 0.0)
+
+    tolerance = max(4.0, POSITION_TOLERANCE * float(np.hypot(*page_size)))
+    matched = [None] * len(new)
+    used = set()
+    for i, c in enumerate(candidates):
+        best = None
+        for j in c:
+            if j in used:
+                continue
+            err = np.hypot(new[i]["box"][0] - old[j]["box"][0] - dx,
+                           new[i]["box"][1] - old[j]["box"][1] - dy)
+            if err <= tolerance and (best is None or err < best[0]):
+                best = (err, j)
+        if best is not None:
+            matched[i] = best[1]
+            used.add(best[1])
+    return matched
+
+
+def _shift_box(box, dx, dy):
+    return [box[0] + dx, box[1] + dy, box[2], box[3]]
+
+
+def _reuse_result(result, block, dx, dy):
+    """沿用上一版本的识别结果：结构化结果的块框换成新块，词框随墨迹平移"""
+    if not isinstance(result, dict):
+        return result
+    reused = dict(result)
+    reused["box"] = list(block)
+    reused["words"] = [dict(word, box=_shift_box(word["box"], dx, dy)) for word in result["words"]]
+    return reused
+
+
+# ---------- 索引 ----------
+
+class BlockIndex:
+    def __init__(self, directory=None):
+        """
+        :param directory: 每个文档一个 JSON 文件保存到该目录，多个进程可以共享；None 表示只保存在内存中
+        """
+        self.directory = directory
+        self._memory = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, doc_id):
+        name = hashlib.blake2b(doc_id.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, doc_id, settings=None):
+        """
+        上一版本的条目 [{"box", "hash", "result"}, ...]
+        :param settings: 识别参数，与上一版本保存的不同时不能沿用，返回空列表
+        :return: 没有记录或参数不同时为空列表
+        """
+        if not self.directory:
+            with self._lock:
+                record = self._memory.get(doc_id)
+        else:
+            try:
+                with open(self._path(doc_id), encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                record = None
+        # 没有记录参数的旧索引文件也视为参数不同
+        if not isinstance(record, dict) or record.get("settings") != settings:
+            return []
+        return list(record.get("blocks", []))
+
+    def put(self, doc_id, entries, settings=None):
+        record = {"doc_id": doc_id, "settings": settings, "blocks": list(entries)}
+        if not self.directory:
+            with self._lock:
+                self._memory[doc_id] = record
+            return
+        path = self._path(doc_id)
+        # 先写临时文件再改名，多个进程共享同一目录时不会读到半截文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def revision(self, doc_id, structured=False, settings=None):
+        """
+        文档的一次新版本识别，作为 ocr.run_ocr 的 reuse 参数
+        :param settings: 识别参数（语言、psm、oem、引擎等，需可 JSON 序列化），与上一版本不同时全部重新识别
+        """
+        return Revision(self, doc_id, structured, settings)
+
+
+class Revision:
+    def __init__(self, index, doc_id, structured=False, settings=None):
+        self.index = index
+        self.doc_id = doc_id
+        self.structured = structured
+        # 经过一次 JSON 往返，与从索引文件读出的值比较时类型一致（如元组与列表）
+        self.settings = json.loads(json.dumps(settings)) if settings is not None else None
+        self.prints = None
+        self.reused = 0
+
+    def __call__(self, img, blocks):
+        """
+        计算每块的指纹并与上一版本匹配
+        :return: 与 blocks 一一对应的沿用结果，需要重新识别的块为 None
+        """
+        self.prints = fingerprint_blocks(img, blocks)
+        # 上一版本的结果类型不同（纯文本/结构化）时无法沿用
+        old = [entry for entry in self.index.get(self.doc_id, self.settings)
+               if isinstance(entry["result"], dict) == self.structured]
+        matched = match(old, self.prints, (img.shape[1], img.shape[0]))
+
+        results = []
+        for block, entry, j in zip(blocks, self.prints, matched):
+            if j is None:
+                results.append(None)
+                continue
+            dx = entry["box"][0] - old[j]["box"][0]
+            dy = entry["box"][1] - old[j]["box"][1]
+            results.append(_reuse_result(old[j]["result"], block, dx, dy))
+        self.reused = sum(r is not None for r in results)
+        logger.debug("%s: reused %d/%d blocks", self.doc_id, self.reused, len(blocks))
+        return results
+
+    def prime(self, img, blocks):
+        """只计算指纹不做匹配：结果来自其他缓存、没有经过 run_ocr 时，在 commit 之前调用"""
+        self.prints = fingerprint_blocks(img, blocks)
+
+    def commit(self, results):
+        """保存本次的指纹和识别结果，供下一版本匹配"""
+        if self.prints is None:
+            return
+        entries = [{"box": entry["box"], "hash": entry["hash"], "result": result}
+                   for entry, result in zip(self.prints, results) if entry is not None]
+        self.index.put(self.doc_id, entries, self.settings)
@@ -0,0 +1,101 @@
+# framestore.py
+"""
+共享内存中的图像帧：一页图像只复制进共享内存一次，其他进程凭句柄直接映射同一块内存，
+不再对整页或每个文本块做序列化
+
+    with framestore.SharedFrame.create(img) as frame:
+        executor.submit(framestore.recognize_block, frame.handle, (x, y, w, h), "auto")
+
+句柄为 (共享内存名, 形状, dtype) 的元组，可以直接 pickle 传给子进程。
+创建者退出 with 时释放共享内存；其他进程中的映射由 attach() 缓存，按需关闭。
+"""
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import engines
+
+
+class SharedFrame:
+    def __init__(self, shm, shape, dtype, owner=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, img):
+        """把图像复制进新建的共享内存"""
+        shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+        frame = cls(shm, img.shape, img.dtype, owner=True)
+        frame.array[...] = img
+        return frame
+
+    @classmethod
+    def attach(cls, handle):
+        """按句柄映射已有的共享内存（只读视图）"""
+        name, shape, dtype = handle
+        frame = cls(shared_memory.SharedMemory(name=name), shape, dtype)
+        frame.array.flags.writeable = False
+        return frame
+
+    @property
+    def handle(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    def roi(self, block):
+        x, y, w, h = block
+        return self.array[y:y+h, x:x+w]
+
+    def close(self):
+        # 先释放 numpy 视图，否则 SharedMemory.close 会因缓冲区仍被引用而失败
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# 子进程中最近映射的帧；同一页的多个文本块依次到达，只映射一次
+_attached = None
+_attached_lock = threading.Lock()
+
+
+def attach(handle):
+    """映射句柄对应的帧，换到新的一页时关闭上一页的映射"""
+    global _attached
+    with _attached_lock:
+        if _attached is not None and _attached.shm.name == handle[0]:
+            return _attached
+        if _attached is not None:
+            _attached.close()
+            _attached = None
+        _attached = SharedFrame.attach(handle)
+        return _attached
+
+
+def recognize_block(handle, block, engine="auto", lang="chi_sim+eng", oem=3, psm=3,
+                    structured=False):
+    """
+    子进程中识别共享帧里的一个文本块，只传句柄和块坐标
+    :param structured: 见 ocr.ocr_block
+    :return: (识别结果, 耗时秒数)
+    """
+    from . import ocr  # ocr 导入了本模块，这里延迟导入避免循环
+
+    start = time.perf_counter()
+    frame = attach(handle)
+    engine = engines.get_engine(engine, lang=lang, oem=oem, psm=psm)
+    result = ocr.ocr_block(frame.array, block, engine, structured)
+    return result, time.perf_counter() - start
@@ -0,0 +1,158 @@
+# ingest.py
+"""
+多页文档读取：按页惰性读取 PDF 和多页 TIFF，每次只在内存中保留一页
+    - TIFF：cv2.imreadmulti 按页读取，OpenCV 读不了时（如中文路径）退回 Pillow
+    - PDF：优先使用 PyMuPDF，未安装时调用 poppler 的 pdftoppm/pdfinfo 逐页栅格化
+普通图片视为只有一页的文档
+"""
+import re
+import subprocess
+
+import cv2
+import numpy as np
+
+from . import preprocessor
+
+_fitz = None
+_fitz_checked = False
+
+PDF_EXTS = (".pdf",)
+TIFF_EXTS = (".tif", ".tiff")
+DOCUMENT_EXTS = PDF_EXTS + TIFF_EXTS
+
+
+def is_document(file_path):
+    return file_path.lower().endswith(DOCUMENT_EXTS)
+
+
+def page_count(file_path):
+    """文档页数，普通图片为 1"""
+    lower = file_path.lower()
+    if lower.endswith(PDF_EXTS):
+        return _pdf_page_count(file_path)
+    if lower.endswith(TIFF_EXTS):
+        return _tiff_page_count(file_path)
+    return 1
+
+
+def read_page(file_path, index, dpi=300):
+    """
+    读取文档的第 index 页（从 0 开始）
+    :param dpi: PDF 栅格化分辨率
+    :return: numpy数组形式的图像（灰度或 BGR）
+    """
+    lower = file_path.lower()
+    if lower.endswith(PDF_EXTS):
+        return _pdf_read_page(file_path, index, dpi)
+    if lower.endswith(TIFF_EXTS):
+        return _tiff_read_page(file_path, index)
+    if index != 0:
+        raise IndexError(f"页码超出范围: {index}")
+    return preprocessor.read_image(file_path)
+
+
+def iter_pages(file_path, dpi=300):
+    """逐页读取文档，yield (页码(从1开始), 图像)"""
+    lower = file_path.lower()
+    fitz = _load_fitz() if lower.endswith(PDF_EXTS) else None
+    if fitz is not None:
+        # PyMuPDF 只打开一次文档，逐页渲染
+        with fitz.open(file_path) as doc:
+            for index, page in enumerate(doc):
+                yield index + 1, _fitz_render(page, dpi)
+        return
+    for index in range(page_count(file_path)):
+        yield index + 1, read_page(file_path, index, dpi)
+
+
+# ---------- TIFF ----------
+
+def _tiff_page_count(file_path):
+    try:
+        count = cv2.imcount(file_path)
+    except cv2.error:
+        count = 0
+    if count > 0:
+        return count
+    from PIL import Image
+    with Image.open(file_path) as im:
+        return getattr(im, "n_frames", 1)
+
+
+def _tiff_read_page(file_path, index):
+    try:
+        ok, pages = cv2.imreadmulti(file_path, start=index, count=1, flags=cv2.IMREAD_ANYCOLOR)
+    except cv2.error:
+        ok, pages = False, []
+    if ok and pages:
+        return pages[0]
+
+    from PIL import Image
+    with Image.open(file_path) as im:
+        im.seek(index)
+        frame = im.convert("L") if im.mode in ("1", "L", "I;16", "I") else im.convert("RGB")
+        page = np.array(frame)
+    if page.ndim == 3:
+        page = cv2.cvtColor(page, cv2.COLOR_RGB2BGR)
+    return page
+
+
+# ---------- PDF ----------
+
+def _load_fitz():
+    """PyMuPDF 导入较慢，第一次读取 PDF 时才导入；未安装时为 None"""
+    global _fitz, _fitz_checked
+    if not _fitz_checked:
+        try:
+            import pymupdf as module
+        except ImportError:
+            try:
+                import fitz as module  # 旧版本 PyMuPDF 的模块名
+            except ImportError:
+                module = None
+        _fitz, _fitz_checked = module, True
+    return _fitz
+
+
+def _fitz_render(page, dpi):
+    fitz = _load_fitz()
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY)
+    # samples 每行可能有对齐填充，按 stride 取出有效部分后复制，不再引用 pixmap 的缓冲区
+    buf = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return buf[:, :pix.width].copy()
+
+
+def _pdf_page_count(file_path):
+    fitz = _load_fitz()
+    if fitz is not None:
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    out = _run_poppler(["pdfinfo", file_path])
+    match = re.search(rb"^Pages:\s+(\d+)", out, re.MULTILINE)
+    if not match:
+        raise ValueError(f"无法读取PDF页数: {file_path}")
+    return int(match.group(1))
+
+
+def _pdf_read_page(file_path, index, dpi):
+    fitz = _load_fitz()
+    if fitz is not None:
+        with fitz.open(file_path) as doc:
+            return _fitz_render(doc[index], dpi)
+    page_no = str(index + 1)
+    data = _run_poppler(["pdftoppm", "-f", page_no, "-l", page_no, "-r", str(dpi),
+                         "-gray", "-png", "-singlefile", file_path])
+    page = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if page is None:
+        raise ValueError(f"无法栅格化PDF第{page_no}页: {file_path}")
+    return page
+
+
+def _run_poppler(cmd):
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except FileNotFoundError:
+        raise RuntimeError("读取PDF需要安装 PyMuPDF 或 poppler（pdftoppm/pdfinfo）")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(e.stderr.decode(errors="replace").strip() or f"{cmd[0]} 执行失败")
+    return result.stdout
@@ -0,0 +1,299 @@
+# instrument.py
+"""
+流程各阶段的耗时/内存统计
+
+    with instrument.profile("page.jpg", track_memory=True) as prof:
+        pipeline.process_array(img)
+    print(prof.to_dict())
+
+没有处于 profile() 中时，instrument.stage() 返回空上下文，几乎没有开销。
+每个阶段结束时以 DEBUG 级别写入 logging（logger 名为 "instrument"）。
+内存峰值使用 tracemalloc 统计，包含 numpy/OpenCV 返回的数组，不包含 OpenCV、tesseract 内部的临时缓冲。
+Linux 上整页还记录进程常驻内存（RSS）的峰值 peak_rss_bytes：开始时重置内核记录的 VmHWM，结束时读取，
+包含所有内部缓冲和已加载的模型，可以直接用来估算一台机器能同时运行多少个工作进程；
+同一进程中同时处理多页时，得到的是整个进程的峰值。
+
+tracemalloc 的峰值是整个进程共用的，不能按线程区分：两个统计内存的区段（不同的页，或同一页在
+线程池中并发执行的阶段，如 ocr_block）在时间上重叠时会互相重置、计入对方的分配。
+发生重叠的区段不给出内存数值（peak_bytes 为 None），而不是输出错误的数字；
+需要准确的内存数据时，请逐页顺序处理（batch --profile 的每个工作进程即是如此）。
+未处于 profile() 中的其他线程的分配仍会被计入，这部分无法排除。
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("instrument_profile", default=None)
+_noop = contextlib.nullcontext()
+
+# 正在统计内存的区段，tracemalloc 由第一个区段启动、最后一个区段停止
+_mem_lock = threading.Lock()
+_mem_active = []
+_started_tracing = False
+_rss_resettable = False
+
+
+class PageProfile:
+    """一张图像（或一页）各阶段的记录"""
+
+    def __init__(self, name=None, track_memory=False):
+        self.name = name
+        self.track_memory = track_memory
+        self.stages = []  # [{"stage", "seconds", "peak_bytes"}, ...]
+        self.seconds = 0.0
+        self.peak_bytes = None
+        self.peak_rss_bytes = None
+        self._max_traced = 0  # tracemalloc 绝对峰值，用于计算整页峰值
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, peak_bytes=None):
+        with self._lock:
+            self.stages.append({"stage": stage, "seconds": seconds, "peak_bytes": peak_bytes})
+        if logger.isEnabledFor(logging.DEBUG):
+            if peak_bytes is None:
+                logger.debug("%s %s: %.1f ms", self.name or "-", stage, seconds * 1000)
+            else:
+                logger.debug("%s %s: %.1f ms, peak %.1f MB", self.name or "-", stage,
+                             seconds * 1000, peak_bytes / 1e6)
+
+    def totals(self):
+        """按阶段汇总：{阶段: {"seconds": 总耗时, "count": 次数, "peak_bytes": 最大峰值}}"""
+        totals = {}
+        with self._lock:
+            for item in self.stages:
+                entry = totals.setdefault(item["stage"], {"seconds": 0.0, "count": 0, "peak_bytes": None})
+                entry["seconds"] += item["seconds"]
+                entry["count"] += 1
+                if item["peak_bytes"] is not None:
+                    entry["peak_bytes"] = max(entry["peak_bytes"] or 0, item["peak_bytes"])
+        return totals
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "seconds": round(self.seconds, 6),
+            "peak_bytes": self.peak_bytes,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "stages": [dict(item, seconds=round(item["seconds"], 6)) for item in self.stages],
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+def _reset_peak_rss():
+    """把进程的 RSS 峰值（VmHWM）重置为当前值；不支持时（非 Linux 或没有权限）返回 False"""
+    global _rss_resettable
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        _rss_resettable = False
+        return False
+    _rss_resettable = True
+    return True
+
+
+def _peak_rss():
+    """上次重置以来进程的 RSS 峰值（字节）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class _Tracked:
+    """一个正在统计内存的区段（整页或阶段）"""
+
+    def __init__(self, prof, is_stage):
+        self.prof = prof
+        self.is_stage = is_stage
+        self.overlapped = False
+        self.alone = True  # 开始时没有其他页在统计
+        self.base = 0
+
+
+def _begin_tracking(prof, is_stage):
+    global _started_tracing
+    section = _Tracked(prof, is_stage)
+    with _mem_lock:
+        for other in _mem_active:
+            if not other.is_stage:
+                section.alone = False
+            # 整页与它自己的阶段不算重叠：整页峰值本来就由各阶段的绝对峰值汇总
+            if other.prof is prof and other.is_stage != is_stage:
+                continue
+            other.overlapped = section.overlapped = True
+        if not _mem_active and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _mem_active.append(section)
+        # 重叠时不再重置峰值，以免破坏另一区段（它已被标记为重叠）
+        if not section.overlapped:
+            tracemalloc.reset_peak()
+        section.base = tracemalloc.get_traced_memory()[0]
+    return section
+
+
+def _end_tracking(section):
+    """结束统计，返回上次重置以来 tracemalloc 的绝对峰值"""
+    global _started_tracing
+    with _mem_lock:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        _mem_active.remove(section)
+        if not _mem_active and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+    return traced_peak
+
+
+def current():
+    """当前上下文中的 PageProfile，没有时为 None"""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def profile(name=None, track_memory=False):
+    """
+    统计代码块内各阶段的耗时
+    :param track_memory: 同时用 tracemalloc 统计各阶段的内存峰值（有额外开销），并记录整页的 RSS 峰值；
+        与其他页同时进行时整页和各阶段的 peak_bytes 为 None，见模块说明
+    """
+    prof = PageProfile(name, track_memory)
+    section = None
+    track_rss = False
+    if track_memory:
+        section = _begin_tracking(prof, False)
+        # 其他页正在统计时不重置 VmHWM，得到的是进程峰值（偏大），而不是把对方的数值改小
+        track_rss = _reset_peak_rss() if section.alone else _rss_resettable
+
+    token = _current.set(prof)
+    start = time.perf_counter()
+    try:
+        yield prof
+    finally:
+        prof.seconds = time.perf_counter() - start
+        _current.reset(token)
+        if section is not None:
+            # 各阶段开始时会重置峰值，整页峰值取各阶段绝对峰值与最后一段的最大值
+            peak = max(prof._max_traced, _end_tracking(section))
+            if not section.overlapped:
+                prof.peak_bytes = peak - section.base
+            if track_rss:
+                prof.peak_rss_bytes = _peak_rss()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s total: %.1f ms", name or "-", prof.seconds * 1000)
+
+
+def stage(name):
+    """记录一个阶段；不在 profile() 中时返回空上下文"""
+    prof = _current.get()
+    if prof is None:
+        return _noop
+    return _stage(prof, name)
+
+
+@contextlib.contextmanager
+def _stage(prof, name):
+    section = _begin_tracking(prof, True) if prof.track_memory else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if section is not None:
+            traced_peak = _end_tracking(section)
+            # 同一页内并发的阶段各自的峰值无法区分，但都属于这一页，仍计入整页峰值
+            with prof._lock:
+                prof._max_traced = max(prof._max_traced, traced_peak)
+            if not section.overlapped:
+                peak = traced_peak - section.base
+        prof.record(name, seconds, peak)
+
+
+class MetricsRegistry:
+    """汇总多张图像的阶段统计，可导出为 JSON 或 Prometheus 文本格式"""
+
+    def __init__(self, prefix="ocr"):
+        self.prefix = prefix
+        self.pages = 0
+        self.page_seconds = 0.0
+        self.page_peak_bytes = 0
+        self.page_peak_rss_bytes = 0
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, prof):
+        """加入一个 PageProfile 或其 to_dict() 结果"""
+        if not isinstance(prof, dict):
+            prof = prof.to_dict()
+        with self._lock:
+            self.pages += 1
+            self.page_seconds += prof["seconds"]
+            self.page_peak_bytes = max(self.page_peak_bytes, prof.get("peak_bytes") or 0)
+            self.page_peak_rss_bytes = max(self.page_peak_rss_bytes, prof.get("peak_rss_bytes") or 0)
+            for item in prof["stages"]:
+                entry = self.stages.setdefault(item["stage"], {"seconds": 0.0, "count": 0, "peak_bytes": 0})
+                entry["seconds"] += item["seconds"]
+                entry["count"] += 1
+                if item.get("peak_bytes") is not None:
+                    entry["peak_bytes"] = max(entry["peak_bytes"], item["peak_bytes"])
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "page_seconds": round(self.page_seconds, 6),
+                "page_peak_bytes": self.page_peak_bytes,
+                "page_peak_rss_bytes": self.page_peak_rss_bytes,
+                "stages": {name: dict(entry, seconds=round(entry["seconds"], 6))
+                           for name, entry in self.stages.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        p = self.prefix
+        data = self.to_dict()
+        lines = [
+            f"# HELP {p}_pages_total Pages processed.",
+            f"# TYPE {p}_pages_total counter",
+            f"{p}_pages_total {data['pages']}",
+            f"# HELP {p}_page_seconds_total Wall time spent on pages.",
+            f"# TYPE {p}_page_seconds_total counter",
+            f"{p}_page_seconds_total {data['page_seconds']}",
+            f"# HELP {p}_page_peak_bytes Largest traced allocation peak of a single page.",
+            f"# TYPE {p}_page_peak_bytes gauge",
+            f"{p}_page_peak_bytes {data['page_peak_bytes']}",
+            f"# HELP {p}_page_peak_rss_bytes Largest process resident set size while processing a page.",
+            f"# TYPE {p}_page_peak_rss_bytes gauge",
+            f"{p}_page_peak_rss_bytes {data['page_peak_rss_bytes']}",
+            f"# HELP {p}_stage_seconds Wall time per pipeline stage.",
+            f"# TYPE {p}_stage_seconds summary",
+        ]
+        for name, entry in sorted(data["stages"].items()):
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {entry["seconds"]}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {entry["count"]}')
+        lines.append(f"# HELP {p}_stage_peak_bytes Largest traced allocation peak per stage.")
+        lines.append(f"# TYPE {p}_stage_peak_bytes gauge")
+        for name, entry in sorted(data["stages"].items()):
+            lines.append(f'{p}_stage_peak_bytes{{stage="{name}"}} {entry["peak_bytes"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        """按扩展名写出：.prom/.txt 为 Prometheus 文本格式，其他为 JSON"""
+        text = self.to_prometheus() if file_path.endswith((".prom", ".txt")) else self.to_json()
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(text)
@@ -1,16 +1,26 @@
 # main.py
 import sys
 import os
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QPushButton, QTextEdit, QFileDialog, QMessageBox, QFrame
+    QLabel, QPushButton, QTextEdit, QFileDialog, QMessageBox, QFrame, QProgressBar
 )
 from PyQt5.QtGui import QPixmap, QImage, QDragEnterEvent, QDropEvent
-from PyQt5.QtCore import Qt, QMimeData
-import preprocessor
-import ocr
-import cv2
-import numpy as np
+from PyQt5.QtCore import (
+    Qt, QMimeData, QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+)
+
+# 核心模块（OpenCV、numpy、识别流程）不在启动时导入：窗口显示后由后台线程预先导入，
+# 各方法中用到时再从已导入的模块中取得，启动只需要加载 PyQt5
+CORE_MODULES = ("pipeline", "document", "ingest", "cache")
+
+
+def warm_up():
+    """在后台线程中导入核心模块，第一次加载图像时不用再等待"""
+    import importlib
+    for name in CORE_MODULES:
+        importlib.import_module(f".{name}", __package__)
 
 
 class DropLabel(QLabel):
@@ -70,6 +80,63 @@ class DropLabel(QLabel):
             print("Error: main window has no method 'load_image'")
 
 
+class WorkerSignals(QObject):
+    """后台任务的信号，由工作线程发出，在界面线程中处理"""
+    stage = pyqtSignal(str)
+    block_done = pyqtSignal(int, int, str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class PipelineWorker(QRunnable):
+    """在线程池中运行预处理/OCR，避免阻塞界面"""
+
+    def __init__(self, task):
+        """
+        :param task: task(worker) -> 结果；任务内通过 worker.report_stage / worker.report_block 汇报进度
+        """
+        super().__init__()
+        self.task = task
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report_stage(self, stage):
+        from . import ocr
+
+        # 预处理各阶段之间检查是否已取消
+        if self.cancel_event.is_set():
+            raise ocr.OCRCancelled()
+        self.signals.stage.emit(stage)
+
+    def report_block(self, index, total, text):
+        self.signals.block_done.emit(index, total, text)
+
+    @pyqtSlot()
+    def run(self):
+        from . import ocr
+
+        try:
+            result = self.task(self)
+        except ocr.OCRCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+STAGE_NAMES = {
+    "gray": "灰度化",
+    "denoise": "去噪",
+    "rotation": "旋转矫正",
+    "threshold": "二值化",
+}
+
+
 class OCRApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -101,6 +168,7 @@ class OCRApp(QMainWindow):
         self.ocr_btn = QPushButton("运行OCR")
         self.save_btn = QPushButton("保存结果")
         self.clear_btn = QPushButton("清空")
+        self.cancel_btn = QPushButton("取消")
 
         # 设置按钮样式
         button_style = """
@@ -125,6 +193,7 @@ class OCRApp(QMainWindow):
         self.ocr_btn.setStyleSheet(button_style)
         self.save_btn.setStyleSheet(button_style)
         self.clear_btn.setStyleSheet(button_style)
+        self.cancel_btn.setStyleSheet(button_style)
 
         # 按钮连接事件
         self.load_btn.clicked.connect(self.select_image)
@@ -132,6 +201,7 @@ class OCRApp(QMainWindow):
         self.ocr_btn.clicked.connect(self.run_ocr)
         self.save_btn.clicked.connect(self.save_results)
         self.clear_btn.clicked.connect(self.clear_all)
+        self.cancel_btn.clicked.connect(self.cancel_task)
 
         # 添加按钮
         button_layout.addWidget(self.load_btn)
@@ -139,8 +209,20 @@ class OCRApp(QMainWindow):
         button_layout.addWidget(self.ocr_btn)
         button_layout.addWidget(self.save_btn)
         button_layout.addWidget(self.clear_btn)
+        button_layout.addWidget(self.cancel_btn)
         main_layout.addLayout(button_layout)
 
+        # 进度显示
+        progress_layout = QHBoxLayout()
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("font-size: 14px; color: #2c3e50;")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setVisible(False)
+        progress_layout.addWidget(self.status_label)
+        progress_layout.addWidget(self.progress_bar)
+        main_layout.addLayout(progress_layout)
+
         # 拖拽提示
         drag_label = QLabel("或者拖放图像文件到下方区域")
         drag_label.setAlignment(Qt.AlignCenter)
@@ -241,18 +323,32 @@ class OCRApp(QMainWindow):
         self.original_image = None
         self.processed_image = None
         self.ocr_results = []
+        self.ocr_document = None  # 带坐标和置信度的结构化结果，见 document.build_page
+        self.transform = None  # 原图到预处理后图像的仿射矩阵
         self.current_image_path = None
+        self.image_digest = None
+
+        # 结果缓存：重复加载同一图像时跳过预处理和OCR，第一次加载图像时创建
+        self.cache = None
+
+        # 后台任务
+        self.thread_pool = QThreadPool.globalInstance()
+        self.worker = None
+        self.partial_results = {}
 
         # 禁用初始按钮
         self.process_btn.setEnabled(False)
         self.ocr_btn.setEnabled(False)
         self.save_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
     def select_image(self):
         """通过文件资源管理器选择图像"""
         file_path, _ = QFileDialog.getOpenFileName(
             self, "选择图像文件", "",
-            "图像文件 (*.png *.jpg *.jpeg *.bmp *.tiff)"
+            "图像文件 (*.png *.jpg *.jpeg *.bmp *.tif *.tiff *.pdf)"
         )
 
         if file_path:
@@ -260,26 +356,31 @@ class OCRApp(QMainWindow):
 
     def load_image(self, file_path):
         """加载图像文件"""
-        try:
-            # 使用OpenCV读取图像
-            self.current_image_path = file_path
-            self.original_image = cv2.imread(file_path)
+        if self.worker is not None:
+            return
+        from . import cache as result_cache
+        from . import ingest
 
-            if self.original_image is None:
-                 # 尝试使用 fromfile + imdecode 兼容中文路径
-                abs_path = os.path.abspath(file_path)
-                data = np.fromfile(abs_path, dtype=np.uint8)
-                self.original_image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        try:
+            if self.cache is None:
+                self.cache = result_cache.ResultCache(
+                    cache_dir=os.path.join(os.path.expanduser("~"), ".ocr_cache"))
 
-                if self.original_image is None:
-                    raise ValueError(f"无法读取图像文件: {file_path}")
+            # 读取图像；PDF/多页TIFF 只读取第一页，整份文档请使用 batch.py
+            self.current_image_path = file_path
+            self.original_image = ingest.read_page(file_path, 0)
+            pages = ingest.page_count(file_path) if ingest.is_document(file_path) else 1
+            self.image_digest = result_cache.hash_array(self.original_image)
 
             # 显示原始图像
             self.display_image(self.original_image, self.original_label)
 
             # 更新标签文本
             filename = os.path.basename(file_path)
-            self.original_label.setText(f"已加载: {filename}")
+            if pages > 1:
+                self.original_label.setText(f"已加载: {filename}（第1页，共{pages}页）")
+            else:
+                self.original_label.setText(f"已加载: {filename}")
             self.original_label.setStyleSheet("""
                 QLabel {
                     border: 2px solid #3498db;
@@ -304,6 +405,7 @@ class OCRApp(QMainWindow):
             """)
             self.result_text.clear()
             self.ocr_results = []
+            self.ocr_document = None
 
             # 启用按钮
             self.process_btn.setEnabled(True)
@@ -324,57 +426,156 @@ class OCRApp(QMainWindow):
             """)
 
     def preprocess_image(self):
-        if self.original_image is None:
+        if self.original_image is None or self.worker is not None:
             return
+        from . import pipeline
+        from . import preprocessor
 
-        try:
+        image, digest, cache = self.original_image, self.image_digest, self.cache
+
+        def task(worker):
             # 使用新函数处理内存中的图像
-            self.processed_image = preprocessor.preprocess_image_from_array(self.original_image)
+            return pipeline.preprocess(image, cache=cache, digest=digest,
+                                       on_stage=worker.report_stage, return_transform=True)
 
-            # 显示处理后的图像
-            self.display_image(self.processed_image, self.processed_label)
+        worker = self._start_worker(task, self.on_preprocess_finished, "图像预处理失败")
+        worker.signals.stage.connect(self.on_stage)
+        self.progress_bar.setRange(0, len(preprocessor.STAGES))
+        self.progress_bar.setValue(0)
+        self.status_label.setText("预处理中...")
 
-            # 更新标签
-            self.processed_label.setText("")
-            self.processed_label.setStyleSheet("")
+    def on_stage(self, stage):
+        from . import preprocessor
 
-            # 启用OCR按钮
-            self.ocr_btn.setEnabled(True)
+        self.progress_bar.setValue(preprocessor.STAGES.index(stage))
+        self.status_label.setText(f"预处理中：{STAGE_NAMES.get(stage, stage)}")
 
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"图像预处理失败: {str(e)}")
+    def on_preprocess_finished(self, result):
+        self.processed_image, self.transform = result
+
+        # 显示处理后的图像
+        self.display_image(self.processed_image, self.processed_label)
+
+        # 更新标签
+        self.processed_label.setText("")
+        self.processed_label.setStyleSheet("")
+        self.status_label.setText("预处理完成")
 
     def run_ocr(self):
-        if self.processed_image is None:
+        if self.processed_image is None or self.worker is not None:
             return
+        from . import pipeline
 
-        try:
-            # 运行OCR
-            self.ocr_results = ocr.run_ocr(self.processed_image)
+        image, processed = self.original_image, self.processed_image
+        digest, cache = self.image_digest, self.cache
 
-            # 显示结果
-            result_text = "\n\n".join(self.ocr_results)
-            self.result_text.setPlainText(result_text)
+        def task(worker):
+            # 词坐标和置信度与文本来自同一次识别，保存为 hOCR/ALTO 时不需要重新识别
+            return pipeline.recognize(image, processed, cache=cache, digest=digest,
+                                      on_block=worker.report_block,
+                                      cancel_event=worker.cancel_event, structured=True)
 
-            # 启用保存按钮
-            self.save_btn.setEnabled(True)
-
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"OCR识别失败: {str(e)}")
+        self.ocr_results = []
+        self.partial_results = {}
+        self.result_text.clear()
+        worker = self._start_worker(task, self.on_ocr_finished, "OCR识别失败")
+        worker.signals.block_done.connect(self.on_block_done)
+        self.progress_bar.setRange(0, 0)  # 文本块数量未知前显示为忙碌状态
+        self.status_label.setText("识别中...")
+
+    def on_block_done(self, index, total, text):
+        # 按阅读顺序显示已经完成的文本块
+        self.partial_results[index] = text
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(len(self.partial_results))
+        self.status_label.setText(f"识别中：{len(self.partial_results)}/{total}")
+        done = [self.partial_results[i] for i in sorted(self.partial_results)]
+        self.result_text.setPlainText("\n\n".join(done))
+
+    def on_ocr_finished(self, results):
+        from . import document
+        from . import ocr
+
+        self.ocr_results = [ocr.block_text(result) for result in results]
+        h, w = self.original_image.shape[:2]
+        self.ocr_document = document.build_page(results, w, h, self.transform)
+
+        # 显示结果
+        result_text = "\n\n".join(self.ocr_results)
+        self.result_text.setPlainText(result_text)
+        self.status_label.setText(f"识别完成，共 {len(results)} 个文本块")
+
+    def cancel_task(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.status_label.setText("正在取消...")
+
+    def _start_worker(self, task, on_finished, error_title):
+        """在线程池中启动后台任务，任务结束前禁用操作按钮"""
+        worker = PipelineWorker(task)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.failed.connect(
+            lambda message: QMessageBox.critical(self, "错误", f"{error_title}: {message}"))
+        worker.signals.cancelled.connect(lambda: self.status_label.setText("已取消"))
+        for signal in (worker.signals.finished, worker.signals.failed, worker.signals.cancelled):
+            signal.connect(self._on_worker_done)
+
+        self.worker = worker
+        self._update_buttons()
+        self.progress_bar.setVisible(True)
+        self.thread_pool.start(worker)
+        return worker
+
+    def _on_worker_done(self, *args):
+        self.worker = None
+        self.progress_bar.setVisible(False)
+        self._update_buttons()
+
+    def _update_buttons(self):
+        busy = self.worker is not None
+        self.load_btn.setEnabled(not busy)
+        self.clear_btn.setEnabled(not busy)
+        self.process_btn.setEnabled(not busy and self.original_image is not None)
+        self.ocr_btn.setEnabled(not busy and self.processed_image is not None)
+        self.save_btn.setEnabled(not busy and bool(self.ocr_results))
+        self.cancel_btn.setEnabled(busy)
+
+    def closeEvent(self, event):
+        # 关闭窗口时取消后台任务，等待线程结束
+        if self.worker is not None:
+            self.worker.cancel()
+        self.thread_pool.waitForDone()
+        super().closeEvent(event)
 
     def save_results(self):
         if not self.ocr_results:
             return
 
-        file_path, _ = QFileDialog.getSaveFileName(
+        filters = {
+            "文本文件 (*.txt)": "txt",
+            "JSON，含坐标和置信度 (*.json)": "json",
+            "hOCR (*.hocr)": "hocr",
+            "ALTO XML (*.xml)": "alto",
+        }
+        file_path, selected = QFileDialog.getSaveFileName(
             self, "保存OCR结果", "",
-            "文本文件 (*.txt)"
+            ";;".join(filters)
         )
 
         if file_path:
+            from . import document
+
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write("\n\n".join(self.ocr_results))
+                fmt = filters.get(selected, "txt")
+                if not os.path.splitext(file_path)[1]:
+                    file_path += document.FORMAT_EXTS[fmt]
+                if fmt == "txt":
+                    with open(file_path, 'w', encoding='utf-8') as f:
+                        f.write("\n\n".join(self.ocr_results))
+                else:
+                    image_name = os.path.basename(self.current_image_path or "")
+                    document.write(self.ocr_document, file_path, fmt, image_name)
                 QMessageBox.information(self, "成功", f"结果已成功保存到:\n{file_path}")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
@@ -384,7 +585,11 @@ class OCRApp(QMainWindow):
         self.original_image = None
         self.processed_image = None
         self.ocr_results = []
+        self.ocr_document = None
+        self.transform = None
         self.current_image_path = None
+        self.image_digest = None
+        self.status_label.setText("")
 
         self.original_label.setText("拖放图像文件到这里\n或点击上方按钮选择")
         self.original_label.setStyleSheet("""
@@ -421,7 +626,12 @@ class OCRApp(QMainWindow):
             h, w = image.shape
             bytes_per_line = w
             qimg = QImage(image.data, w, h, bytes_per_line, QImage.Format_Grayscale8)
-        else:  # 彩色图
+        elif hasattr(QImage, "Format_BGR888"):  # 彩色图，Qt 5.14 起可直接显示 BGR，不再复制一份 RGB
+            h, w, ch = image.shape
+            qimg = QImage(image.data, w, h, image.strides[0], QImage.Format_BGR888)
+        else:
+            import cv2
+
             # 将BGR转换为RGB
             rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             h, w, ch = rgb_image.shape
@@ -440,7 +650,7 @@ class OCRApp(QMainWindow):
         label.setAlignment(Qt.AlignCenter)
 
 
-if __name__ == "__main__":
+def main():
     app = QApplication(sys.argv)
 
     # 设置应用样式
@@ -464,4 +674,8 @@ if __name__ == "__main__":
 
     window = OCRApp()
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
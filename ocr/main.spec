@@ -4,15 +4,15 @@
 block_cipher = None
 
 a = Analysis(
-    ['main.py'],# 需要打包的文件
-    pathex=[],
+    ['../rectxt.py'],# 需要打包的文件；入口在包外，包内模块按 ocr.xxx 导入
+    pathex=['..'],
     binaries=[],
     datas=[],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['tkinter'],# 界面只用 PyQt5
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -1,84 +1,383 @@
-import pytesseract
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import cv2
+import numpy as np
+
+from . import engines
+from . import instrument
+from . import preprocessor
+from . import script
+
+logger = logging.getLogger(__name__)
+
+
+class OCRCancelled(Exception):
+    """识别过程被 cancel_event 取消"""
+
+
+def _dilate_blocks(binary, kernel_size, min_h, min_w):
+    """膨胀二值图后取外轮廓的外接矩形，按从左到右排序并过滤小噪声"""
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size)
+    dilate = cv2.dilate(binary, kernel, iterations=1)
+    cnts, _ = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # 每个轮廓只计算一次外接矩形，再从左到右排序
+    rects = sorted((cv2.boundingRect(c) for c in cnts), key=lambda r: r[0])
+    return [(x, y, w, h) for x, y, w, h in rects if h > min_h and w > min_w]
 
-# 分中英文检测文本块
-def blocks_detection(gray_img):
+
+# 版面检测的尺寸以字高为单位（见 preprocessor.text_height），与输入分辨率无关：
+# 膨胀核 (宽, 高)，以及块的最小高度、最小宽度
+COLUMN_KERNEL = (0.2, 0.8)
+COLUMN_MIN_SIZE = (12.5, 1.25)
+LINE_KERNEL = (0.6, 0.45)
+LINE_MIN_SIZE = (1.75, 0.7)
+# 文字太少、无法统计字高时使用
+DEFAULT_TEXT_HEIGHT = 16
+
+
+def _layout_sizes(text_h, kernel, min_size):
+    """把以字高为单位的尺寸换算为像素：(膨胀核, 最小高度, 最小宽度)"""
+    kernel_px = tuple(max(1, int(round(k * text_h))) for k in kernel)
+    return kernel_px, min_size[0] * text_h, min_size[1] * text_h
+
+
+def _text_height(gray_img, text_h):
+    if text_h is None:
+        text_h = preprocessor.estimate_text_height(gray_img) or DEFAULT_TEXT_HEIGHT
+        logger.debug("text height: %.1f", text_h)
+    return text_h
+
+
+def detect_layout(gray_img, text_h=None, mode=None):
+    """
+    统一的文本块检测：高斯模糊和 Otsu 二值化只做一次，
+    先用竖直结构元素检测列（多列英文），没有结果时复用同一张二值图检测行块（中文）
+    :param text_h: 字高（像素），None 时由连通域统计；膨胀核和尺寸阈值都以字高为单位
+    :param mode: 只按 "column" 或 "line" 检测，None 时自动选择
+    :return: (mode, blocks, scores)
+        mode   "column" 或 "line"
+        blocks [(x, y, w, h), ...]，从左到右排序
+        scores 每个块内前景像素的占比
+    """
     # 高斯模糊平滑
     blur = cv2.GaussianBlur(gray_img, (7, 7), 0)
-    
-    # 自适应阈值 + 反色（二值化）
-    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 
-    # 结构元素，竖直结构更适合列检测
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 13))
-    dilate = cv2.dilate(thresh, kernel, iterations=1)
-    #cv2.imshow("Dilate", dilate)
-    #cv2.waitKey(0)
-    # 查找轮廓
-    cnts, _ = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # 从左到右排序
-    cnts = sorted(cnts, key=lambda c: cv2.boundingRect(c)[0])
+    # Otsu 二值化 + 反色；中文检测使用的正向二值图即为其取反，阈值相同
+    _, thresh_inv = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    text_h = _text_height(gray_img, text_h)
 
+    # 竖直结构更适合列检测
     blocks = []
-    for c in cnts:
-        x, y, w, h = cv2.boundingRect(c)
-        if h > 200 and w > 20:  # 过滤小噪声
-            blocks.append((x, y, w, h))
-    
-    print(f"[INFO] blocks number0: {len(blocks)}")
+    detected = "column"
+    if mode != "line":
+        kernel, min_h, min_w = _layout_sizes(text_h, COLUMN_KERNEL, COLUMN_MIN_SIZE)
+        blocks = _dilate_blocks(thresh_inv, kernel, min_h=min_h, min_w=min_w)
+        logger.debug("blocks number0: %d", len(blocks))
+
+    if mode == "line" or (mode is None and len(blocks) == 0):
+        detected = "line"
+        thresh = cv2.bitwise_not(thresh_inv)
+        kernel, min_h, min_w = _layout_sizes(text_h, LINE_KERNEL, LINE_MIN_SIZE)
+        blocks = _dilate_blocks(thresh, kernel, min_h=min_h, min_w=min_w)
+        logger.debug("blocks number1: %d", len(blocks))
+
+    scores = [cv2.countNonZero(thresh_inv[y:y+h, x:x+w]) / float(w * h)
+              for x, y, w, h in blocks]
+    return detected, blocks, scores
+
+
+# 分中英文检测文本块（单独使用时各自完成模糊和二值化，run_ocr 使用 detect_layout）
+def blocks_detection(gray_img, text_h=None):
+    blur = cv2.GaussianBlur(gray_img, (7, 7), 0)
+    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    kernel, min_h, min_w = _layout_sizes(_text_height(gray_img, text_h), COLUMN_KERNEL, COLUMN_MIN_SIZE)
+    blocks = _dilate_blocks(thresh, kernel, min_h=min_h, min_w=min_w)
+    logger.debug("blocks number0: %d", len(blocks))
     return blocks
 
-def blocks_detection_Chinese(gray_img):
-    # 高斯模糊平滑
+
+def blocks_detection_Chinese(gray_img, text_h=None):
     blur = cv2.GaussianBlur(gray_img, (7, 7), 0)
-    
-    # 自适应阈值 + 反色（二值化）
     _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel, min_h, min_w = _layout_sizes(_text_height(gray_img, text_h), LINE_KERNEL, LINE_MIN_SIZE)
+    blocks = _dilate_blocks(thresh, kernel, min_h=min_h, min_w=min_w)
+    logger.debug("blocks number1: %d", len(blocks))
+    return blocks
 
-    # 结构元素，竖直结构更适合列检测
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (int(gray_img.shape[1]*0.02), 13))
-    dilate = cv2.dilate(thresh, kernel, iterations=1)
-    #cv2.imshow("Dilate", dilate)
-    #cv2.waitKey(0)
-    # 查找轮廓
-    cnts, _ = cv2.findContours(dilate, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # 从左到右排序
-    cnts = sorted(cnts, key=lambda c: cv2.boundingRect(c)[0])
 
-    blocks = []
-    for c in cnts:
-        x, y, w, h = cv2.boundingRect(c)
-        if h > 50 and w > 20:  # 过滤小噪声
-            blocks.append((x, y, w, h))
-    
-    print(f"[INFO] blocks number1: {len(blocks)}")
-    return blocks
+# ---------- 每块的 tesseract 配置 ----------
+
+# tesseract 页面分割模式
+PSM_AUTO = 3      # 自动版面分析
+PSM_COLUMN = 4    # 单列、字号不一
+PSM_BLOCK = 6     # 单个均匀的文本块
+PSM_LINE = 7      # 单行
+PSM_WORD = 8      # 单个词
+PSM_SPARSE = 11   # 稀疏文本
+
+# 空白块判断：墨迹少于 MIN_INK_PIXELS 的一律为空白；不超过 BLANK_RATIO_MAX_AREA 的小块
+# 再看墨迹占比；大块中稀疏的一行字占比可能不到千分之一，改为数字符状连通域
+BLANK_INK_RATIO = 0.002
+BLANK_RATIO_MAX_AREA = 256 * 256
+BLANK_MIN_GLYPHS = 2
+MIN_INK_PIXELS = 20
 
 
+def _runs(mask):
+    """一维布尔数组中连续 True 段的 [(起点, 终点), ...]"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
 
-def run_ocr (preprocessed_img, lang="chi_sim+eng"):
 
-    results = []
+def is_blank(roi):
+    """墨迹过少的块（空白、零星噪点）视为空白，不送入 tesseract"""
+    mask = roi < 128
+    ink = int(np.count_nonzero(mask))
+    if ink < MIN_INK_PIXELS:
+        return True
+    if roi.size <= BLANK_RATIO_MAX_AREA:
+        return ink < roi.size * BLANK_INK_RATIO
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    return int(np.count_nonzero((heights >= 4) & (areas >= 8))) < BLANK_MIN_GLYPHS
+
+
+def parse_psm(value):
+    """解析命令行/查询参数中的 psm："auto" 或整数"""
+    if value == "auto":
+        return value
+    return int(value)
+
+
+def choose_psm(roi):
+    """
+    根据块的几何形状选择 psm，块已由 detect_layout 切分出来，不需要 tesseract 再做整页版面分析：
+        单行 -> 7，单行且没有词间距 -> 8，行距远大于行高 -> 11，
+        行高差别大（标题 + 正文）-> 4，其他多行文本 -> 6
+    :param roi: 白底黑字的二值图
+    """
+    ink = roi < 128
+    h, w = ink.shape
+    rows = [r for r in _runs(ink.sum(axis=1) > max(1, w // 200)) if r[1] - r[0] >= 3]
+    if not rows:
+        return PSM_SPARSE
+    heights = np.array([y1 - y0 for y0, y1 in rows])
+    line_h = float(np.median(heights))
+
+    if len(rows) == 1:
+        y0, y1 = rows[0]
+        cols = _runs(ink[y0:y1].any(axis=0))
+        gaps = [x0 - prev_x1 for (_, prev_x1), (x0, _) in zip(cols, cols[1:])]
+        return PSM_LINE if any(g > line_h * 0.3 for g in gaps) else PSM_WORD
+
+    gaps = np.array([y0 - prev_y1 for (_, prev_y1), (y0, _) in zip(rows, rows[1:])])
+    if np.median(gaps) > 1.5 * line_h:
+        return PSM_SPARSE
+    if heights.max() > 1.5 * line_h:
+        return PSM_COLUMN
+    return PSM_BLOCK
+
+
+def _empty_result(block, structured):
+    if not structured:
+        return ""
+    x, y, w, h = block
+    return {"box": [int(x), int(y), int(w), int(h)], "text": "", "words": []}
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise OCRCancelled()
+
+
+def ocr_block(img, block, engine, structured=False):
+    """
+    用指定引擎识别单个文本块 (x, y, w, h)
+    :param structured: 返回 {"box", "text", "words"}，词的坐标换算到整张 img 上；否则只返回文本
+    """
+    x, y, w, h = block
+    roi = img[y:y+h, x:x+w]
+    if not structured:
+        return engine.recognize(roi)
+
+    data = engine.recognize_data(roi)
+    for word in data["words"]:
+        word["box"][0] += x
+        word["box"][1] += y
+    return {"box": [int(x), int(y), int(w), int(h)], "text": data["text"], "words": data["words"]}
+
+
+def block_text(result):
+    """run_ocr 单块结果中的文本（structured 时为字典）"""
+    return result["text"] if isinstance(result, dict) else result
+
+
+def detect_blocks(preprocessed_img, tile=None, max_workers=None):
+    """
+    检测文本块，与 run_ocr 使用的相同
+    :param tile: 按该边长分块并行检测，见 tiling.detect_blocks
+    :return: [(x, y, w, h), ...]，按阅读顺序排列
+    """
+    if tile:
+        from . import tiling  # tiling 依赖本模块，这里延迟导入避免循环
+        return tiling.detect_blocks(preprocessed_img, tile=tile, max_workers=max_workers)
+    _, blocks, _ = detect_layout(preprocessed_img)
+    return blocks
+
+
+def run_ocr (preprocessed_img, lang="chi_sim+eng", max_workers=None, engine="auto", oem=3, psm=3,
+             on_block=None, cancel_event=None, block_executor=None, structured=False, reuse=None,
+             tile=None):
+    """
+    检测文本块并逐块识别
+    :param preprocessed_img: 预处理后的二值图像
+    :param lang: tesseract 语言；"auto" 按每块的连通域统计选择 eng / chi_sim，
+                 "auto:osd" 整页用 tesseract OSD 判断，无法判断时都使用 chi_sim+eng，见 script.py
+    :param max_workers: 并发识别的文本块数，默认等于CPU核数；1 表示串行
+    :param engine: 引擎名（"auto"/"tesserocr"/"pytesseract"）或引擎实例，见 engines.py
+    :param oem: tesseract --oem
+    :param psm: tesseract --psm；"auto" 按每块的几何形状选择，见 choose_psm
+    :param on_block: 每块识别完成后回调 on_block(块序号, 块总数, 文本)，在调用方线程中执行
+    :param cancel_event: threading.Event，被设置后不再开始新的文本块，并抛出 OCRCancelled
+    :param block_executor: 在该进程池中识别文本块：图像放入共享内存，子进程只收到句柄和块坐标；
+                           此时 engine 按名称在子进程中创建，max_workers 不起作用
+    :param structured: 每块返回 {"box", "text", "words", "lang", "psm"}（与文本来自同一次识别），见 ocr_block
+    :param reuse: 可调用对象 reuse(图像, 文本块列表)，返回与文本块一一对应的已有结果，
+                  不为 None 的块不再识别，见 fingerprint.BlockIndex.revision
+    :param tile: 按该边长分块并行检测文本块，合并跨接缝的块，过高的块切开后分段识别，见 tiling.detect_blocks
+    :return: 按阅读顺序排列的每块识别结果；空白块（见 is_blank）不调用 tesseract，结果为空
+    """
     # 检测文本块
-    blocks = blocks_detection(preprocessed_img)
-    if len(blocks) == 0:
-        blocks = blocks_detection_Chinese(preprocessed_img)
-        for i, (x, y, w, h) in enumerate(blocks, 1):
-            roi0 = preprocessed_img[y:y+h, x:x+w]
-            # ocr识别    
-            custom_config = r'--oem 3 --psm 3'  
-            text = pytesseract.image_to_string(roi0, lang=lang, config=custom_config)
-            results.append(text)
+    with instrument.stage("layout"):
+        blocks = detect_blocks(preprocessed_img, tile=tile, max_workers=max_workers)
+
+    # 每块使用的语言
+    if lang in script.AUTO_METHODS:
+        with instrument.stage("script"):
+            langs = script.choose_langs(preprocessed_img, blocks, script.AUTO_METHODS[lang])
+    else:
+        langs = [lang] * len(blocks)
+
+    # 每块的 psm；空白块为 None，不调用 tesseract
+    rois = [preprocessed_img[y:y+h, x:x+w] for x, y, w, h in blocks]
+    psms = [None if is_blank(roi) else (choose_psm(roi) if psm == "auto" else psm)
+            for roi in rois]
+    logger.debug("block psm: %s", psms)
+
+    # 不需要调用 tesseract 的块：空白块，以及可以沿用已有结果的块
+    known = [_empty_result(block, structured) if p is None else None
+             for block, p in zip(blocks, psms)]
+    if reuse is not None:
+        with instrument.stage("reuse"):
+            for i, result in enumerate(reuse(preprocessed_img, blocks)):
+                if result is not None and known[i] is None:
+                    known[i] = result
+
+    if block_executor is not None:
+        return _run_blocks_in_processes(preprocessed_img, blocks, block_executor, engine,
+                                        langs, oem, psms, known, on_block, cancel_event,
+                                        structured)
+
+    # 引擎按 (语言, psm) 缓存，配置相同的块共用一个实例
+    if isinstance(engine, str):
+        engine_name = engine
+    elif lang in script.AUTO_METHODS or psm == "auto":
+        engine_name = engine.name
     else:
-        for i, (x, y, w, h) in enumerate(blocks, 1):
-            roi1 = preprocessed_img[y:y+h, x:x+w]
-            # OCR识别
-            custom_config = r'--oem 3 --psm 3'  
-            text = pytesseract.image_to_string(roi1, lang=lang, config=custom_config)
-            results.append(text)
+        engine_name = None
+
+    def recognize(i, block):
+        _check_cancelled(cancel_event)
+        if known[i] is not None:
+            return known[i]
+        block_engine = engine if engine_name is None else engines.get_engine(
+            engine_name, lang=langs[i], oem=oem, psm=psms[i])
+        with instrument.stage("ocr_block"):
+            result = ocr_block(preprocessed_img, block, block_engine, structured)
+        if structured:
+            result.update(lang=langs[i], psm=psms[i])
+        return result
+
+    # ocr识别
+    total = len(blocks)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, total)
 
+    results = [None] * total
+    if max_workers <= 1:
+        for i, block in enumerate(blocks):
+            results[i] = recognize(i, block)
+            if on_block is not None:
+                on_block(i, total, block_text(results[i]))
+        _check_cancelled(cancel_event)
+        return results
+
+    # tesseract 子进程或释放了GIL的 tesserocr 都可以用线程并行；结果按块序号放回，保持阅读顺序
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 复制上下文到工作线程，每块的耗时记入调用方的 profile
+        futures = {executor.submit(contextvars.copy_context().run, recognize, i, block): i
+                   for i, block in enumerate(blocks)}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_block is not None:
+                    on_block(i, total, block_text(results[i]))
+        except BaseException:
+            # 出错或取消时丢弃尚未开始的文本块
+            for future in futures:
+                future.cancel()
+            raise
+
+    # 取消时即使所有块都已开始，也不把结果当作成功返回
+    _check_cancelled(cancel_event)
     return results
 
 
+def _run_blocks_in_processes(img, blocks, executor, engine, langs, oem, psms, known,
+                             on_block, cancel_event, structured=False):
+    """
+    run_ocr 的多进程版本：整页只复制进共享内存一次，每块只传句柄和坐标
+    langs、psms 为每块的语言和 psm；known 中已有结果的块（空白块、沿用的块）不提交
+    """
+    _check_cancelled(cancel_event)
+    engine_name = engine if isinstance(engine, str) else engine.name
+    # 共享内存只在使用进程池时需要，按需导入
+    from . import framestore
+
+    prof = instrument.current()
+    total = len(blocks)
+    results = [None] * total
+    for i in range(total):
+        if known[i] is not None:
+            results[i] = known[i]
+            if on_block is not None:
+                on_block(i, total, block_text(results[i]))
+    with framestore.SharedFrame.create(img) as frame:
+        futures = {executor.submit(framestore.recognize_block, frame.handle, block,
+                                   engine_name, langs[i], oem, psms[i], structured): i
+                   for i, block in enumerate(blocks) if known[i] is None}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i], seconds = future.result()
+                if structured:
+                    results[i].update(lang=langs[i], psm=psms[i])
+                if prof is not None:
+                    prof.record("ocr_block", seconds)
+                if on_block is not None:
+                    on_block(i, total, block_text(results[i]))
+                _check_cancelled(cancel_event)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
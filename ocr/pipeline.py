@@ -0,0 +1,188 @@
+# pipeline.py
+import numpy as np
+
+from . import preprocessor
+from . import ocr
+from . import cache as result_cache
+from . import ingest
+from . import document
+from . import engines
+
+
+def preprocess(img_array, denoise="nlm", cache=None, digest=None, on_stage=None,
+               return_transform=False, tile=None, buffers=None, skip_non_text=False):
+    """
+    预处理，命中缓存时直接返回缓存的结果（跳过去噪和旋转矫正）
+    :param denoise: 去噪方式，见 preprocessor.denoise_before
+    :param on_stage: 阶段回调，见 preprocessor.preprocess_image_from_array
+    :param cache: cache.ResultCache，None 表示不使用缓存
+    :param digest: 输入图像的哈希，未提供时根据 img_array 计算
+    :param return_transform: 返回 (预处理后的图像, 原图到预处理后的仿射矩阵)
+    :param tile: 大图分块处理，见 tiling.preprocess_tiled
+    :param buffers: preprocessor.BufferPool，中间结果放在可重复使用的工作缓冲区中；
+                    True 表示使用当前线程的缓冲区，见 preprocessor.thread_buffers
+    :param skip_non_text: 空白和非文本页面抛出 preprocessor.PageSkipped，见 preprocessor.classify_page
+    """
+    buffers = preprocessor.thread_buffers() if buffers is True else buffers or None
+    if cache is None:
+        return preprocessor.preprocess_image_from_array(img_array, denoise=denoise,
+                                                        on_stage=on_stage,
+                                                        return_transform=return_transform,
+                                                        tile=tile, buffers=buffers,
+                                                        skip_non_text=skip_non_text)
+
+    # 缓存条目与 skip_non_text 无关，分类在查缓存之前做，无论条目是否带该选项生成的都不会漏判
+    if skip_non_text:
+        preprocessor.skip_non_text_page(img_array)
+    digest = digest or result_cache.hash_array(img_array)
+    params = {"tile": tile} if tile else {}
+    key = result_cache.make_key(digest, stage="preprocess", denoise=denoise,
+                                text_height=preprocessor.TARGET_TEXT_HEIGHT, **params)
+    entry = cache.get(key)
+    # 旧条目没有记录变换矩阵，需要矩阵时重新计算
+    if entry is not None and "image" in entry and (not return_transform or "meta" in entry):
+        if return_transform:
+            return entry["image"], np.array(entry["meta"]["transform"])
+        return entry["image"]
+
+    processed, transform = preprocessor.preprocess_image_from_array(
+        img_array, denoise=denoise, on_stage=on_stage, return_transform=True, tile=tile,
+        buffers=buffers)
+    cache.put(key, image=processed, meta={"transform": transform.tolist()})
+    if return_transform:
+        return processed, transform
+    return processed
+
+
+def recognize(img_array, processed, lang="chi_sim+eng", max_workers=None, engine="auto",
+              oem=3, psm=3, denoise="nlm", cache=None, digest=None,
+              on_block=None, cancel_event=None, block_executor=None, structured=False,
+              index=None, doc_id=None, tile=None):
+    """
+    对预处理后的图像做OCR，命中缓存时不调用 tesseract
+    :param img_array: 原始图像，仅用于计算缓存键
+    :param processed: 预处理后的图像
+    :param denoise: 生成 processed 时使用的去噪方式，仅用于计算缓存键
+    :param on_block: 每块完成回调，命中缓存时对每块依次回调；见 ocr.run_ocr
+    :param cancel_event: 取消事件，见 ocr.run_ocr
+    :param block_executor: 在进程池中识别文本块（共享内存传图），见 ocr.run_ocr
+    :param structured: 每块返回带词坐标和置信度的字典，见 ocr.run_ocr
+    :param index: fingerprint.BlockIndex，与 doc_id 同时提供时只识别与上一版本相比有变化的文本块
+    :param doc_id: 文档（页）的标识，同一文档的各个修订版使用相同的标识
+    :param tile: 大图分块检测文本块，见 tiling.detect_blocks
+    """
+    revision = None
+    if index is not None and doc_id:
+        settings = {"lang": lang, "oem": oem, "psm": psm,
+                    "engine": engines.resolve_engine(engine), "tile": tile}
+        revision = index.revision(doc_id, structured, settings)
+
+    def run():
+        results = ocr.run_ocr(processed, lang=lang, max_workers=max_workers, engine=engine,
+                              oem=oem, psm=psm, on_block=on_block, cancel_event=cancel_event,
+                              block_executor=block_executor, structured=structured,
+                              reuse=revision, tile=tile)
+        if revision is not None:
+            revision.commit(results)
+        return results
+
+    if cache is None:
+        return run()
+
+    digest = digest or result_cache.hash_array(img_array)
+    params = {"structured": True} if structured else {}
+    if tile:
+        params["tile"] = tile
+    # 不同引擎的输出不完全相同，"auto" 按实际使用的引擎区分
+    key = result_cache.make_key(digest, stage="ocr", denoise=denoise, lang=lang, oem=oem, psm=psm,
+                                engine=engines.resolve_engine(engine), **params)
+    entry = cache.get(key)
+    if entry is not None and ("meta" in entry if structured else "texts" in entry):
+        results = entry["meta"]["blocks"] if structured else entry["texts"]
+        if on_block is not None:
+            for i, result in enumerate(results):
+                on_block(i, len(results), ocr.block_text(result))
+        # 命中缓存时不会调用 revision，这里补算指纹并保存，下一版本仍能沿用这次的结果
+        if revision is not None:
+            revision.prime(processed, ocr.detect_blocks(processed, tile=tile, max_workers=max_workers))
+            revision.commit(results)
+        return results
+
+    results = run()
+    if structured:
+        cache.put(key, texts=[ocr.block_text(r) for r in results], meta={"blocks": results})
+    else:
+        cache.put(key, texts=results)
+    return results
+
+
+def process_array(img_array, lang="chi_sim+eng", max_workers=None, engine="auto",
+                  oem=3, psm=3, denoise="nlm", cache=None, block_executor=None,
+                  index=None, doc_id=None, tile=None, buffers=None,
+                  skip_non_text=False):
+    """
+    对内存中的图像执行完整流程：预处理 + OCR
+    :param img_array: numpy数组形式的图像
+    :param lang: tesseract 语言
+    :param max_workers: 并发识别的文本块数，见 ocr.run_ocr
+    :param engine: OCR 引擎，见 engines.get_engine
+    :param denoise: 去噪方式，见 preprocessor.denoise_before
+    :param cache: cache.ResultCache，None 表示不使用缓存
+    :param block_executor: 在进程池中识别文本块（共享内存传图），见 ocr.run_ocr
+    :param index, doc_id: 文档修订时只识别有变化的文本块，见 recognize
+    :param tile: 大图（A0 图纸、长收据等）按该边长分块预处理和检测文本块，见 tiling.py
+    :param buffers: 预处理的工作缓冲区，见 preprocess
+    :param skip_non_text: 空白和非文本页面不做预处理和识别，抛出 preprocessor.PageSkipped
+    :return: (预处理后的图像, 每个文本块的识别结果列表)
+    """
+    digest = result_cache.hash_array(img_array) if cache is not None else None
+    processed = preprocess(img_array, denoise=denoise, cache=cache, digest=digest, tile=tile,
+                           buffers=buffers, skip_non_text=skip_non_text)
+    texts = recognize(img_array, processed, lang=lang, max_workers=max_workers, engine=engine,
+                      oem=oem, psm=psm, denoise=denoise, cache=cache, digest=digest,
+                      block_executor=block_executor, index=index, doc_id=doc_id, tile=tile)
+    return processed, texts
+
+
+def analyze_array(img_array, lang="chi_sim+eng", max_workers=None, engine="auto",
+                  oem=3, psm=3, denoise="nlm", cache=None, block_executor=None,
+                  index=None, doc_id=None, tile=None, buffers=None,
+                  skip_non_text=False):
+    """
+    与 process_array 相同的流程，但返回结构化结果：词/行/块的原图坐标和置信度，
+    与文本来自同一次 tesseract 调用
+    :return: (预处理后的图像, 页结构)，页结构见 document.build_page
+    """
+    digest = result_cache.hash_array(img_array) if cache is not None else None
+    processed, transform = preprocess(img_array, denoise=denoise, cache=cache, digest=digest,
+                                      return_transform=True, tile=tile, buffers=buffers,
+                                      skip_non_text=skip_non_text)
+    blocks = recognize(img_array, processed, lang=lang, max_workers=max_workers, engine=engine,
+                       oem=oem, psm=psm, denoise=denoise, cache=cache, digest=digest,
+                       block_executor=block_executor, structured=True,
+                       index=index, doc_id=doc_id, tile=tile)
+    page = document.build_page(blocks, img_array.shape[1], img_array.shape[0], transform)
+    return processed, page
+
+
+def process_file(file_path, lang="chi_sim+eng", max_workers=None, engine="auto",
+                 oem=3, psm=3, denoise="nlm", cache=None):
+    """
+    读取图像文件并执行完整流程
+    :return: 每个文本块的识别结果列表
+    """
+    img = preprocessor.read_image(file_path)
+    _, texts = process_array(img, lang=lang, max_workers=max_workers, engine=engine,
+                             oem=oem, psm=psm, denoise=denoise, cache=cache)
+    return texts
+
+
+def iter_document(file_path, dpi=300, **options):
+    """
+    逐页处理 PDF / 多页 TIFF / 普通图片，每处理完一页就产出结果，内存中始终只有一页
+    :param options: 传给 process_array 的参数
+    :return: 生成器，yield {"page": 页码(从1开始), "blocks": 每块识别结果}
+    """
+    for page_no, img in ingest.iter_pages(file_path, dpi=dpi):
+        _, texts = process_array(img, **options)
+        yield {"page": page_no, "blocks": texts}
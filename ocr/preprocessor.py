@@ -1,86 +1,305 @@
 # preprocessor.py
 import cv2
 import numpy as np
+import logging
 import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from . import instrument
 
-def denoise_before(img):
-    denoised = cv2.fastNlMeansDenoising(img, None, 10, 7, 21)
-    return denoised
+logger = logging.getLogger(__name__)
 
 
-def do_rotation(img, angle_range=45, padding=100, min_angle=0.5):
-    # 如果图像太小，直接返回
-    if img.shape[0] < 50 or img.shape[1] < 50:
-        return img
+def read_image(file_path, flags=cv2.IMREAD_COLOR):
+    """
+    读取图像文件，兼容中文路径
+    :param file_path: 图像文件路径
+    :return: numpy数组形式的图像
+    """
+    img = cv2.imread(file_path, flags)
+    if img is None:
+        # 尝试使用 fromfile + imdecode 兼容中文路径
+        data = np.fromfile(os.path.abspath(file_path), dtype=np.uint8)
+        img = cv2.imdecode(data, flags)
+    if img is None:
+        raise ValueError(f"无法读取图像文件: {file_path}")
+    return img
+
+
+# 预处理各阶段名称，按执行顺序
+STAGES = ("gray", "scale", "denoise", "rotation", "threshold")
+
+DENOISE_METHODS = ("nlm", "median", "bilateral", "nlm_downscaled", "auto", "none")
+
+
+class BufferPool:
+    """
+    预处理的两块工作缓冲区：每一步的输出放在不与输入共享内存的那一块中，两块轮流使用，
+    连续处理多页时不再为每页的每一步重新申请整页大小的内存
+    缓冲区只在需要更大时重新申请；预处理的最终结果不放在缓冲区中，可以跨页保留。
+    同一个 BufferPool 只能由一个线程使用，见 thread_buffers
+    """
+
+    def __init__(self):
+        self._buffers = [None, None]
+
+    def spare(self, src, shape):
+        """不与 src 共享内存的那块缓冲区中形状为 shape 的 uint8 视图，作为以 src 为输入的下一步的输出"""
+        first = self._buffers[0]
+        i = 1 if first is not None and np.may_share_memory(first, src) else 0
+        size = int(np.prod(shape))
+        buf = self._buffers[i]
+        if buf is None or buf.size < size:
+            buf = self._buffers[i] = np.empty(size, dtype=np.uint8)
+        return buf[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buf.size for buf in self._buffers if buf is not None)
+
+
+_local = threading.local()
+
+
+def thread_buffers():
+    """当前线程的 BufferPool，每个工作线程（进程）各用一个"""
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = BufferPool()
+    return buffers
+
+
+def _spare(buffers, src, shape):
+    """有 BufferPool 时返回输出缓冲区，否则为 None（由 OpenCV 申请新数组）"""
+    return None if buffers is None else buffers.spare(src, shape)
+
+
+# 尺寸归一化：字高（连通域高度的 75 分位数，拉丁字母约为含升部的字高，汉字约为整字高）
+# 超过 TARGET_TEXT_HEIGHT 的 MAX_TEXT_SCALE 倍时，先把整页缩小到目标字高，再做去噪、旋转矫正和二值化
+TARGET_TEXT_HEIGHT = 32
+MAX_TEXT_SCALE = 1.25
+MIN_TEXT_COMPONENTS = 20
+ESTIMATE_MAX_PIXELS = 4_000_000
 
-    # Canny边缘检测
-    edge = cv2.Canny(img, 50, 200, apertureSize=3)
-    lines = cv2.HoughLinesP(edge, 1, np.pi / 180, threshold=80,
-                        minLineLength=int(0.1*0.5*(img.shape[0]+img.shape[1])), maxLineGap=10)
-    if lines is None:
-        return img
 
-    angles = []
+def text_height(ink):
+    """
+    由连通域统计字高
+    :param ink: 前景为非零的二值图（黑底白字）
+    :return: 字高（像素），连通域太少时为 None
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    # 去掉噪点，以及表格线、边框、图片等远大于文字的连通域
+    keep = ((heights >= 4) & (areas >= 8)
+            & (heights < ink.shape[0] * 0.1) & (widths < ink.shape[1] * 0.2))
+    if np.count_nonzero(keep) < MIN_TEXT_COMPONENTS:
+        return None
+    return float(np.percentile(heights[keep], 75))
+
+
+def estimate_text_height(gray):
+    """估计灰度图（白底黑字）中的字高；大图先缩小到 ESTIMATE_MAX_PIXELS 以内再统计"""
+    factor = 1.0
+    pixels = gray.shape[0] * gray.shape[1]
+    if pixels > ESTIMATE_MAX_PIXELS:
+        factor = math.sqrt(ESTIMATE_MAX_PIXELS / pixels)
+        gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    blur = cv2.GaussianBlur(gray, (3, 3), 0)
+    _, ink = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=blur)
+    height = text_height(ink)
+    return None if height is None else height / factor
+
+
+def normalize_scale(gray, target=TARGET_TEXT_HEIGHT, buffers=None):
+    """
+    字太大时把整页缩小到目标字高，后续各步骤的耗时随像素数下降，版面检测的阈值也与输入尺寸无关
+    只缩小不放大：小字放大不会增加信息，只会增加计算量
+    :param buffers: BufferPool，缩小后的图像放在其中
+    :return: (缩放后的图像, 缩放比例)
+    """
+    height = estimate_text_height(gray)
+    if height is None or height <= target * MAX_TEXT_SCALE:
+        return gray, 1.0
+    scale = target / height
+    logger.debug("text height %.1f, scale %.3f", height, scale)
+    # 输出尺寸与 OpenCV 按 fx/fy 的取整相同；不一致时 OpenCV 会另外申请，结果不受影响
+    dst = _spare(buffers, gray, (round(gray.shape[0] * scale), round(gray.shape[1] * scale)))
+    scaled = cv2.resize(gray, None, dst=dst, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return scaled, scale
+
+
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
 
-    for x1, y1, x2, y2 in lines[:, 0]:
-        dx, dy = x2 - x1, y2 - y1
-        if dx == 0:  # 垂直线忽略
-            continue
 
-        angle_deg = np.rad2deg(np.arctan2(dy, dx))
-        if angle_deg > 90:
-             angle_deg -= 180
-        elif angle_deg < -90:
-            angle_deg += 180  # 转换到 [-90, 90]
-        # 仅关注水平线，筛选
-        if abs(angle_deg) > angle_range:
-            continue
+def estimate_noise(img):
+    """
+    估计灰度图的噪声标准差
+    用二阶差分核抑制图像结构，取响应的中位数绝对值做稳健估计，文字边缘只占少数像素，对结果影响不大
+    """
+    response = cv2.filter2D(img, cv2.CV_32F, NOISE_KERNEL)
+    # 核对独立噪声的放大倍数为 sqrt(36) = 6，1.4826 为中位数绝对值到标准差的换算系数
+    return 1.4826 * float(np.median(np.abs(response))) / 6.0
+
+
+def denoise_before(img, method="nlm", clean_sigma=2.0, large_pixels=4_000_000, buffers=None):
+    """
+    旋转前去噪
+    :param method:
+        "nlm"            非局部均值去噪（原有方式，效果最好也最慢）
+        "median"         3x3 中值滤波
+        "bilateral"      双边滤波，保留文字边缘
+        "nlm_downscaled" 缩小一半做非局部均值去噪再放大回原尺寸
+        "auto"           估计噪声，足够干净时跳过；否则大图用 nlm_downscaled，小图用 nlm
+        "none"           不去噪
+    :param clean_sigma: auto 模式下噪声标准差低于该值视为干净图像
+    :param large_pixels: auto 模式下像素数超过该值视为大图
+    :param buffers: BufferPool，去噪结果放在其中；不去噪时直接返回输入
+    """
+    if method == "auto":
+        if estimate_noise(img) < clean_sigma:
+            return img
+        method = "nlm_downscaled" if img.shape[0] * img.shape[1] > large_pixels else "nlm"
+
+    dst = None if method == "none" else _spare(buffers, img, img.shape)
+    if method == "nlm":
+        denoised = cv2.fastNlMeansDenoising(img, dst, 10, 7, 21)
+    elif method == "median":
+        denoised = cv2.medianBlur(img, 3, dst=dst)
+    elif method == "bilateral":
+        denoised = cv2.bilateralFilter(img, 5, 50, 50, dst=dst)
+    elif method == "nlm_downscaled":
+        h, w = img.shape[:2]
+        small = cv2.resize(img, (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA)
+        cv2.fastNlMeansDenoising(small, small, 10, 7, 21)
+        denoised = cv2.resize(small, (w, h), dst=dst, interpolation=cv2.INTER_CUBIC)
+    elif method == "none":
+        denoised = img
+    else:
+        raise ValueError(f"未知的去噪方式: {method}")
+    return denoised
+
 
-        angles.append(angle_deg)
-        print(f"[DEBUG]angle = {angle_deg:.2f}!")
+def _line_angles(lines, angle_range):
+    """HoughLinesP 线段的角度（度，[-90, 90]），向量化过滤垂直线和超出范围的线"""
+    segs = lines[:, 0].astype(np.float64)
+    dx = segs[:, 2] - segs[:, 0]
+    dy = segs[:, 3] - segs[:, 1]
+    keep = dx != 0  # 垂直线忽略
+    angles = np.rad2deg(np.arctan2(dy[keep], dx[keep]))
+    angles[angles > 90] -= 180
+    angles[angles < -90] += 180
+    # 仅关注水平线，筛选
+    return angles[np.abs(angles) <= angle_range]
 
-    if not angles:
-        return img
 
+def _circular_mean(angles):
     angles_rad = np.deg2rad(angles)
-    mean_sin = np.mean(np.sin(angles_rad))
-    mean_cos = np.mean(np.cos(angles_rad))
-    dominant_angle = np.rad2deg(np.arctan2(mean_sin, mean_cos))
-    print(f"[INFO] rotated: {dominant_angle:.2f}.")
+    return float(np.rad2deg(np.arctan2(np.mean(np.sin(angles_rad)), np.mean(np.cos(angles_rad)))))
 
-    if abs (dominant_angle)<min_angle:
-        return img
+
+def _hough_skew(img, scale=1.0, angle_range=45):
+    """
+    Canny + HoughLinesP，所有近水平线段角度的圆均值
+    :param scale: img 相对原分辨率的缩放比例，阈值和线段间隙按比例换算，与原分辨率下的检测条件一致
+    :return: 倾斜角度（度），未检测到直线时返回 None
+    """
+    edge = cv2.Canny(img, 50, 200, apertureSize=3)
+    lines = cv2.HoughLinesP(edge, 1, np.pi / 180, threshold=max(20, int(80 * scale)),
+                            minLineLength=int(0.1*0.5*(img.shape[0]+img.shape[1])),
+                            maxLineGap=max(3, int(round(10 * scale))))
+    if lines is None:
+        return None
+    angles = _line_angles(lines, angle_range)
+    if angles.size == 0:
+        return None
+    return _circular_mean(angles)
 
 
-    img_padded = cv2.copyMakeBorder(
-        img,
-        top=padding,
-        bottom=padding, left=padding,
-        right=padding, borderType=cv2.BORDER_CONSTANT,
-        value=255  # 白色边框
-    )
+def estimate_skew(img, angle_range=45, max_side=1024, tolerance=0.5):
+    """
+    估计倾斜角度，结果与在原分辨率上直接检测相同或相近
+    边长不超过 2*max_side 时直接在原图上检测；更大的图先在 1/4 和 1/2 两层上各检测一次，
+    两层一致（相差不超过 tolerance 度）时采用 1/2 层的结果，否则回到原分辨率重新检测。
+    只用这两层：再缩小时 10 像素的线段间隙换算后不足 3 像素，检测到的线段与原图差别很大，
+    文字密集的页面上各层的结果可能差好几度，甚至方向相反。
+    :param max_side: 不超过该边长的两倍时不使用金字塔
+    :param tolerance: 两层结果允许的差（度）
+    :return: 倾斜角度（度），未检测到直线时返回 None
+    """
+    if max(img.shape[:2]) <= 2 * max_side:
+        return _hough_skew(img, angle_range=angle_range)
 
-    # 仿射旋转
-    h, w = img_padded.shape[:2]
-    center = (w // 2, h // 2)
+    half = cv2.pyrDown(img)
+    quarter = cv2.pyrDown(half)
+    coarse = _hough_skew(quarter, quarter.shape[1] / img.shape[1], angle_range)
+    if coarse is not None:
+        fine = _hough_skew(half, half.shape[1] / img.shape[1], angle_range)
+        if fine is not None and abs(fine - coarse) <= tolerance:
+            return fine
+    logger.debug("skew levels disagree, estimating at full resolution")
+    return _hough_skew(img, angle_range=angle_range)
+
+
+MIN_ROTATION_SIDE = 50  # 边长小于该值的图像不做旋转矫正
+
+
+def rotation_matrix(h, w, angle, padding=100):
+    """
+    四周加白边后绕中心旋转、并扩大画布容纳旋转后图像的仿射变换
+    :return: (2x3 矩阵（输入坐标 -> 输出坐标，已包含加边的平移）, (输出宽, 输出高))
+    """
+    padded_w, padded_h = w + 2 * padding, h + 2 * padding
+    center = (padded_w // 2, padded_h // 2)
 
     # 旋转矩阵
-    M = cv2.getRotationMatrix2D(center, dominant_angle, 1.0)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
 
     # 计算新边界大小
     cos = np.abs(M[0, 0])
     sin = np.abs(M[0, 1])
-    new_w = int(h * sin + w * cos)
-    new_h = int(h * cos + w * sin)
+    new_w = int(padded_h * sin + padded_w * cos)
+    new_h = int(padded_h * cos + padded_w * sin)
 
     # 调整旋转中心
     M[0, 2] += (new_w / 2) - center[0]
     M[1, 2] += (new_h / 2) - center[1]
 
-    # 执行旋转
-    rotated = cv2.warpAffine(img_padded, M, (new_w, new_h), borderValue=255)
+    # 把加边的平移并入矩阵，得到相对原图的变换
+    M[:, 2] += M[:, :2] @ np.array([padding, padding], dtype=np.float64)
+    return M, (new_w, new_h)
+
+
+def do_rotation(img, angle_range=45, padding=100, min_angle=0.5, return_matrix=False, buffers=None):
+    """
+    :param return_matrix: 同时返回 2x3 仿射矩阵（输入坐标 -> 输出坐标，包含加边和旋转），未旋转时为单位矩阵
+    :param buffers: BufferPool，旋转后的画布放在其中；不旋转时直接返回输入，不加边也不复制
+    """
+    identity = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+    # 如果图像太小，直接返回
+    if min(img.shape[:2]) < MIN_ROTATION_SIDE:
+        return (img, identity) if return_matrix else img
+
+    dominant_angle = estimate_skew(img, angle_range=angle_range)
+    if dominant_angle is None:
+        return (img, identity) if return_matrix else img
+    logger.debug("rotated: %.2f", dominant_angle)
+
+    if abs (dominant_angle)<min_angle:
+        return (img, identity) if return_matrix else img
+
+    # 仿射旋转；加边用白色边界值代替，不需要先复制一张加边的图像
+    matrix, size = rotation_matrix(img.shape[0], img.shape[1], dominant_angle, padding)
+    rotated = cv2.warpAffine(img, matrix, size, dst=_spare(buffers, img, (size[1], size[0])),
+                             borderValue=255)
 
+    if return_matrix:
+        return rotated, matrix
     return rotated
 
 
@@ -97,29 +316,286 @@ def after_rotation(img):
     return binary
 
 
-def preprocess_image_from_array(img_array):
+# ---------- 页面分类 ----------
+# 批量扫描中夹着空白隔页、照片和条码，它们不需要去噪、旋转矫正和版面检测。
+# 在长边 CLASSIFY_SIDE 的缩略图上统计墨迹比例、连通域和暗区面积，判断是否值得识别；
+# 只在把握较大时才判为 blank / non_text，拿不准的页面一律按 text 走完整流程
+
+PAGE_CLASSES = ("text", "blank", "non_text")
+
+CLASSIFY_SIDE = 800
+INK_CONTRAST = 25           # 比邻域均值暗这么多灰度级才算墨迹
+BLANK_MAX_COMPONENTS = 3    # 文字状连通域少于该数的页面没有可识别的文字
+BLANK_DARK_RATIO = 0.05     # 其中暗区不超过该比例的为空白页（允许扫描仪黑边、页码）
+GRAPHICS_TEXT_SHARE = 0.2   # 墨迹大多不在文字状连通域中：条码、线稿
+PHOTO_DARK_RATIO = 0.08     # 照片：大片暗区，但其中只有少量是有局部对比的笔画
+PHOTO_DARK_TO_INK = 4.0
+PHOTO_HEIGHT_CV = 0.8       # 照片纹理形成的连通域高度参差不齐，文字的高度较一致
+
+
+class PageSkipped(Exception):
+    """页面被判为空白或非文本，跳过预处理和识别；reason 为 classify_page 的分类，stats 为分类依据"""
+
+    def __init__(self, reason, stats=None):
+        super().__init__(f"page skipped: {reason}")
+        self.reason = reason
+        self.stats = stats or {}
+
+
+def page_stats(img, side=CLASSIFY_SIDE):
+    """
+    在缩略图上统计页面特征
+    :return: {"ink": 有局部对比的墨迹占比, "dark": 比页面中位灰度暗 48 级以上的面积占比,
+              "components": 文字状连通域数, "text_share": 其中墨迹占全部墨迹的比例,
+              "height_cv": 其高度的变异系数}
+    """
+    factor = min(1.0, side / max(img.shape[:2]))
+    # 先缩小再灰度化，大图不需要整页的灰度副本
+    if factor < 1.0:
+        img = cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if np.mean(gray) < 127:
+        gray = cv2.bitwise_not(gray)
+
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV,
+                                31, INK_CONTRAST)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    h, w = gray.shape
+    # 文字状：不是噪点，不是远大于文字的图块或表格线，也不是条码那样的细长竖条
+    text = ((areas >= 3) & (heights >= 3) & (heights < h * 0.1) & (widths < w * 0.2)
+            & (widths * 8 >= heights))
+    ink_pixels = int(areas[areas >= 3].sum())
+    text_heights = heights[text]
+    return {
+        "ink": np.count_nonzero(ink) / ink.size,
+        "dark": float(np.mean(gray < np.median(gray) - 48)),
+        "components": int(np.count_nonzero(text)),
+        "text_share": float(areas[text].sum()) / ink_pixels if ink_pixels else 0.0,
+        "height_cv": float(text_heights.std() / text_heights.mean()) if text_heights.size else 0.0,
+    }
+
+
+def classify_page(img):
+    """
+    判断页面是空白、非文本（照片、条码、线稿）还是文本，耗时为整页预处理的很小一部分
+    :param img: BGR 或灰度图像
+    :return: (分类, 统计)，分类见 PAGE_CLASSES，统计见 page_stats
+    """
+    stats = page_stats(img)
+    if stats["components"] < BLANK_MAX_COMPONENTS:
+        label = "blank" if stats["dark"] < BLANK_DARK_RATIO else "non_text"
+    elif stats["text_share"] < GRAPHICS_TEXT_SHARE and stats["components"] < MIN_TEXT_COMPONENTS:
+        label = "non_text"
+    elif (stats["dark"] > PHOTO_DARK_RATIO and stats["dark"] > PHOTO_DARK_TO_INK * stats["ink"]
+          and (stats["components"] < MIN_TEXT_COMPONENTS or stats["height_cv"] > PHOTO_HEIGHT_CV)):
+        label = "non_text"
+    else:
+        label = "text"
+    return label, stats
+
+
+def skip_non_text_page(img):
+    """classify_page 判为空白或非文本时抛出 PageSkipped，文本页面直接返回"""
+    with instrument.stage("classify"):
+        label, stats = classify_page(img)
+    if label != "text":
+        logger.debug("page skipped: %s %s", label, stats)
+        raise PageSkipped(label, stats)
+
+
+def preprocess_image_from_array(img_array, denoise="nlm", on_stage=None, return_transform=False,
+                                normalize=True, tile=None, buffers=None, skip_non_text=False):
     """
     直接从内存中的图像数组进行预处理
     :param img_array: numpy数组形式的图像
+    :param denoise: 去噪方式，见 denoise_before
+    :param on_stage: 每个阶段开始前回调 on_stage(阶段名)，阶段名见 STAGES
+    :param return_transform: 同时返回原图坐标到预处理后坐标的 2x3 仿射矩阵（包含缩放），见 do_rotation
+    :param normalize: 字太大时先缩小到目标字高，见 normalize_scale
+    :param tile: 按该边长分块处理，峰值内存与分块大小而不是整图大小相关，见 tiling.preprocess_tiled
+    :param buffers: BufferPool，中间结果放在可重复使用的工作缓冲区中（分块处理时不使用）；
+                    返回的图像总是新数组
+    :param skip_non_text: 先用 classify_page 判断页面，空白和非文本页面抛出 PageSkipped
     :return: 预处理后的图像
     """
-    # 如果图像是彩色，转换为灰度
-    if len(img_array.shape) == 3:
-        img_gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
-    else:
-        img_gray = img_array
+    if skip_non_text:
+        skip_non_text_page(img_array)
+
+    if tile:
+        from . import tiling  # tiling 依赖本模块，这里延迟导入避免循环
+        return tiling.preprocess_tiled(img_array, denoise=denoise, tile=tile, on_stage=on_stage,
+                                       return_transform=return_transform, normalize=normalize)
 
-    if np.mean(img_gray) < 127:
-        img_gray = cv2.bitwise_not(img_gray)  # 统一为白底黑字
+    def stage(name):
+        if on_stage is not None:
+            on_stage(name)
+        return instrument.stage(name)
 
+    # 各步骤的结果都赋给 img，上一步的中间结果随即释放，同一时刻最多只有输入、输出两张整页图像
+
+    # 如果图像是彩色，转换为灰度
+    with stage("gray"):
+        if len(img_array.shape) == 3:
+            img = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY,
+                               dst=_spare(buffers, img_array, img_array.shape[:2]))
+        else:
+            img = img_array
+
+        if np.mean(img) < 127:
+            # 统一为白底黑字；自己转换的灰度图原地取反，调用方传入的灰度图不能修改
+            dst = img if img is not img_array else _spare(buffers, img, img.shape)
+            img = cv2.bitwise_not(img, dst=dst)
+
+    # 按字高缩小大图，后面的步骤都在缩小后的图像上进行
+    with stage("scale"):
+        scale = 1.0
+        if normalize:
+            img, scale = normalize_scale(img, buffers=buffers)
 
     # 旋转前简单去噪
-    denoised1 = denoise_before(img_gray)
+    with stage("denoise"):
+        img = denoise_before(img, method=denoise, buffers=buffers)
 
     # 霍夫变换旋转矫正
-    rotated = do_rotation(denoised1)
+    with stage("rotation"):
+        img, transform = do_rotation(img, return_matrix=True, buffers=buffers)
 
     # 旋转后处理
-    final = after_rotation(rotated)
+    with stage("threshold"):
+        final = after_rotation(img)
+
+    if return_transform:
+        # 先缩放后旋转：旋转矩阵的线性部分乘以缩放比例，平移部分不变
+        transform = np.hstack([transform[:, :2] * scale, transform[:, 2:]])
+        return final, transform
+    return final
+
+
+
+# ---------- 批量预处理 ----------
+# 大量小图（收据、标签裁剪）：同尺寸的图像拼成一叠，灰度化和反色判断整叠一次完成；
+# 是否统计字高、是否估计倾斜角、是否旋转由尺寸和 NumPy 数组对整批一次判断，跳过的图像不再逐张调用。
+# 去噪、边缘检测和自适应阈值仍逐张调用 OpenCV：单次调用的固定开销只有几微秒，
+# 拼成一张处理时为了让边界与逐张处理一致需要补边和复制，实测反而更慢
+
+BATCH_MAX_PIXELS = 1_000_000  # 超过该像素数的图像仍逐张走完整流程
 
-    return final
\ No newline at end of file
+
+def _may_shrink(shape, target=TARGET_TEXT_HEIGHT):
+    """
+    text_height 只统计高度小于图像高度 10% 的连通域，
+    图像高度不到缩小阈值的 10 倍时字高不可能超过阈值，不用统计
+    """
+    return shape[0] * 0.1 > target * MAX_TEXT_SCALE
+
+
+def _batch_gray(images):
+    """灰度化并统一为白底黑字：同尺寸的彩色图整叠一次 cvtColor，均值和反色对整叠一次算出"""
+    groups = {}
+    for i, img in enumerate(images):
+        groups.setdefault(img.shape, []).append(i)
+
+    results = [None] * len(images)
+    for shape, index in groups.items():
+        stack = np.stack([images[i] for i in index])
+        if stack.ndim == 4:
+            n, h, w, c = stack.shape
+            stack = cv2.cvtColor(stack.reshape(n * h, w, c), cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+        invert = stack.mean(axis=(1, 2)) < 127
+        if invert.any():
+            stack[invert] = 255 - stack[invert]
+        for i, gray in zip(index, stack):
+            results[i] = gray
+    return results
+
+
+def _batch_scale(images, map_fn):
+    """与 normalize_scale 相同；不够高的图像整批跳过字高统计"""
+    heights = np.full(len(images), np.nan)
+    tall = [i for i, img in enumerate(images) if _may_shrink(img.shape)]
+    for i, height in zip(tall, map_fn(estimate_text_height, [images[i] for i in tall])):
+        if height is not None:
+            heights[i] = height
+
+    scales = np.ones(len(images))
+    shrink = np.flatnonzero(heights > TARGET_TEXT_HEIGHT * MAX_TEXT_SCALE)  # nan 比较为 False
+    scales[shrink] = TARGET_TEXT_HEIGHT / heights[shrink]
+    images = list(images)
+    for i in shrink:
+        images[i] = cv2.resize(images[i], None, fx=scales[i], fy=scales[i], interpolation=cv2.INTER_AREA)
+    return images, scales
+
+
+def _batch_rotation(images, map_fn, min_angle=0.5):
+    """与 do_rotation 相同；边长不足 MIN_ROTATION_SIDE 的图像整批跳过倾斜估计，是否旋转对整批一次判断"""
+    angles = np.full(len(images), np.nan)
+    candidates = [i for i, img in enumerate(images) if min(img.shape[:2]) >= MIN_ROTATION_SIDE]
+    for i, angle in zip(candidates, map_fn(estimate_skew, [images[i] for i in candidates])):
+        if angle is not None:
+            angles[i] = angle
+
+    def rotate(i):
+        logger.debug("rotated: %.2f", angles[i])
+        matrix, size = rotation_matrix(images[i].shape[0], images[i].shape[1], angles[i])
+        return cv2.warpAffine(images[i], matrix, size, borderValue=255), matrix
+
+    identity = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    rotated = list(images)
+    transforms = [identity] * len(images)
+    turn = np.flatnonzero(np.abs(angles) >= min_angle).tolist()
+    for i, (img, matrix) in zip(turn, map_fn(rotate, turn)):
+        rotated[i], transforms[i] = img, matrix
+    return rotated, transforms
+
+
+def preprocess_batch(images, denoise="nlm", on_stage=None, return_transform=False, normalize=True,
+                     max_workers=None):
+    """
+    批量预处理大量小图（收据、标签裁剪等），结果与逐张调用 preprocess_image_from_array 相同
+    :param images: 图像数组的列表，尺寸可以各不相同
+    :param on_stage: 每个阶段开始前回调 on_stage(阶段名)，整批只回调一次，见 STAGES
+    :param max_workers: 逐张的 OpenCV 调用（去噪、倾斜估计、二值化等）并行的线程数，默认等于CPU核数
+    :return: 与 images 一一对应的预处理结果列表；return_transform=True 时为 (图像, 2x3 仿射矩阵) 的列表
+    """
+    images = list(images)
+    results = [None] * len(images)
+    small = []
+    for i, img in enumerate(images):
+        if img.shape[0] * img.shape[1] > BATCH_MAX_PIXELS:
+            results[i] = preprocess_image_from_array(img, denoise=denoise, return_transform=True,
+                                                     normalize=normalize)
+        else:
+            small.append(i)
+
+    def stage(name):
+        if on_stage is not None:
+            on_stage(name)
+        return instrument.stage(name)
+
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(small)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def map_fn(func, items):
+            return list(executor.map(func, items)) if workers > 1 else [func(x) for x in items]
+
+        batch = [images[i] for i in small]
+        with stage("gray"):
+            batch = _batch_gray(batch)
+        with stage("scale"):
+            scales = np.ones(len(batch))
+            if normalize:
+                batch, scales = _batch_scale(batch, map_fn)
+        with stage("denoise"):
+            batch = map_fn(lambda img: denoise_before(img, method=denoise), batch)
+        with stage("rotation"):
+            batch, transforms = _batch_rotation(batch, map_fn)
+        with stage("threshold"):
+            batch = map_fn(after_rotation, batch)
+
+    for i, final, transform, scale in zip(small, batch, transforms, scales):
+        results[i] = (final, np.hstack([transform[:, :2] * scale, transform[:, 2:]]))
+    if return_transform:
+        return results
+    return [final for final, _ in results]
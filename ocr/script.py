@@ -0,0 +1,141 @@
+# script.py
+"""
+文字种类（script）检测，为每个文本块选择最小的语言模型：
+    - cc：连通域统计，每块只需一次 connectedComponentsWithStats，不调用 tesseract
+    - osd：整页调用一次 tesseract OSD（需要 osd.traineddata），不可用或置信度低时退回 cc
+
+cc 的依据：以连通域高度的 90 分位数作为字高 T，按高度 T 的横条统计每个有墨迹的列
+自上而下穿过的笔画数。汉字横笔多，平均约 1.8 以上；拉丁字母约 1.0~1.4。
+两者之间（中英混排、字太小笔画粘连等）视为无法判断，使用组合模型。
+"""
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from . import engines
+
+logger = logging.getLogger(__name__)
+
+# run_ocr 的 lang 取这些值时自动选择语言
+AUTO_METHODS = {"auto": "cc", "auto:osd": "osd"}
+
+SCRIPT_LANGS = {"Latin": "eng", "Han": "chi_sim"}
+FALLBACK_LANG = "chi_sim+eng"
+
+LATIN_MAX_RUNS = 1.45
+HAN_MIN_RUNS = 1.75
+MIN_COMPONENTS = 5
+MIN_OSD_CONF = 2.0
+
+# 复用 OSD 用的 PyTessBaseAPI，避免每页重新加载 osd.traineddata（与 TesserocrEngine 的池相同）
+_osd_idle = []
+_osd_lock = threading.Lock()
+
+
+def stroke_runs(binary):
+    """
+    横条内每个有墨迹的列平均穿过的笔画数（按列数加权）
+    :param binary: 白底黑字的二值图
+    :return: 平均笔画数，连通域太少时为 None
+    """
+    ink = (binary < 128).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    heights = heights[(areas >= 4) & (heights >= 3)]
+    if len(heights) < MIN_COMPONENTS:
+        return None
+
+    text_h = int(np.percentile(heights, 90))
+    total = weight = 0.0
+    # 横条与文本行不一定对齐，步长取半个字高，两种文字受到的影响相同
+    for y in range(0, ink.shape[0] - text_h + 1, max(1, text_h // 2)):
+        strip = ink[y:y + text_h]
+        cols = strip.any(axis=0)
+        count = int(cols.sum())
+        if count < text_h:
+            continue
+        runs = (np.diff(strip.astype(np.int8), axis=0) == 1).sum(axis=0) + strip[0]
+        total += float(runs[cols].sum())
+        weight += count
+    return total / weight if weight else None
+
+
+def classify(binary):
+    """判断文本块的文字种类："Latin"、"Han"，无法判断时为 None"""
+    runs = stroke_runs(binary)
+    if runs is None:
+        return None
+    if runs <= LATIN_MAX_RUNS:
+        return "Latin"
+    if runs >= HAN_MIN_RUNS:
+        return "Han"
+    return None
+
+
+def _acquire_osd(tesserocr):
+    with _osd_lock:
+        if _osd_idle:
+            return _osd_idle.pop()
+    return tesserocr.PyTessBaseAPI(lang="osd", psm=tesserocr.PSM.OSD_ONLY)
+
+
+def _release_osd(api):
+    with _osd_lock:
+        _osd_idle.append(api)
+
+
+def detect_osd(img):
+    """
+    用 tesseract OSD 检测整页的文字种类
+    :return: (script, 置信度)，OSD 不可用或文字太少时为 None
+    """
+    tesserocr = engines.load_tesserocr()
+    pytesseract = engines.load_pytesseract()
+    try:
+        if tesserocr is not None:
+            api = _acquire_osd(tesserocr)
+            try:
+                h, w = img.shape[:2]
+                api.SetImageBytes(np.ascontiguousarray(img).tobytes(), w, h, 1, w)
+                result = api.DetectOrientationScript()
+            finally:
+                api.Clear()
+                _release_osd(api)
+            if not result:
+                return None
+            return result["script_name"], float(result["script_conf"])
+        osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+        return osd["script"], float(osd["script_conf"])
+    except (RuntimeError, KeyError, ValueError, pytesseract.TesseractError) as e:
+        logger.debug("osd unavailable: %s", e)
+        return None
+
+
+def lang_for(script, fallback=FALLBACK_LANG):
+    return SCRIPT_LANGS.get(script, fallback)
+
+
+def choose_langs(img, blocks, method="cc", fallback=FALLBACK_LANG):
+    """
+    为每个文本块选择语言
+    :param img: 预处理后的二值图（灰度）
+    :param blocks: [(x, y, w, h), ...]
+    :param method: "cc" 每块用连通域统计；"osd" 整页用 tesseract OSD，不可用时退回 cc
+    :param fallback: 无法判断时使用的组合模型
+    :return: 与 blocks 一一对应的语言列表
+    """
+    if method == "osd":
+        detected = detect_osd(img)
+        if detected is not None and detected[1] >= MIN_OSD_CONF and detected[0] in SCRIPT_LANGS:
+            logger.debug("osd script: %s (%.2f)", *detected)
+            return [SCRIPT_LANGS[detected[0]]] * len(blocks)
+
+    langs = []
+    for x, y, w, h in blocks:
+        script = classify(img[y:y+h, x:x+w])
+        langs.append(lang_for(script, fallback))
+    logger.debug("block langs: %s", langs)
+    return langs
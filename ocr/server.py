@@ -0,0 +1,443 @@
+# server.py
+"""
+本地 HTTP OCR 服务（仅依赖标准库 asyncio）：
+    python -m ocr.server --port 8080 -j 4 --concurrency 4 --max-queue 32
+
+工作进程启动时预先导入 cv2/numpy 并初始化 OCR 引擎，之后的请求不再有冷启动开销。
+同时处理的请求数受 --concurrency 限制，排队数超过 --max-queue 时返回 503。
+
+    POST /ocr            请求体为图像文件内容（png/jpg/tiff...）
+    POST /ocr            请求体为 JSON：{"path": "a.png"} / {"path": "a.pdf", "page": 2}
+                         或批量 {"paths": ["a.png", "b.pdf", {"path": "c.tif", "page": 1}]}
+                         （未指定页码的 PDF/多页 TIFF 会展开为所有页）
+    GET  /health         JSON：队列深度、在途请求数、延迟 p50/p95
+    GET  /metrics        Prometheus 文本格式：请求数、队列深度、延迟、各阶段耗时
+
+查询参数 lang、denoise、psm 可覆盖默认识别参数，如 POST /ocr?lang=eng&psm=auto；
+structured=1 时结果带 "document" 字段：词/行/块的原图坐标和置信度（见 document.py）；
+skip_non_text=1 时空白页、照片、条码等不做识别，结果为空并带 "page_skipped" 字段
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import cv2
+import numpy as np
+
+from . import pipeline
+from . import ocr
+from . import document
+from . import preprocessor
+from . import ingest
+from . import instrument
+from . import engines
+from . import batch
+from . import script
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 << 20
+READ_TIMEOUT = 30
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+# ---------- 工作进程 ----------
+
+def _init_worker(cache_dir=None, log_level=None, engine="auto", lang="chi_sim+eng"):
+    batch._init_worker(cache_dir, log_level)
+    # tesserocr 在第一次识别时加载模型，这里先识别一张空白图，让首个请求不用等待
+    # "auto"/"auto:osd" 不是真正的语言包，改为预热按文字自动选择时会用到的语言
+    if lang in script.AUTO_METHODS:
+        langs = sorted(set(script.SCRIPT_LANGS.values()) | {script.FALLBACK_LANG})
+    else:
+        langs = [lang]
+    blank = np.full((32, 32), 255, dtype=np.uint8)
+    for warm_lang in langs:
+        warm = engines.get_engine(engine, lang=warm_lang)
+        if warm.name != "tesserocr":
+            break
+        warm.recognize(blank)
+
+
+def _ping():
+    # 占住进程一小段时间，让启动时的每个空任务落到不同的进程上
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def ocr_job(options, data=None, path=None, page=None, structured=False):
+    """
+    子进程中识别一张图像：data 为图像文件内容，或 path (+ page，从1开始) 指定文件
+    :param structured: 同时返回带坐标和置信度的页结构
+    :return: 可序列化的结果记录
+    """
+    start = time.perf_counter()
+    record = {}
+    if path is not None:
+        record["path"] = path
+    if page is not None:
+        record["page"] = page
+    with instrument.profile(path) as prof:
+        try:
+            with instrument.stage("read"):
+                if data is not None:
+                    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if img is None:
+                        raise ValueError("无法解码图像数据")
+                elif page is None:
+                    img = preprocessor.read_image(path)
+                else:
+                    img = ingest.read_page(path, page - 1)
+            if structured:
+                _, page_data = pipeline.analyze_array(img, cache=batch._worker_cache, **options)
+                texts = [block["text"] for block in page_data["blocks"]]
+            else:
+                _, texts = pipeline.process_array(img, cache=batch._worker_cache, **options)
+        except preprocessor.PageSkipped as e:
+            record.update(status="ok", blocks=[], page_skipped=e.reason)
+            if structured:
+                record["document"] = document.build_page([], img.shape[1], img.shape[0])
+        except Exception as e:
+            record.update(status="error", error=str(e))
+        else:
+            record.update(status="ok", blocks=[{"index": i, "text": text}
+                                               for i, text in enumerate(texts)])
+            if structured:
+                record["document"] = page_data
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["profile"] = prof.to_dict()
+    return record
+
+
+# ---------- 服务 ----------
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class OCRServer:
+    def __init__(self, workers=None, concurrency=None, max_queue=32, lang="chi_sim+eng",
+                 engine="auto", denoise="nlm", cache_dir=None, root=None):
+        """
+        :param workers: 工作进程数，默认全部核心
+        :param concurrency: 同时识别的图像数，默认等于 workers
+        :param max_queue: 等待中的图像数上限，超过时返回 503
+        :param root: 限制 JSON 请求中的路径必须位于该目录下，None 表示不限制
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = concurrency or self.workers
+        self.max_queue = max_queue
+        self.defaults = {"lang": lang, "engine": engine, "denoise": denoise,
+                         "max_workers": 1}
+        self.cache_dir = cache_dir
+        self.root = os.path.realpath(root) if root else None
+        self.executor = None
+        self._slots = None
+        self.waiting = 0
+        self.running = 0
+        self.requests = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self.registry = instrument.MetricsRegistry()
+
+    async def start(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(self.cache_dir, logging.getLogger().level,
+                      self.defaults["engine"], self.defaults["lang"]))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # 同时提交与进程数相同的空任务，让所有工作进程在启动时就完成初始化
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.executor, _ping)
+                                      for _ in range(self.workers)))
+        logger.info("%d workers ready: %s", len(set(pids)), sorted(set(pids)))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    # ---------- 任务调度 ----------
+
+    def _admit(self, count):
+        """为 count 个任务占用排队名额，队列已满时拒绝整个请求"""
+        if self.waiting + count > self.max_queue + max(0, self.concurrency - self.running):
+            raise HTTPError(503, "队列已满，请稍后重试")
+        self.waiting += count
+
+    async def _run(self, options, structured=False, **source):
+        start = time.perf_counter()
+        started = False
+        try:
+            async with self._slots:
+                self.waiting -= 1
+                started = True
+                self.running += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    record = await loop.run_in_executor(
+                        self.executor, ocr_job, options, source.get("data"),
+                        source.get("path"), source.get("page"), structured)
+                finally:
+                    self.running -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+        record["latency"] = round(time.perf_counter() - start, 3)
+        self.latencies.append(record["latency"])
+        self.requests[record["status"]] += 1
+        self.registry.add(record.pop("profile"))
+        return record
+
+    def _options(self, query):
+        options = dict(self.defaults)
+        if "lang" in query:
+            options["lang"] = query["lang"][-1]
+        if "denoise" in query:
+            if query["denoise"][-1] not in preprocessor.DENOISE_METHODS:
+                raise HTTPError(400, f"未知的去噪方式: {query['denoise'][-1]}")
+            options["denoise"] = query["denoise"][-1]
+        if "psm" in query:
+            try:
+                options["psm"] = ocr.parse_psm(query["psm"][-1])
+            except ValueError:
+                raise HTTPError(400, "psm 应为整数或 auto")
+        if "skip_non_text" in query:
+            options["skip_non_text"] = query["skip_non_text"][-1] in ("1", "true")
+        return options
+
+    def _resolve(self, path):
+        if not isinstance(path, str) or not path:
+            raise HTTPError(400, "path 应为非空字符串")
+        if self.root is None:
+            return os.path.abspath(path)
+        full = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise HTTPError(400, f"路径不在允许的目录内: {path}")
+        return full
+
+    async def _expand(self, items):
+        """JSON 请求中的条目展开为 [(路径, 页码), ...]"""
+        loop = asyncio.get_running_loop()
+        sources = []
+        for item in items:
+            if isinstance(item, dict):
+                path, page = self._resolve(item.get("path")), item.get("page")
+                if page is not None and (not isinstance(page, int) or page < 1):
+                    raise HTTPError(400, "page 应为从1开始的整数")
+            else:
+                path, page = self._resolve(item), None
+            if page is None and ingest.is_document(path):
+                try:
+                    count = await loop.run_in_executor(None, ingest.page_count, path)
+                except Exception as e:
+                    raise HTTPError(400, f"{path}: {e}")
+                sources.extend((path, p) for p in range(1, count + 1))
+            else:
+                sources.append((path, page))
+        return sources
+
+    async def handle_ocr(self, query, headers, body):
+        options = self._options(query)
+        structured = query.get("structured", ["0"])[-1] in ("1", "true")
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "请求体不是合法的 JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "JSON 请求体应为对象")
+            if "paths" in payload:
+                if not isinstance(payload["paths"], list):
+                    raise HTTPError(400, "paths 应为列表")
+                sources = await self._expand(payload["paths"])
+                single = False
+            else:
+                sources = await self._expand([{"path": payload.get("path"),
+                                               "page": payload.get("page")}])
+                single = len(sources) == 1
+            self._admit(len(sources))
+            records = await asyncio.gather(*(self._run(options, structured, path=path, page=page)
+                                             for path, page in sources))
+            return records[0] if single else {"results": records}
+
+        if not body:
+            raise HTTPError(400, "请求体为空")
+        self._admit(1)
+        return await self._run(options, structured, data=body)
+
+    def health(self):
+        latencies = sorted(self.latencies)
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "queue_depth": self.waiting,
+            "in_flight": self.running,
+            "max_queue": self.max_queue,
+            "requests": dict(self.requests),
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+        }
+
+    def metrics(self):
+        data = self.health()
+        lines = [
+            "# HELP ocr_server_queue_depth Images waiting for a worker.",
+            "# TYPE ocr_server_queue_depth gauge",
+            f"ocr_server_queue_depth {data['queue_depth']}",
+            "# HELP ocr_server_in_flight Images being processed.",
+            "# TYPE ocr_server_in_flight gauge",
+            f"ocr_server_in_flight {data['in_flight']}",
+            "# HELP ocr_server_requests_total Images processed by result status.",
+            "# TYPE ocr_server_requests_total counter",
+        ]
+        for status in ("ok", "error"):
+            lines.append(f'ocr_server_requests_total{{status="{status}"}} {self.requests[status]}')
+        lines += [
+            "# HELP ocr_server_latency_seconds Queue + processing latency (last 1000 images).",
+            "# TYPE ocr_server_latency_seconds summary",
+        ]
+        for q, key in ((0.5, "latency_p50"), (0.95, "latency_p95")):
+            if data[key] is not None:
+                lines.append(f'ocr_server_latency_seconds{{quantile="{q}"}} {data[key]}')
+        lines.append(f"ocr_server_latency_seconds_sum {round(sum(self.latencies), 6)}")
+        lines.append(f"ocr_server_latency_seconds_count {len(self.latencies)}")
+        return "\n".join(lines) + "\n" + self.registry.to_prometheus()
+
+    # ---------- HTTP ----------
+
+    async def dispatch(self, method, target, headers, body):
+        """返回 (状态码, 响应体对象或文本)"""
+        url = urlsplit(target)
+        if url.path == "/ocr":
+            if method != "POST":
+                raise HTTPError(405, "请使用 POST")
+            return 200, await self.handle_ocr(parse_qs(url.query), headers, body)
+        if url.path == "/health":
+            return 200, self.health()
+        if url.path == "/metrics":
+            return 200, self.metrics()
+        raise HTTPError(404, f"未知路径: {url.path}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                method, target, headers, body = await asyncio.wait_for(
+                    _read_request(reader), READ_TIMEOUT)
+                status, payload = await self.dispatch(method, target, headers, body)
+            except HTTPError as e:
+                status, payload = e.status, {"error": str(e)}
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                return
+            except Exception as e:
+                logger.exception("request failed")
+                status, payload = 500, {"error": str(e)}
+            await _write_response(writer, status, payload)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        await self.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info("listening on http://%s:%d", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(q / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        raise asyncio.IncompleteReadError(b"", None)
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "无效的请求行")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "无效的 Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+async def _write_response(writer, status, payload):
+    if isinstance(payload, str):
+        data = payload.encode("utf-8")
+        content_type = "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        content_type = "application/json; charset=utf-8"
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            "Connection: close"]
+    if status == 503:
+        head.append("Retry-After: 1")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 HTTP OCR 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8080, help="监听端口")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数，默认全部核心")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="同时识别的图像数，默认等于工作进程数")
+    parser.add_argument("--max-queue", type=int, default=32, help="排队图像数上限，超过时返回 503")
+    parser.add_argument("--lang", default="chi_sim+eng", help="默认 tesseract 语言，可用 auto / auto:osd 自动选择")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"],
+                        help="OCR 引擎，auto 优先使用 tesserocr")
+    parser.add_argument("--denoise", default="nlm", choices=preprocessor.DENOISE_METHODS,
+                        help="默认去噪方式")
+    parser.add_argument("--cache-dir", help="结果缓存目录")
+    parser.add_argument("--root", help="JSON 请求中的路径必须位于该目录下")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试日志")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format=batch.LOG_FORMAT)
+    server = OCRServer(workers=args.workers, concurrency=args.concurrency,
+                       max_queue=args.max_queue, lang=args.lang, engine=args.engine,
+                       denoise=args.denoise, cache_dir=args.cache_dir, root=args.root)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# tiling.py
+"""
+超大图像（A0 图纸、长收据、拼接全景）的分块处理，峰值内存由分块大小而不是整图大小决定
+
+    processed = preprocessor.preprocess_image_from_array(img, tile=2048)
+    texts = ocr.run_ocr(processed, tile=2048)
+
+预处理：倾斜角和字高在缩小的整页副本上估计一次，之后每块独立完成缩放、去噪、旋转和二值化，
+    每块向外多取 MARGIN 像素作为滤波窗口的上下文，只写回中心部分，拼接处与整页处理一致。
+    去噪等耗内存的步骤只作用于单个分块，整页只保留灰度图和输出的二值图。
+文本块检测：相邻分块重叠 OVERLAP 像素，各块并行检测后换算到整页坐标，
+    跨越接缝的块在重叠区相交，合并为一个块，重叠区中被两侧重复检测到的块也随之合并，
+    每段文字只会被识别一次。合并后过高的块在行间空白处切开，单次送入 tesseract 的区域不超过分块大小。
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from . import instrument
+from . import preprocessor
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 2048
+OVERLAP = 256
+# 预处理时每块向外扩展的像素数，需大于去噪搜索窗口和自适应阈值窗口的半径
+MARGIN = 32
+SKEW_MAX_SIDE = 2048
+CLEAN_SIGMA = 2.0
+# 块的边界离分块边缘不超过该像素数时视为被分块截断
+EDGE_TOL = 2
+
+
+def tile_grid(height, width, tile=TILE_SIZE, overlap=0):
+    """
+    把 height x width 的区域切成边长不超过 tile 的分块，相邻分块重叠 overlap 像素
+    :return: [(x0, y0, x1, y1), ...]，按行优先排列
+    """
+    step = max(1, tile - overlap)
+
+    xs = range(0, max(1, width - overlap), step)
+    ys = range(0, max(1, height - overlap), step)
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in ys for x in xs]
+
+
+def _map(matrix, points):
+    pts = np.hstack([np.asarray(points, dtype=np.float64), np.ones((len(points), 1))])
+    return pts @ matrix.T
+
+
+# ---------- 预处理 ----------
+
+def _page_scale(gray):
+    """与 preprocessor.normalize_scale 相同的缩放比例，只估计不缩放"""
+    height = preprocessor.estimate_text_height(gray)
+    if height is None or height <= preprocessor.TARGET_TEXT_HEIGHT * preprocessor.MAX_TEXT_SCALE:
+        return 1.0
+    return preprocessor.TARGET_TEXT_HEIGHT / height
+
+
+def _page_transform(gray, scale):
+    """在缩小的副本上估计倾斜角，返回 (原图 -> 输出的 2x3 矩阵, 输出尺寸)"""
+    h, w = gray.shape
+    out_h, out_w = int(round(h * scale)), int(round(w * scale))
+    scaling = np.array([[scale, 0.0, 0.0], [0.0, scale, 0.0]])
+
+    # 倾斜角与分辨率无关，在缩小后的副本上估计，中值滤波代替完整的去噪
+    factor = min(1.0, SKEW_MAX_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    angle = preprocessor.estimate_skew(cv2.medianBlur(small, 3))
+    if angle is None or abs(angle) < 0.5 or min(out_h, out_w) < 50:
+        return scaling, (out_w, out_h)
+
+    logger.debug("rotated: %.2f", angle)
+    rotation, size = preprocessor.rotation_matrix(out_h, out_w, angle)
+    return np.hstack([rotation[:, :2] @ scaling[:, :2], rotation[:, 2:]]), size
+
+
+def _resolve_denoise(gray, method):
+    """auto 按整页中心一块的噪声估计一次，所有分块使用相同的去噪方式，避免拼接处效果不一致"""
+    if method != "auto":
+        return method
+    h, w = gray.shape
+    y0, x0 = max(0, h // 2 - TILE_SIZE // 2), max(0, w // 2 - TILE_SIZE // 2)
+    sample = gray[y0:y0 + TILE_SIZE, x0:x0 + TILE_SIZE]
+    return "none" if preprocessor.estimate_noise(sample) < CLEAN_SIGMA else "nlm"
+
+
+def _preprocess_tile(gray, out, box, scale, matrix, inverse, denoise):
+    """处理输出图像中的一块 box=(x0, y0, x1, y1)，结果写入 out 的对应位置"""
+    x0, y0, x1, y1 = box
+    ex0, ey0 = max(0, x0 - MARGIN), max(0, y0 - MARGIN)
+    ex1, ey1 = min(out.shape[1], x1 + MARGIN), min(out.shape[0], y1 + MARGIN)
+
+    # 扩展后的分块在原图中对应的区域
+    corners = _map(inverse, [(ex0, ey0), (ex1, ey0), (ex0, ey1), (ex1, ey1)])
+    pad = 2 / scale
+    sx0, sy0 = (max(0, int(np.floor(v - pad))) for v in corners.min(axis=0))
+    sx1 = min(gray.shape[1], int(np.ceil(corners[:, 0].max() + pad)))
+    sy1 = min(gray.shape[0], int(np.ceil(corners[:, 1].max() + pad)))
+    if sx1 <= sx0 or sy1 <= sy0:
+        out[y0:y1, x0:x1] = 255
+        return
+
+    crop = gray[sy0:sy1, sx0:sx1]
+    fx = fy = 1.0
+    if scale != 1.0:
+        size = (max(1, int(round(crop.shape[1] * scale))), max(1, int(round(crop.shape[0] * scale))))
+        fx, fy = size[0] / crop.shape[1], size[1] / crop.shape[0]
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+    crop = preprocessor.denoise_before(crop, method=denoise)
+
+    # 缩放后的裁剪图坐标 -> 原图坐标（按像素中心对齐）-> 扩展分块坐标
+    to_source = np.array([[1 / fx, 0.0, sx0 + 0.5 / fx - 0.5],
+                          [0.0, 1 / fy, sy0 + 0.5 / fy - 0.5],
+                          [0.0, 0.0, 1.0]])
+    local = matrix @ to_source
+    local[:, 2] -= (ex0, ey0)
+    warped = cv2.warpAffine(crop, local, (ex1 - ex0, ey1 - ey0), borderValue=255)
+    binary = preprocessor.after_rotation(warped)
+    out[y0:y1, x0:x1] = binary[y0 - ey0:y1 - ey0, x0 - ex0:x1 - ex0]
+
+
+def preprocess_tiled(img_array, denoise="nlm", tile=TILE_SIZE, max_workers=None, on_stage=None,
+                     return_transform=False, normalize=True):
+    """
+    分块版本的 preprocessor.preprocess_image_from_array，参数和返回值相同
+    :param tile: 分块边长（输出图像上的像素）
+    :param max_workers: 并行处理的分块数，默认等于CPU核数；峰值内存约为 分块数 x 单块的去噪开销
+    """
+    def stage(name):
+        if on_stage is not None:
+            on_stage(name)
+        return instrument.stage(name)
+
+    with stage("gray"):
+        gray = img_array if img_array.ndim == 2 else cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+        # 均值在缩小的副本上计算，和整页处理一样统一为白底黑字
+        probe = cv2.resize(gray, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA) \
+            if gray.size > 4 * TILE_SIZE * TILE_SIZE else gray
+        if np.mean(probe) < 127:
+            gray = cv2.bitwise_not(gray)
+
+    with stage("scale"):
+        scale = _page_scale(gray) if normalize else 1.0
+
+    with stage("rotation"):
+        matrix, (out_w, out_h) = _page_transform(gray, scale)
+        inverse = np.linalg.inv(np.vstack([matrix, [0.0, 0.0, 1.0]]))[:2]
+        method = _resolve_denoise(gray, denoise)
+
+    with stage("threshold"):
+        out = np.empty((out_h, out_w), dtype=np.uint8)
+        boxes = tile_grid(out_h, out_w, tile)
+        logger.debug("preprocess %dx%d in %d tiles", out_w, out_h, len(boxes))
+        workers = min(max_workers or os.cpu_count() or 1, len(boxes))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 各分块写入 out 中互不重叠的区域，不需要加锁
+            list(executor.map(lambda box: _preprocess_tile(gray, out, box, scale, matrix,
+                                                           inverse, method), boxes))
+
+    if return_transform:
+        return out, matrix
+    return out
+
+
+# ---------- 文本块检测 ----------
+
+def _sweep_groups(boxes, joined):
+    """
+    按左边界排序后扫描，只比较右边界还没有越过当前块左边界的块，joined(i, j) 为真的相交块归为一组
+    :return: [[块序号, ...], ...]
+    """
+    order = sorted(range(len(boxes)), key=lambda i: boxes[i][0])
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    active = []
+    for i in order:
+        x, y, w, h = boxes[i]
+        active = [j for j in active if boxes[j][0] + boxes[j][2] > x]
+        for j in active:
+            _, oy, _, oh = boxes[j]
+            if y < oy + oh and oy < y + h and find(i) != find(j) and joined(i, j):
+                parent[find(i)] = find(j)
+        active.append(i)
+
+    groups = {}
+    for i in order:
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _bounding(boxes):
+    x0 = min(b[0] for b in boxes)
+    y0 = min(b[1] for b in boxes)
+    x1 = max(b[0] + b[2] for b in boxes)
+    y1 = max(b[1] + b[3] for b in boxes)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _extent(block, tile, page, axis):
+    """
+    块在一个方向上的范围 (lo, hi, lo 被截断, hi 被截断)；
+    落在分块边缘（不是整页边缘）上的一侧是被截断的，真实的边界在分块之外
+    """
+    lo, hi = block[axis], block[axis] + block[axis + 2]
+    lo_cut = lo - tile[axis] <= EDGE_TOL and tile[axis] > 0
+    hi_cut = tile[axis + 2] - hi <= EDGE_TOL and tile[axis + 2] < page[axis]
+    return lo, hi, lo_cut, hi_cut
+
+
+def _same_text(a, ta, b, tb, page):
+    """
+    两个分块中相交的块是否为同一段文字：两个方向上，两块都未被截断的边界必须接近（相差不超过较短一块的一半），
+    只有一块被截断的一侧，另一块的边界不能落在被截断的块以内（容差相同）；
+    相邻两栏中一栏被接缝截断、与另一栏相交时，另一栏未截断的左边界与这一栏的左边界相差很远，不会合并
+    """
+    for axis in (0, 1):
+        a_lo, a_hi, a_lo_cut, a_hi_cut = _extent(a, ta, page, axis)
+        b_lo, b_hi, b_lo_cut, b_hi_cut = _extent(b, tb, page, axis)
+        slack = 0.5 * min(a_hi - a_lo, b_hi - b_lo)
+        if not a_lo_cut and not b_lo_cut and abs(a_lo - b_lo) > slack:
+            return False
+        # 被截断的一侧真实边界在分块之外，另一块的边界不能在它以内
+        if a_lo_cut and not b_lo_cut and b_lo > a_lo + slack:
+            return False
+        if b_lo_cut and not a_lo_cut and a_lo > b_lo + slack:
+            return False
+        if not a_hi_cut and not b_hi_cut and abs(a_hi - b_hi) > slack:
+            return False
+        if a_hi_cut and not b_hi_cut and b_hi < a_hi - slack:
+            return False
+        if b_hi_cut and not a_hi_cut and a_hi < b_hi - slack:
+            return False
+    return True
+
+
+def merge_blocks(tile_blocks, tiles):
+    """
+    合并各分块检测出的文本块
+    :param tile_blocks: 每个分块的块列表（整页坐标）
+    :param tiles: 与 tile_blocks 对应的分块 [(x0, y0, x1, y1), ...]，见 tile_grid
+    :return: 合并后的块：
+             1. 不同分块中相交、且是同一段文字（见 _same_text）的块合并为外接框，跨接缝的块由此拼回；
+             2. 合并后的外接框若与其他块大部分重叠（相交面积超过较小一块的一半，如重叠区中重复检测的块），
+                再合并，重复直到不再变化。只是边缘擦到的相邻栏不合并，避免多栏连成一个整页宽的块
+    """
+    page = (max(t[2] for t in tiles), max(t[3] for t in tiles))
+    items = [(tuple(block), tiles[t]) for t, group in enumerate(tile_blocks) for block in group]
+    boxes = [block for block, _ in items]
+
+    def continues(i, j):
+        (a, ta), (b, tb) = items[i], items[j]
+        return ta != tb and _same_text(a, ta, b, tb, page)
+
+    blocks = [_bounding([boxes[i] for i in group]) for group in _sweep_groups(boxes, continues)]
+
+    def overlapped(i, j):
+        a, b = blocks[i], blocks[j]
+        w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+        h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+        return w * h * 2 > min(a[2] * a[3], b[2] * b[3])
+
+    while True:
+        groups = _sweep_groups(blocks, overlapped)
+        if len(groups) == len(blocks):
+            return sorted(blocks)
+        blocks = [_bounding([blocks[i] for i in group]) for group in groups]
+
+
+def split_tall_blocks(img, blocks, max_h=TILE_SIZE):
+    """
+    把高于 max_h 的块在行间空白处切成几段：每段在 [0.75, 1] x max_h 范围内选墨迹最少的一行切开
+    :return: 切分后的块，同一块的各段按从上到下的顺序相邻排列
+    """
+    result = []
+    for x, y, w, h in blocks:
+        if h <= max_h:
+            result.append((x, y, w, h))
+            continue
+        ink = np.count_nonzero(img[y:y+h, x:x+w] < 128, axis=1)
+        top = 0
+        while h - top > max_h:
+            lo, hi = top + int(max_h * 0.75), top + max_h
+            cut = lo + int(np.argmin(ink[lo:hi]))
+            result.append((x, y + top, w, cut - top))
+            top = cut
+        result.append((x, y + top, w, h - top))
+    return result
+
+
+def detect_blocks(img, tile=TILE_SIZE, overlap=OVERLAP, max_workers=None):
+    """
+    分块并行检测文本块，代替整页的 ocr.detect_layout
+    :param img: 预处理后的二值图
+    :param tile: 分块边长，至少为列最小高度的两倍（字高 16 像素时为 400），否则抛出 ValueError
+    :return: [(x, y, w, h), ...]，从左到右、从上到下排列
+    """
+    from . import ocr  # ocr 导入了本模块，这里延迟导入避免循环
+
+    # 字高在整页上统计一次，各分块使用相同的尺寸阈值。
+    # 重叠不小于列的最小高度：被接缝截断、在一侧分块中过矮而被丢弃的部分，一定完整地落在另一侧分块中
+    text_h = preprocessor.estimate_text_height(img) or ocr.DEFAULT_TEXT_HEIGHT
+    min_overlap = int(np.ceil(ocr.COLUMN_MIN_SIZE[0] * text_h))
+    if min_overlap > tile // 2:
+        raise ValueError(f"分块边长 {tile} 过小：字高 {text_h:g} 像素时至少需要 {2 * min_overlap}")
+    overlap = min(tile // 2, max(overlap, min_overlap))
+    boxes = tile_grid(img.shape[0], img.shape[1], tile, overlap)
+
+    def detect(box, mode):
+        x0, y0, x1, y1 = box
+        _, blocks, _ = ocr.detect_layout(img[y0:y1, x0:x1], text_h=text_h, mode=mode)
+        return [(x + x0, y + y0, w, h) for x, y, w, h in blocks]
+
+    # 与 detect_layout 一样按整页选择检测方式：任一分块检测到列时整页按列，否则按行
+    workers = min(max_workers or os.cpu_count() or 1, len(boxes))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tile_blocks = list(executor.map(lambda box: detect(box, "column"), boxes))
+        if not any(tile_blocks):
+            tile_blocks = list(executor.map(lambda box: detect(box, "line"), boxes))
+    blocks = split_tall_blocks(img, merge_blocks(tile_blocks, boxes), max_h=tile)
+    logger.debug("tiles: %d, blocks: %d", len(boxes), len(blocks))
+    return blocks
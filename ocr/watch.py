@@ -0,0 +1,496 @@
+# watch.py
+"""
+监视目录，自动识别新放入的图像（扫描仪输出到共享目录等场景）：
+    python -m ocr.watch 扫描目录 -o 输出目录 -j 4
+    python -m ocr.watch 扫描目录 --poll --interval 5      # 网络共享上 inotify 收不到其他机器的写入，改用轮询
+    python -m ocr.watch 扫描目录 --once                   # 处理完现有文件后退出
+    python -m ocr.watch --db ocr_queue.sqlite --status    # 查看队列和失败的文件
+    python -m ocr.watch --db ocr_queue.sqlite --retry-dead
+
+新文件先写入 SQLite 任务队列再处理，进程退出或崩溃后重新启动会接着处理未完成的任务。
+识别失败（图像无法解码、tesseract 出错等）的任务按指数退避重试，超过次数后标记为 dead，不再阻塞队列。
+未指定输出目录时，结果写在源文件旁边（scan.jpg -> scan.txt）。
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+from . import batch
+from . import document
+from . import ocr
+from . import preprocessor
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    rel_name TEXT NOT NULL,
+    page INTEGER,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    output TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+-- 普通图片的 page 为 NULL，NULL 在 UNIQUE 约束中互不相等，这里换成 0 参与去重
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_file ON jobs (path, IFNULL(page, 0), size, mtime);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, next_attempt);
+"""
+
+
+class JobQueue:
+    def __init__(self, db_path, max_attempts=3, retry_delay=30.0):
+        """
+        :param db_path: SQLite 数据库文件
+        :param max_attempts: 每个任务最多尝试的次数，之后标记为 dead
+        :param retry_delay: 第一次重试前等待的秒数，之后每次加倍
+        """
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, path, rel_name, page, size, mtime, status=PENDING, error=None):
+        """加入任务；同一文件（路径、页码、大小、修改时间都相同）只加入一次，返回是否为新任务"""
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (path, rel_name, page, size, mtime, status, error,"
+                " created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, rel_name, page, size, mtime, status, error, now, now))
+        return cursor.rowcount > 0
+
+    def recover(self):
+        """上次退出时仍在处理的任务重新放回队列"""
+        with self.conn:
+            cursor = self.conn.execute("UPDATE jobs SET status = ? WHERE status = ?",
+                                       (PENDING, RUNNING))
+        return cursor.rowcount
+
+    def claim(self, limit):
+        """取出最多 limit 个到期的任务并标记为处理中"""
+        now = time.time()
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (PENDING, now, limit)).fetchall()
+            self.conn.executemany("UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                                  [(RUNNING, now, row["id"]) for row in rows])
+        return rows
+
+    def claim_job(self, job_id):
+        """取出指定的待处理任务并标记为处理中，任务已不在队列中时返回 None"""
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                                       (RUNNING, now, job_id, PENDING))
+            if cursor.rowcount == 0:
+                return None
+            return self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def release(self, job_id):
+        """把处理中的任务放回队列，不计入尝试次数"""
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                              (PENDING, time.time(), job_id))
+
+    def complete(self, job_id, output=None):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, output = ?, error = NULL, updated = ?"
+                              " WHERE id = ?", (DONE, output, time.time(), job_id))
+
+    def fail(self, job_id, error):
+        """记录一次失败：未超过次数时延后重试，否则标记为 dead；返回新状态"""
+        now = time.time()
+        with self.conn:
+            attempts = self.conn.execute("SELECT attempts FROM jobs WHERE id = ?",
+                                         (job_id,)).fetchone()["attempts"] + 1
+            status = DEAD if attempts >= self.max_attempts else PENDING
+            next_attempt = now + self.retry_delay * 2 ** (attempts - 1)
+            self.conn.execute("UPDATE jobs SET status = ?, attempts = ?, next_attempt = ?,"
+                              " error = ?, updated = ? WHERE id = ?",
+                              (status, attempts, next_attempt, error, now, job_id))
+        return status
+
+    def retry_dead(self):
+        """把 dead 任务重新放回队列，重新计算尝试次数"""
+        with self.conn:
+            cursor = self.conn.execute("UPDATE jobs SET status = ?, attempts = 0, next_attempt = 0"
+                                       " WHERE status = ?", (PENDING, DEAD))
+        return cursor.rowcount
+
+    def counts(self):
+        rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    def dead(self):
+        return self.conn.execute("SELECT path, page, attempts, error FROM jobs WHERE status = ?"
+                                 " ORDER BY id", (DEAD,)).fetchall()
+
+    def has_pending(self):
+        row = self.conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (PENDING,)).fetchone()
+        return row is not None
+
+    def next_due(self):
+        """最早到期的待处理任务的时间，没有时为 None"""
+        row = self.conn.execute("SELECT MIN(next_attempt) AS t FROM jobs WHERE status = ?",
+                                (PENDING,)).fetchone()
+        return row["t"]
+
+
+# ---------- 目录监视 ----------
+
+def _is_image(name):
+    return name.lower().endswith(batch.IMAGE_EXTS)
+
+
+class PollingWatcher:
+    def __init__(self, dirs, recursive=False, settle=2.0):
+        """
+        定期扫描目录，文件大小和修改时间在两次扫描之间不再变化、且已有 settle 秒未修改时才认为写入完成
+        """
+        self.dirs = dirs
+        self.recursive = recursive
+        self.settle = settle
+        self._last = {}
+        self._emitted = {}
+
+    def scan(self):
+        """返回写入完成的新文件 [(路径, 相对名, 大小, 修改时间), ...]"""
+        ready = []
+        now = time.time()
+        current = {}
+        for path, rel_name in batch.collect_inputs(self.dirs, recursive=self.recursive):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime)
+            current[path] = key
+            if self._last.get(path) != key or now - st.st_mtime < self.settle:
+                continue
+            if self._emitted.get(path) != key:
+                self._emitted[path] = key
+                ready.append((path, rel_name) + key)
+        self._last = current
+        return ready
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        return self.scan()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """用 inotify 接收写入完成（CLOSE_WRITE）和移入（MOVED_TO）事件，需要 inotify_simple"""
+
+    def __init__(self, dirs, recursive=False):
+        self.recursive = recursive
+        self.inotify = INotify()
+        self._watches = {}
+        for root in dirs:
+            self._add(root, root)
+
+    def _add(self, path, root):
+        mask = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+        if self.recursive:
+            mask |= inotify_flags.CREATE
+        wd = self.inotify.add_watch(path, mask)
+        self._watches[wd] = (path, root)
+        if self.recursive:
+            for name in os.listdir(path):
+                sub = os.path.join(path, name)
+                if os.path.isdir(sub):
+                    self._add(sub, root)
+
+    def changes(self, timeout):
+        ready = []
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.wd not in self._watches or not event.name:
+                continue
+            parent, root = self._watches[event.wd]
+            path = os.path.join(parent, event.name)
+            if event.mask & inotify_flags.ISDIR:
+                if self.recursive and os.path.isdir(path):
+                    self._add(path, root)
+                continue
+            # CREATE 只用于发现新的子目录，文件要等写入完成
+            if not event.mask & (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO):
+                continue
+            if not _is_image(event.name):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ready.append((os.path.abspath(path), os.path.relpath(path, root),
+                          st.st_size, st.st_mtime))
+        return ready
+
+    def close(self):
+        self.inotify.close()
+
+
+def make_watcher(dirs, recursive=False, poll=False, settle=2.0):
+    """优先使用 inotify；未安装 inotify_simple、不是 Linux 或指定 poll 时轮询"""
+    if not poll and INotify is not None:
+        try:
+            return InotifyWatcher(dirs, recursive=recursive)
+        except OSError as e:
+            logger.warning("inotify unavailable (%s), falling back to polling", e)
+    return PollingWatcher(dirs, recursive=recursive, settle=settle)
+
+
+# ---------- 处理 ----------
+
+def enqueue_file(queue, path, rel_name, size, mtime):
+    """加入一个文件；多页文档每页一个任务，读不出页数的文档直接标记为 dead"""
+    tasks, failed = batch.expand_pages([(path, rel_name)])
+    added = 0
+    for task_path, task_rel, page in tasks:
+        added += queue.enqueue(task_path, task_rel, page, size, mtime)
+    for task_path, error in failed:
+        if queue.enqueue(task_path, rel_name, None, size, mtime, status=DEAD, error=error):
+            logger.error("%s: %s", task_path, error)
+    return added
+
+
+def write_result(record, row, output_dir=None, fmt="txt"):
+    """写出识别结果，返回输出路径；未指定输出目录时写在源文件旁边"""
+    if output_dir:
+        out_path = batch.output_path_for(output_dir, row["rel_name"], row["page"], fmt)
+    else:
+        out_path = batch.output_path_for(os.path.dirname(row["path"]),
+                                         os.path.basename(row["path"]), row["page"], fmt)
+    if fmt == "txt":
+        text = "\n\n".join(record["blocks"])
+    else:
+        text = document.export(record["document"], fmt, os.path.basename(row["path"]))
+    batch._write_text_atomic(out_path, text)
+    return out_path
+
+
+def run_watch(dirs, db_path, output_dir=None, workers=None, recursive=False, poll=False,
+              interval=2.0, settle=2.0, max_attempts=3, retry_delay=30.0, once=False,
+              fmt="txt", cache_dir=None, **options):
+    """
+    监视目录并处理新文件，直到被中断（once=True 时处理完现有文件后返回）
+    :param dirs: 监视的目录列表
+    :param db_path: 任务队列的 SQLite 文件
+    :param output_dir: 输出目录，None 表示写在源文件旁边
+    :param poll: 强制使用轮询，见 make_watcher
+    :param interval: 轮询间隔（秒）
+    :param settle: 轮询时文件多久未修改才视为写入完成（秒）
+    :param max_attempts, retry_delay: 失败重试，见 JobQueue
+    :param fmt: 输出格式，见 document.FORMATS
+    :param options: 传给 pipeline.process_array 的参数（lang、engine、denoise、psm 等）
+    :return: 队列各状态的任务数
+    """
+    queue = JobQueue(db_path, max_attempts=max_attempts, retry_delay=retry_delay)
+    recovered = queue.recover()
+    if recovered:
+        logger.info("%d interrupted jobs requeued", recovered)
+
+    # 先开始监视再扫描已有文件：启动前刚写完、或扫描期间写完的文件不会漏掉
+    watcher = None if once else make_watcher(dirs, recursive=recursive, poll=poll, settle=settle)
+    if watcher is not None:
+        logger.info("watching %s (%s)", ", ".join(dirs), type(watcher).__name__)
+
+    # 启动前已经存在的文件；队列按 (路径, 页码, 大小, 修改时间) 去重，已处理过的不会重复加入。
+    # inotify 下全部加入，仍在写入的文件写完后以新的大小和修改时间再次加入；
+    # 轮询时可能仍在写入的文件留给监视器，稳定后再加入
+    wait_settle = isinstance(watcher, PollingWatcher)
+    for path, rel_name in batch.collect_inputs(dirs, recursive=recursive):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # 扫描期间被删除或移走
+        if not wait_settle or time.time() - st.st_mtime >= settle:
+            enqueue_file(queue, path, rel_name, st.st_size, st.st_mtime)
+
+    options = dict(options)
+    options.setdefault("max_workers", 1)
+    workers = workers or os.cpu_count() or 1
+
+    def make_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=batch._init_worker,
+                                   initargs=(cache_dir, logging.getLogger().level))
+
+    def submit(row):
+        future = executor.submit(batch.process_one, row["path"], row["page"], options,
+                                 False, fmt != "txt")
+        in_flight[future] = row
+
+    executor = make_pool()
+    in_flight = {}
+    # 进程崩溃时同时在处理的任务：不知道是哪一个导致的，逐个单独重新处理，
+    # 单独处理时仍然崩溃的任务才计一次失败，其他文件不会被连累成 dead
+    suspects = []
+    try:
+        while True:
+            if suspects:
+                if not in_flight:
+                    row = queue.claim_job(suspects.pop(0))
+                    if row is not None:
+                        submit(row)
+            else:
+                for row in queue.claim(workers * 2 - len(in_flight)):
+                    submit(row)
+
+            if once and not in_flight and not suspects and not queue.has_pending():
+                break
+
+            if in_flight:
+                completed, _ = wait(in_flight, timeout=interval if watcher is None else 0.2,
+                                    return_when=FIRST_COMPLETED)
+            else:
+                completed = ()
+                if watcher is None:
+                    # 只剩等待重试的任务
+                    time.sleep(max(0.0, min(interval, (queue.next_due() or 0) - time.time())))
+
+            broken = False
+            crashed = []
+            alone = len(in_flight) == 1
+            for future in completed:
+                row = in_flight.pop(future)
+                where = row["path"] if row["page"] is None else f"{row['path']}#{row['page']}"
+                try:
+                    record = future.result()
+                except BrokenProcessPool as e:
+                    # 工作进程崩溃（如内存耗尽）：只有单独处理时崩溃才算该任务失败
+                    broken = True
+                    if not alone:
+                        crashed.append(row)
+                        continue
+                    record = {"status": "error", "error": f"worker crashed: {e}"}
+                if record["status"] == "ok":
+                    try:
+                        out_path = write_result(record, row, output_dir, fmt)
+                    except OSError as e:
+                        record = {"status": "error", "error": str(e)}
+                    else:
+                        queue.complete(row["id"], out_path)
+                        logger.info("%s -> %s (%ss)", where, out_path, record["seconds"])
+                        continue
+                status = queue.fail(row["id"], record["error"])
+                log = logger.error if status == DEAD else logger.warning
+                log("%s: %s (%s)", where, record["error"], status)
+            if broken:
+                # 进程池损坏后其余任务也都会失败，一起放回队列，不计入尝试次数
+                for row in crashed + list(in_flight.values()):
+                    queue.release(row["id"])
+                    suspects.append(row["id"])
+                if suspects:
+                    logger.warning("worker crashed, retrying %d jobs one at a time", len(suspects))
+                in_flight.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = make_pool()
+
+            if watcher is not None:
+                timeout = 0 if in_flight else interval
+                for path, rel_name, size, mtime in watcher.changes(timeout):
+                    if enqueue_file(queue, path, rel_name, size, mtime):
+                        logger.info("queued %s", path)
+    finally:
+        # 中断时未完成的任务保持 running，下次启动时由 recover 放回队列
+        executor.shutdown(wait=False, cancel_futures=True)
+        if watcher is not None:
+            watcher.close()
+        counts = queue.counts()
+        queue.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监视目录并自动识别新放入的图像")
+    parser.add_argument("dirs", nargs="*", help="监视的目录")
+    parser.add_argument("-o", "--output-dir", help="输出目录，默认写在源文件旁边")
+    parser.add_argument("--db", default="ocr_queue.sqlite", help="任务队列的 SQLite 文件")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="并行进程数，默认全部核心")
+    parser.add_argument("-r", "--recursive", action="store_true", help="同时监视子目录")
+    parser.add_argument("--poll", action="store_true", help="轮询目录而不是使用 inotify（网络共享）")
+    parser.add_argument("--interval", type=float, default=2.0, help="轮询间隔（秒）")
+    parser.add_argument("--settle", type=float, default=2.0, help="轮询时文件多久未修改视为写入完成（秒）")
+    parser.add_argument("--retries", type=int, default=3, help="每个文件最多尝试的次数")
+    parser.add_argument("--retry-delay", type=float, default=30.0, help="第一次重试前等待的秒数，之后每次加倍")
+    parser.add_argument("--once", action="store_true", help="处理完现有文件后退出")
+    parser.add_argument("--status", action="store_true", help="显示队列状态和失败的文件后退出")
+    parser.add_argument("--retry-dead", action="store_true", help="把失败的文件重新放回队列")
+    parser.add_argument("--lang", default="chi_sim+eng", help="tesseract 语言，可用 auto / auto:osd 自动选择")
+    parser.add_argument("--psm", type=ocr.parse_psm, default=3, help="tesseract --psm，auto 按文本块形状选择")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"],
+                        help="OCR 引擎")
+    parser.add_argument("--denoise", default="nlm", choices=preprocessor.DENOISE_METHODS,
+                        help="去噪方式")
+    parser.add_argument("--reuse-buffers", action="store_true",
+                        help="预处理的中间结果写入每个进程常驻的缓冲区，降低每页的内存峰值")
+    parser.add_argument("--skip-non-text", action="store_true",
+                        help="空白隔页、照片、条码等非文本页面不做预处理和识别，输出为空")
+    parser.add_argument("--cache-dir", help="结果缓存目录")
+    parser.add_argument("--format", default="txt", choices=document.FORMATS, help="输出格式")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试日志")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format=batch.LOG_FORMAT)
+
+    if args.status or args.retry_dead:
+        queue = JobQueue(args.db)
+        if args.retry_dead:
+            logger.info("%d dead jobs requeued", queue.retry_dead())
+        if args.status:
+            print(queue.counts())
+            for row in queue.dead():
+                where = row["path"] if row["page"] is None else f"{row['path']}#{row['page']}"
+                print(f"{where}\t{row['attempts']}\t{row['error']}")
+        queue.close()
+        return 0
+
+    if not args.dirs:
+        parser.error("需要指定监视的目录")
+    try:
+        counts = run_watch(args.dirs, args.db, output_dir=args.output_dir, workers=args.workers,
+                           recursive=args.recursive, poll=args.poll, interval=args.interval,
+                           settle=args.settle, max_attempts=args.retries,
+                           retry_delay=args.retry_delay, once=args.once, fmt=args.format,
+                           cache_dir=args.cache_dir, lang=args.lang, psm=args.psm,
+                           engine=args.engine, denoise=args.denoise, buffers=args.reuse_buffers,
+                           skip_non_text=args.skip_non_text)
+    except KeyboardInterrupt:
+        return 130
+    logger.info("done: %s", counts)
+    return 0 if not counts.get(DEAD) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# rectxt.py
+"""图形界面的启动脚本，也是 PyInstaller 打包的入口（见 ocr/main.spec），等同于 python -m ocr.main"""
+from ocr.main import main
+
+if __name__ == "__main__":
+    main()